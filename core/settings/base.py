@@ -0,0 +1,337 @@
+"""
+Django settings for core project: common base for the profiles in this package
+(prod, test, bench). Nothing here requires secrets or cloud credentials, so any
+profile can boot (and run manage.py) without them; prod requires them.
+
+Generated by 'django-admin startproject' using Django 5.2.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/5.2/ref/settings/
+"""
+
+from pathlib import Path
+from decouple import config
+import os
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+# SECRET_KEY lo define cada perfil (prod lo exige en el entorno)
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = config('DEBUG', default=False, cast=bool)
+
+ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='localhost').split(",")   
+
+AUTH_USER_MODEL = 'user_messages.CustomUser'
+
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+
+# Application definition
+
+INSTALLED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'rest_framework',
+    'user_messages',
+    'corsheaders',
+    'storages',
+]
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'user_messages.authentication.CachedJWTAuthentication',
+    ),
+    # Token bucket por usuario y tipo de endpoint (THROTTLE_RATES, user_messages/throttling.py)
+    'DEFAULT_THROTTLE_CLASSES': (
+        'user_messages.throttling.TokenBucketThrottle',
+    ),
+}
+
+# Límites: 'N/periodo' es un cubo de N peticiones que se rellena entero en ese periodo.
+# Los contadores van en la caché THROTTLE_CACHE_ALIAS (compartida entre workers con Redis)
+THROTTLE_ENABLED = config('THROTTLE_ENABLED', default=True, cast=bool)
+THROTTLE_CACHE_ALIAS = 'default'
+THROTTLE_RATES = {
+    'list': config('THROTTLE_RATE_LIST', default='120/min'),
+    'send': config('THROTTLE_RATE_SEND', default='30/min'),
+    'upload': config('THROTTLE_RATE_UPLOAD', default='20/min'),
+    'login': config('THROTTLE_RATE_LOGIN', default='10/min'),
+}
+
+# Los tokens llevan la token_version del usuario (claim 'ver') para poder revocarlos
+SIMPLE_JWT = {
+    'TOKEN_OBTAIN_SERIALIZER': 'user_messages.serializers.VersionedTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'user_messages.serializers.VersionedTokenRefreshSerializer',
+}
+
+# Paginación por cursor de los listados de mensajes
+API_PAGE_SIZE = config('API_PAGE_SIZE', default=50, cast=int)
+API_MAX_PAGE_SIZE = config('API_MAX_PAGE_SIZE', default=200, cast=int)
+
+# Envíos masivos: mensajes por INSERT dentro de la transacción
+BROADCAST_BATCH_SIZE = config('BROADCAST_BATCH_SIZE', default=500, cast=int)
+
+# Exportaciones del historial: mensajes por parte del archivo, filas por lectura de la base
+# de datos y tamaño a partir del cual la parte en curso pasa de memoria a disco
+EXPORT_PART_SIZE = config('EXPORT_PART_SIZE', default=50000, cast=int)
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)
+EXPORT_SPOOL_MAX_SIZE = config('EXPORT_SPOOL_MAX_SIZE', default=8 * 1024 * 1024, cast=int)
+# Validez (segundos) de las URLs firmadas de descarga; el cliente las pide de nuevo al caducar
+EXPORT_URL_EXPIRES = config('EXPORT_URL_EXPIRES', default=600, cast=int)
+
+# Retención (archive_messages / purge_orphaned_images): antigüedad a partir de la cual los
+# mensajes salen de la tabla caliente, mensajes por lote y antigüedad mínima de un objeto de
+# messages/ sin referencias para borrarlo (las subidas directas aún sin confirmar no se tocan)
+MESSAGE_RETENTION_DAYS = config('MESSAGE_RETENTION_DAYS', default=365, cast=int)
+MESSAGE_ARCHIVE_BATCH_SIZE = config('MESSAGE_ARCHIVE_BATCH_SIZE', default=1000, cast=int)
+ORPHAN_IMAGE_GRACE_SECONDS = config('ORPHAN_IMAGE_GRACE_SECONDS', default=86400, cast=int)
+
+# Directorio de usuarios: longitud mínima para buscar por subcadena y nº de contactos recientes
+DIRECTORY_SUBSTRING_MIN_LENGTH = config('DIRECTORY_SUBSTRING_MIN_LENGTH', default=3, cast=int)
+DIRECTORY_RECENT_CONTACTS = config('DIRECTORY_RECENT_CONTACTS', default=20, cast=int)
+
+# Sincronización incremental: margen para no adelantar el token a transacciones aún sin confirmar
+SYNC_SETTLE_SECONDS = config('SYNC_SETTLE_SECONDS', default=2, cast=int)
+
+MIDDLEWARE = [
+    'user_messages.middleware.MetricsMiddleware',
+    'user_messages.middleware.QueryTimingMiddleware',
+    'user_messages.middleware.RateLimitHeadersMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+# Métricas por vista en GET /metrics (formato Prometheus); METRICS_TOKEN protege el endpoint
+# (sin él solo responde con DEBUG)
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+# Directorio compartido por los workers de gunicorn (lo fija gunicorn.conf.py); vacío: cada
+# proceso sirve solo sus métricas
+METRICS_DIR = config('METRICS_DIR', default='')
+METRICS_FLUSH_SECONDS = config('METRICS_FLUSH_SECONDS', default=5, cast=float)
+
+# Logs estructurados (clave=valor) a stdout; LOG_LEVEL=DEBUG para ver los de depuración
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'logfmt': {
+            '()': 'user_messages.logfmt.LogfmtFormatter',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'stream': 'ext://sys.stdout',
+            'formatter': 'logfmt',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': LOG_LEVEL,
+    },
+}
+
+# Cabeceras de límites legibles desde el frontend
+CORS_EXPOSE_HEADERS = ['X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Reset', 'Retry-After']
+
+CORS_ALLOWED_ORIGINS = [
+    'https://smspy-frontend-pre.onrender.com'
+]
+
+ROOT_URLCONF = 'core.urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = 'core.wsgi.application'
+
+# Procesado de imágenes subidas (user_messages/images.py): formato 'webp' o 'jpeg'
+IMAGE_OUTPUT_FORMAT = config('IMAGE_OUTPUT_FORMAT', default='webp')
+IMAGE_QUALITY = config('IMAGE_QUALITY', default=80, cast=int)
+IMAGE_MAX_PIXELS = config('IMAGE_MAX_PIXELS', default=40_000_000, cast=int)
+IMAGE_MAX_DIMENSION = {'message': 2048, 'avatar': 512}
+IMAGE_THUMBNAIL_SIZES = {'message': [320], 'avatar': [40, 128]}
+
+# Cola de trabajos en segundo plano (python manage.py run_jobs)
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=5, cast=int)
+JOB_RETRY_BASE_SECONDS = config('JOB_RETRY_BASE_SECONDS', default=10, cast=int)
+JOB_RETRY_MAX_SECONDS = config('JOB_RETRY_MAX_SECONDS', default=3600, cast=int)
+JOB_LOCK_TIMEOUT = config('JOB_LOCK_TIMEOUT', default=600, cast=int)
+
+# Entrega en tiempo real por WebSocket (core/asgi.py).
+# InMemoryBroker solo sirve con un único proceso ASGI; con varios usar
+# 'user_messages.realtime.RedisBroker' y REDIS_URL (lo que hace core.settings.prod).
+REALTIME_BROKER = config('REALTIME_BROKER', default='user_messages.realtime.InMemoryBroker')
+REALTIME_REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+
+
+# Database
+# https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+
+# Conexiones a Postgres (remoto, con TLS). Con DB_POOL cada proceso mantiene un pool
+# de psycopg 3 y las peticiones no pagan el handshake TCP+TLS+auth; sin él, conexiones
+# persistentes (DB_CONN_MAX_AGE). En ambos casos se comprueba la conexión antes de reutilizarla.
+DB_POOL = config('DB_POOL', default=True, cast=bool)
+# Límite por consulta (milisegundos) solo para los procesos web: gunicorn.conf.py lo fija.
+# migrate, los backfill, archive_messages y run_jobs corren sin límite (0).
+DB_STATEMENT_TIMEOUT_MS = config('DB_STATEMENT_TIMEOUT_MS', default=0, cast=int)
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': config('DB_NAME', default=''),
+        'USER': config('DB_USER', default=''),
+        'PASSWORD': config('DB_PASSWORD', default=''),
+        'HOST': config('DB_HOST', default=''),
+        'PORT': config('DB_PORT', default='5432'),
+        # El pool no admite conexiones persistentes: las gestiona él
+        'CONN_MAX_AGE': 0 if DB_POOL else config('DB_CONN_MAX_AGE', default=600, cast=int),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'sslmode': 'require',
+        },
+    }
+}
+
+if DB_STATEMENT_TIMEOUT_MS:
+    # Corta consultas descontroladas en el servidor
+    DATABASES['default']['OPTIONS']['options'] = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+
+if DB_POOL:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+        'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+        # Segundos esperando una conexión libre antes de fallar
+        'timeout': config('DB_POOL_TIMEOUT', default=10, cast=float),
+        # Renovar conexiones inactivas o muy antiguas (el proveedor corta las ociosas)
+        'max_idle': config('DB_POOL_MAX_IDLE', default=300, cast=float),
+        'max_lifetime': config('DB_POOL_MAX_LIFETIME', default=1800, cast=float),
+    }
+
+
+# Caché (locmem por defecto; compartida con p. ej.
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache y CACHE_LOCATION=redis://...)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='smspy'),
+    }
+}
+
+# Perfiles de usuario cacheados (user_messages/profiles.py)
+PROFILE_CACHE_ALIAS = 'default'
+PROFILE_CACHE_TIMEOUT = config('PROFILE_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Identidad de usuario cacheada para la autenticación JWT (user_messages/identity.py);
+# un cambio en la cuenta la invalida al momento, el TTL acota lo que no pasa por save()
+IDENTITY_CACHE_ALIAS = 'default'
+IDENTITY_CACHE_TIMEOUT = config('IDENTITY_CACHE_TIMEOUT', default=60, cast=int)
+
+
+# Password validation
+# https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/5.2/topics/i18n/
+
+LANGUAGE_CODE = 'en-us'
+
+TIME_ZONE = 'Europe/Madrid'
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/5.2/howto/static-files/
+
+STATIC_URL = 'static/'
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# AWS S3 Config (sin claves, boto3 usa su cadena de credenciales: variables, rol IAM...)
+AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID', default=None)
+AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY', default=None)
+AWS_STORAGE_BUCKET_NAME = config('AWS_STORAGE_BUCKET_NAME', default='smspy-local')
+AWS_S3_REGION_NAME = 'eu-central-1'
+AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.eu-central-1.amazonaws.com'
+
+# Media files
+#DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+#DEFAULT_FILE_STORAGE = 'user_messages.storages_backends.MediaStorage'
+MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/'
+AWS_S3_FILE_OVERWRITE = False
+AWS_DEFAULT_ACL = None
+
+# Cliente S3 compartido por proceso (user_messages/storage.py)
+AWS_S3_CLIENT_CONFIG = {
+    'max_pool_connections': config('AWS_S3_MAX_POOL_CONNECTIONS', default=10, cast=int),
+    'connect_timeout': config('AWS_S3_CONNECT_TIMEOUT', default=5, cast=int),
+    'read_timeout': config('AWS_S3_READ_TIMEOUT', default=30, cast=int),
+    'retries': {
+        'max_attempts': config('AWS_S3_MAX_ATTEMPTS', default=3, cast=int),
+        'mode': 'standard',
+    },
+    'tcp_keepalive': True,
+}
+
+# Subidas directas a S3 con URL firmada (user_messages/uploads.py)
+UPLOAD_URL_EXPIRES = config('UPLOAD_URL_EXPIRES', default=300, cast=int)
+UPLOAD_MESSAGE_IMAGE_MAX_BYTES = config('UPLOAD_MESSAGE_IMAGE_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+UPLOAD_AVATAR_MAX_BYTES = config('UPLOAD_AVATAR_MAX_BYTES', default=5 * 1024 * 1024, cast=int)
@@ -0,0 +1,22 @@
+# Benchmarks (benchmark_api, benchmark_asgi, benchmark_db_pool, benchmark_startup):
+# configuración de producción sin secretos. Con DB_* mide contra ese Postgres; sin ellas, SQLite.
+# S3 se sustituye por el cliente en memoria, así que no hacen falta credenciales.
+from decouple import config
+
+from .base import *  # noqa: F401,F403
+from .base import BASE_DIR, DATABASES, LOGGING
+
+SECRET_KEY = config('SECRET_KEY', default='bench-insecure-secret-key')
+DEBUG = False
+
+if not DATABASES['default']['NAME']:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'bench.sqlite3',
+        }
+    }
+
+# Los logs por petición falsean las medidas y ensucian la salida
+LOG_LEVEL = config('LOG_LEVEL', default='WARNING')
+LOGGING['root']['level'] = LOG_LEVEL
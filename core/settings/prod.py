@@ -0,0 +1,41 @@
+# Producción (render.yaml): lo mismo que base, pero sin valores por defecto para los
+# secretos ni para la base de datos y el bucket; si falta alguno no arranca.
+from decouple import config
+
+from .base import *  # noqa: F401,F403
+from .base import CACHES, DATABASES, REST_FRAMEWORK
+
+SECRET_KEY = config('SECRET_KEY')
+DEBUG = config('DEBUG', cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN')
+
+DATABASES['default'].update(
+    NAME=config('DB_NAME'),
+    USER=config('DB_USER'),
+    PASSWORD=config('DB_PASSWORD'),
+    HOST=config('DB_HOST'),
+)
+
+AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID')
+AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY')
+AWS_STORAGE_BUCKET_NAME = config('AWS_STORAGE_BUCKET_NAME')
+AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.eu-central-1.amazonaws.com'
+MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/'
+
+# Detrás del proxy de Render: la IP del cliente es la que él añade al final de
+# X-Forwarded-For. Sin esto DRF usa la primera, que elige el cliente, y las peticiones
+# anónimas (login, registro) podrían cambiar de cubo en cada intento.
+REST_FRAMEWORK['NUM_PROXIES'] = config('NUM_PROXIES', default=1, cast=int)
+
+# Varios procesos (workers de gunicorn y run_jobs) comparten la caché: un perfil o una
+# identidad invalidada en uno no puede seguir sirviéndose desde otro
+REDIS_URL = config('REDIS_URL')
+CACHES['default'] = {
+    'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.redis.RedisCache'),
+    'LOCATION': config('CACHE_LOCATION', default=REDIS_URL),
+}
+
+# Eventos en tiempo real entre procesos: un mensaje enviado en un worker debe llegar a los
+# WebSocket abiertos en cualquier otro (InMemoryBroker solo sirve con un proceso)
+REALTIME_BROKER = config('REALTIME_BROKER', default='user_messages.realtime.RedisBroker')
+REALTIME_REDIS_URL = REDIS_URL
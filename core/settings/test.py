@@ -0,0 +1,16 @@
+# Tests: python manage.py test --settings=core.settings.test
+# SQLite en memoria y ningún secreto ni credencial; los tests sustituyen el cliente S3.
+from .base import *  # noqa: F401,F403
+
+SECRET_KEY = 'test-insecure-secret-key'
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+# Los tests crean muchos usuarios: un hash de contraseña rápido
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+from rest_framework.settings import api_settings
+
+
+def warm_up():
+    # Proceso maestro de gunicorn con preload_app (gunicorn.conf.py): carga lo que cada worker
+    # cargaría en su primera petición (URLconf y vistas, clases de DRF y el SDK de S3). Los
+    # workers lo heredan al hacer fork y arrancan sin repetir imports.
+    from user_messages import storage
+
+    get_resolver().url_patterns
+    for name in ('DEFAULT_AUTHENTICATION_CLASSES', 'DEFAULT_PERMISSION_CLASSES', 'DEFAULT_THROTTLE_CLASSES',
+                 'DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES'):
+        getattr(api_settings, name)
+    storage.preload()
+    # Nada abierto antes del fork: cada worker crea sus conexiones
+    connections.close_all()
+
+
+def after_fork():
+    # Clientes por proceso (sockets, pools, hilos): si algo los creó en el maestro, el
+    # worker crea los suyos
+    from user_messages import metrics, realtime, storage
+
+    storage.set_client(None)
+    realtime.set_broker(None)
+    # Lo que el maestro hubiera medido no es de este worker
+    metrics.reset()
+    if settings.METRICS_DIR:
+        metrics.start_flusher(settings.METRICS_FLUSH_SECONDS)
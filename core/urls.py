@@ -19,10 +19,12 @@ from django.urls import path, include
 
 from django.conf import settings
 from django.conf.urls.static import static
+from user_messages.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('user_messages.urls')), #ruta base de la app
+    path('metrics', metrics_view, name='metrics'), # métricas para Prometheus
 ]
 
 # TODO REVISAR SI ES NECESARIO
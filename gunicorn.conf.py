@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+
+# Configuración de gunicorn; se lee sola desde el directorio de trabajo (render.yaml).
+# Con preload_app la aplicación se importa una vez en el maestro y los workers se crean con
+# fork: subir o reponer un worker no repite el arranque de Django (benchmark_startup lo mide).
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+# Las peticiones no deben bloquear una conexión más de 5 s; se fija aquí, antes de cargar
+# los settings, para que migrate y los comandos de mantenimiento no hereden el límite
+os.environ.setdefault('DB_STATEMENT_TIMEOUT_MS', '5000')
+
+# Los workers vuelcan aquí sus métricas y GET /metrics suma las de todos (user_messages/metrics.py)
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'smspy-metrics'))
+
+
+def on_starting(server):
+    # Un maestro nuevo empieza de cero: los volcados de la ejecución anterior no cuentan
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from core.startup import warm_up
+        warm_up()
+
+
+def post_fork(server, worker):
+    from core.startup import after_fork
+    after_fork()
+
+
+def worker_exit(server, worker):
+    # Lo medido desde el último volcado periódico
+    from user_messages import metrics
+    metrics.flush()
@@ -0,0 +1,156 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException, NotAuthenticated, Throttled
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .authentication import CachedJWTAuthentication
+from .models import CustomUser, Message, PARTICIPANT_FIELDS
+from .pagination import MessageCursorPagination
+from .serializers import MessageRowSerializer, UserSerializer
+from .throttling import check_rate, view_scope
+from .uploads import UploadError, aconfirm_upload
+from .views import create_message, set_avatar_file, set_uploaded_avatar, upload_message_image
+
+# Versiones async de los endpoints que más esperan a S3 y a la base de datos.
+# Se sirven con el perfil ASGI (core/asgi.py + uvicorn, ver render.yaml): mientras una
+# petición espera, el worker atiende otras. Responden lo mismo que las vistas DRF.
+
+
+def json_response(data, status=200):
+    # Mismo renderizado que las respuestas de DRF
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def _authenticate(request):
+    result = CachedJWTAuthentication().authenticate(request)
+    if result is None:
+        raise NotAuthenticated()
+    return result[0]
+
+
+def _admit(request, scope):
+    # (usuario, decisión del límite): la autenticación y el cubo de throttling leen la base
+    # de datos y la caché con las APIs síncronas, así que van juntos en un único hilo
+    user = _authenticate(request)
+    return user, check_rate(scope, f'user:{user.pk}')
+
+
+def _request_data(request):
+    # (datos, archivos) del cuerpo JSON o de formulario; datos None si el JSON no es válido
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}'), {}
+        except ValueError:
+            return None, {}
+    if request.method != 'POST' and request.content_type == 'multipart/form-data':
+        # Django solo procesa el cuerpo multipart en POST
+        return request.parse_file_upload(request.META, request)
+    return request.POST, request.FILES
+
+
+class AsyncAPIView(View):
+    # Autenticación JWT y errores con el mismo formato que las vistas DRF
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Autenticación por token: sin CSRF, igual que APIView
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    throttle_scope = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            # Mismos cubos que la vista DRF equivalente, fuera del bucle de eventos
+            request.user, request.rate_limit = await sync_to_async(_admit)(request, view_scope(self, request.method))
+            if request.rate_limit is not None and not request.rate_limit.allowed:
+                raise Throttled(request.rate_limit.retry_after)
+        except APIException as e:
+            data = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+            response = json_response(data, status=e.status_code)
+            if getattr(e, 'wait', None):
+                response['Retry-After'] = str(e.wait)
+            return response
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncMessageListView(AsyncAPIView):
+    # GET: como MessageListCreateView
+    throttle_scope = 'list'
+
+    async def get(self, request):
+        paginator = MessageCursorPagination()
+        branches = [branch.rows() for branch in Message.objects.timeline_branches(request.user)]
+        page = await paginator.apaginate_queryset(branches, Request(request), self)
+        # El serializador lee la caché de perfiles, que es síncrona
+        data = await sync_to_async(lambda: MessageRowSerializer(page, context={'request': request}).data)()
+        return json_response(paginator.get_paginated_data(data))
+
+
+class AsyncSendMessageView(AsyncAPIView):
+    # POST: como SendMessageView
+    throttle_scope = 'send'
+
+    async def post(self, request):
+        data, files = _request_data(request)
+        if data is None:
+            return json_response({"error": "JSON inválido"}, status=400)
+        receiver_id = data.get('receiver')
+        content = data.get('content')
+        if not receiver_id or not content:
+            return json_response({"error": "Campos 'receiver' y 'content' son obligatorios"}, status=400)
+        try:
+            receiver = await CustomUser.objects.only(*PARTICIPANT_FIELDS).aget(id=receiver_id)
+        except CustomUser.DoesNotExist:
+            return json_response({"error": "El receptor no existe"}, status=404)
+
+        image_s3_key = None
+        image_key = data.get('image_key')
+        image_file = files.get('image')
+        if image_key:
+            try:
+                image_s3_key = await aconfirm_upload('message', request.user, image_key)
+            except UploadError as e:
+                return json_response({"error": str(e)}, status=400)
+        elif image_file:
+            image_s3_key = await sync_to_async(upload_message_image)(image_file)
+        # La transacción completa corre en un único hilo
+        message = await sync_to_async(create_message)(request, request.user, receiver, content, image_s3_key)
+        return json_response({
+            "message": "Mensaje enviado correctamente",
+            "data": message
+        }, status=201)
+
+
+class AsyncProfileView(AsyncAPIView):
+    # GET y PUT: como ProfileView
+    throttle_scope = {'PUT': 'upload'}
+
+    async def get(self, request):
+        data = await sync_to_async(lambda: UserSerializer(request.user, context={'request': request}).data)()
+        return json_response(data)
+
+    async def put(self, request):
+        data, files = _request_data(request)
+        if data is None:
+            return json_response({"error": "JSON inválido"}, status=400)
+        user = request.user
+        avatar_key = data.get('avatar_key')
+        avatar_file = files.get('avatar')
+        if avatar_key:
+            try:
+                await aconfirm_upload('avatar', user, avatar_key)
+            except UploadError as e:
+                return json_response({"error": str(e)}, status=400)
+            await sync_to_async(set_uploaded_avatar)(user, avatar_key)
+        elif avatar_file:
+            await sync_to_async(set_avatar_file)(user, avatar_file)
+        data = await sync_to_async(lambda: UserSerializer(user, context={'request': request}).data)()
+        return json_response({
+            "message": "Perfil actualizado correctamente",
+            "data": data
+        })
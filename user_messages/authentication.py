@@ -0,0 +1,28 @@
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .identity import build_user, get_identity, token_is_current
+
+
+def user_for_token(validated_token):
+    # Usuario del token a partir de la identidad cacheada; sin consultas en el caso habitual
+    try:
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise InvalidToken("El token no identifica a ningún usuario")
+    record = get_identity(user_id)
+    if record is None:
+        raise AuthenticationFailed("Usuario no encontrado", code='user_not_found')
+    if not record['is_active']:
+        raise AuthenticationFailed("El usuario está inactivo", code='user_inactive')
+    if not token_is_current(validated_token, record):
+        # Contraseña cambiada o cuenta desactivada después de emitir el token
+        raise AuthenticationFailed("El token ha sido revocado", code='token_revoked')
+    return build_user(record)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # Como JWTAuthentication, pero sin leer la fila del usuario en cada petición
+    def get_user(self, validated_token):
+        return user_for_token(validated_token)
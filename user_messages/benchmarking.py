@@ -0,0 +1,247 @@
+import asyncio
+import http.client
+import io
+import math
+import random
+import re
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.test.utils import override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from .models import CustomUser, Message, normalize_search
+
+# Utilidades compartidas por los comandos de benchmark (manage.py benchmark_*):
+# peticiones en proceso contra core.wsgi / core.asgi sin servidor HTTP de por medio,
+# o contra un servidor HTTP local (http_server) para medir también el transporte.
+
+BENCH_PASSWORD = 'bench-secret123'
+
+# "db;dur=1.23;desc=\"4 queries\"" de QueryTimingMiddleware
+_SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+@contextmanager
+def test_database():
+    # Base de datos desechable (test_<nombre>) con el mismo motor y opciones que la real.
+    # Límites de peticiones altísimos: el throttling se ejecuta (y se mide) pero no rechaza.
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        with override_settings(THROTTLE_RATES={scope: '1000000/s' for scope in settings.THROTTLE_RATES}):
+            yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def server_timing_queries(header):
+    # Número de consultas SQL de la cabecera Server-Timing (None si no viene)
+    match = _SERVER_TIMING_QUERIES.search(header or '')
+    return int(match.group(1)) if match else None
+
+
+def seed_dataset(users, messages, skew=1.1, seed=0):
+    # N usuarios y M mensajes repartidos con una distribución de Zipf: el usuario i
+    # participa con peso 1/(i+1)^skew, así unos pocos concentran la mayoría del tráfico
+    rng = random.Random(seed)
+    password = make_password(BENCH_PASSWORD)
+    created = CustomUser.objects.bulk_create(
+        CustomUser(
+            username=f'bench{i:05d}',
+            email=f'bench{i:05d}@example.com',
+            username_search=f'bench{i:05d}',
+            email_search=normalize_search(f'bench{i:05d}@example.com'),
+            password=password,
+        )
+        for i in range(users)
+    )
+    # bulk_create no devuelve ids en todos los motores
+    user_ids = list(CustomUser.objects.filter(username__in=[user.username for user in created]).order_by('username').values_list('id', flat=True))
+    weights = [1 / (rank + 1) ** skew for rank in range(users)]
+    batch = []
+    for i in range(messages):
+        sender, receiver = rng.choices(user_ids, weights, k=2)
+        while receiver == sender:
+            receiver = rng.choices(user_ids, weights)[0]
+        batch.append(Message(sender_id=sender, receiver_id=receiver, content=f'mensaje de prueba {i}'))
+        if len(batch) >= 1000:
+            Message.objects.bulk_create(batch)
+            batch = []
+    Message.objects.bulk_create(batch)
+    return {'user_ids': user_ids, 'weights': weights}
+
+
+def wsgi_request(method, path, body=b'', token=None, query_string=''):
+    # Una petición a core.wsgi; devuelve (segundos, status, consultas SQL)
+    from core.wsgi import application
+
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query_string,
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'testserver',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.url_scheme': 'http',
+        'wsgi.errors': io.StringIO(),
+    }
+    if token:
+        environ['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    statuses = []
+    started = time.perf_counter()
+    response = application(environ, lambda status, headers: statuses.append((status, dict(headers))))
+    try:
+        b''.join(response)
+    finally:
+        response.close()
+    status, headers = statuses[0]
+    return time.perf_counter() - started, int(status.split()[0]), server_timing_queries(headers.get('Server-Timing'))
+
+
+@contextmanager
+def http_server():
+    # Servidor HTTP local (el de runserver, multihilo) sobre core.wsgi; devuelve su URL
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+    from core.wsgi import application
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler, allow_reuse_address=False)
+    server.set_app(application)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def http_request(base_url, method, path, body=b'', token=None, query_string=''):
+    # Una petición HTTP real al servidor local; devuelve (segundos, status, consultas SQL)
+    url = urlsplit(base_url)
+    headers = {'Host': 'testserver', 'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    started = time.perf_counter()
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=60)
+    try:
+        connection.request(method, f'{path}?{query_string}' if query_string else path, body=body or None, headers=headers)
+        response = connection.getresponse()
+        response.read()
+    finally:
+        connection.close()
+    return time.perf_counter() - started, response.status, server_timing_queries(response.getheader('Server-Timing'))
+
+
+async def asgi_request(method, path, body=b'', token=None, query_string=''):
+    # Una petición HTTP a core.asgi; devuelve (segundos, status)
+    from core.asgi import application
+
+    headers = [
+        (b'host', b'testserver'),
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode()),
+    ]
+    if token:
+        headers.append((b'authorization', f'Bearer {token}'.encode()))
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query_string.encode(),
+        'root_path': '',
+        'headers': headers,
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 0),
+    }
+    events = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = []
+
+    async def receive():
+        if events:
+            return events.pop()
+        # Sin desconexión del cliente: Django cancela esta espera al terminar
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    started = time.perf_counter()
+    await application(scope, receive, send)
+    return time.perf_counter() - started, status[0]
+
+
+def percentile(values, fraction):
+    # Percentil por rango más cercano sobre una lista ya ordenada
+    return values[max(math.ceil(len(values) * fraction) - 1, 0)]
+
+
+def summary(results, elapsed):
+    # results: [(segundos, status[, consultas SQL])]
+    latencies = sorted(result[0] for result in results)
+    queries = [result[2] for result in results if len(result) > 2 and result[2] is not None]
+    return {
+        'requests': len(results),
+        'throughput': len(results) / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'errors': sum(1 for result in results if result[1] >= 400),
+        'queries': statistics.mean(queries) if queries else None,
+    }
+
+
+def compare_results(baseline, current, threshold):
+    # Regresiones de current frente a baseline (salidas JSON de benchmark_api):
+    # p95 o req/s peor que el umbral relativo, o más consultas SQL por petición
+    regressions = []
+    for mode, endpoints in current['results'].items():
+        for endpoint, result in endpoints.items():
+            before = baseline.get('results', {}).get(mode, {}).get(endpoint)
+            if before is None:
+                continue
+            name = f'{mode}/{endpoint}'
+            if result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                regressions.append(f"{name}: p95 {before['p95_ms']:.1f}ms -> {result['p95_ms']:.1f}ms")
+            if result['throughput'] < before['throughput'] / (1 + threshold):
+                regressions.append(f"{name}: {before['throughput']:.1f} -> {result['throughput']:.1f} req/s")
+            if before['queries'] is not None and result['queries'] is not None and result['queries'] > before['queries']:
+                regressions.append(f"{name}: {before['queries']:g} -> {result['queries']:g} consultas por petición")
+            if result['errors'] > before['errors']:
+                regressions.append(f"{name}: {before['errors']} -> {result['errors']} errores")
+    return regressions
+
+
+def compare_startup(baseline, current, threshold):
+    # Regresiones de arranque (salidas JSON de benchmark_startup): p50 peor que el umbral
+    # relativo, más módulos importados o el SDK de S3 cargado donde antes no lo estaba
+    regressions = []
+    for scenario, result in current['results']['startup'].items():
+        before = baseline.get('results', {}).get('startup', {}).get(scenario)
+        if before is None:
+            continue
+        if result['p50_ms'] > before['p50_ms'] * (1 + threshold):
+            regressions.append(f"{scenario}: p50 {before['p50_ms']:.1f}ms -> {result['p50_ms']:.1f}ms")
+        if result['modules'] > before['modules'] * (1 + threshold):
+            regressions.append(f"{scenario}: {before['modules']} -> {result['modules']} módulos")
+        if result['s3_sdk'] and not before['s3_sdk']:
+            regressions.append(f"{scenario}: ahora carga boto3/botocore al arrancar")
+    return regressions
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.db import transaction
+
+from .models import Conversation, CustomUser, Message, PARTICIPANT_FIELDS
+from .realtime import notify_new_message
+from .serializers import MessageSerializer
+
+
+def load_receivers(receiver_ids):
+    # Valida todos los receptores con una única consulta IN; {id: usuario}
+    return {user.id: user for user in CustomUser.objects.filter(id__in=receiver_ids).only(*PARTICIPANT_FIELDS)}
+
+
+def send_broadcast(sender, receivers, content, image_key=None, request=None):
+    # Un mensaje con el mismo contenido/imagen para cada receptor, en una transacción:
+    # bulk_create por lotes de BROADCAST_BATCH_SIZE y un resumen de conversaciones por lote.
+    # Devuelve la lista de mensajes creados (en el orden de `receivers`).
+    batch_size = settings.BROADCAST_BATCH_SIZE
+    created = []
+    with transaction.atomic():
+        for start in range(0, len(receivers), batch_size):
+            messages = Message.objects.bulk_create([
+                Message(sender=sender, receiver=receiver, content=content, image=image_key)
+                for receiver in receivers[start:start + batch_size]
+            ])
+            Conversation.objects.record_broadcast(sender, messages)
+            serializer = MessageSerializer(messages, many=True, context={'request': request})
+            for message, data in zip(messages, serializer.data):
+                notify_new_message(message, data)
+            created += messages
+    return created
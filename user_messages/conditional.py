@@ -0,0 +1,82 @@
+import hashlib
+
+from django.db.models import Max, OuterRef, Subquery, Sum
+from django.utils.cache import parse_etags, patch_cache_control, patch_vary_headers, quote_etag
+from rest_framework.response import Response
+
+from .models import Conversation, CustomUser, Message, MessageTombstone
+
+# GET condicional (ETag / If-None-Match) para los endpoints que los clientes sondean.
+# El ETag sale de marcas de agua baratas, calculadas antes que los datos: si coincide con
+# If-None-Match se responde 304 sin lanzar la consulta del listado ni serializar.
+
+
+class NotModified(Exception):
+    pass
+
+
+def _conversations(low, aggregate):
+    # `aggregate` sobre las conversaciones donde el usuario es `low`
+    return Subquery(
+        Conversation.objects.filter(**{low: OuterRef('id')}).values(low)
+        .annotate(total=aggregate).values('total')
+    )
+
+
+def message_watermark(user_id, role):
+    # (último updated_at, último borrado, versiones de los contactos, último archivado) de los
+    # mensajes con el usuario como 'sender' o 'receiver': una consulta con búsquedas en los
+    # índices (rol, updated_at), (rol, id) y los de Conversation. Las versiones solo suben, así
+    # que la suma cambia en cuanto uno de los perfiles que aparecen en los mensajes cambia.
+    latest = Message.objects.filter(**{role: OuterRef('id')}).order_by('-updated_at').values('updated_at')[:1]
+    deleted = MessageTombstone.objects.filter(**{f'{role}_id': OuterRef('id')}).order_by('-id').values('id')[:1]
+    row = CustomUser.objects.filter(id=user_id).values_list(
+        Subquery(latest), Subquery(deleted),
+        _conversations('user_low', Sum('user_high__profile_version')),
+        _conversations('user_high', Sum('user_low__profile_version')),
+        _conversations('user_low', Max('archived_at')), _conversations('user_high', Max('archived_at')),
+    ).first()
+    return row or (None,) * 6
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest())
+
+
+def etag_matches(etag, header):
+    # Comparación débil, como pide If-None-Match
+    etags = parse_etags(header or '')
+    return '*' in etags or etag.removeprefix('W/') in {tag.removeprefix('W/') for tag in etags}
+
+
+class ConditionalGetMixin:
+    # Las vistas definen get_etag_parts(request); el ETag añade usuario, host y URL completa.
+    # Se evalúa tras autenticación, permisos y throttling.
+    etag = None
+
+    def get_etag_parts(self, request):
+        raise NotImplementedError
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD'):
+            self.etag = make_etag(
+                type(self).__name__, request.user.pk, request.get_host(), request.get_full_path(),
+                *self.get_etag_parts(request),
+            )
+            if etag_matches(self.etag, request.META.get('HTTP_IF_NONE_MATCH')):
+                raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=304)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.etag and response.status_code in (200, 304):
+            response['ETag'] = self.etag
+            # Cada uso revalida; la respuesta depende del token del usuario
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ['Authorization'])
+        return response
@@ -0,0 +1,71 @@
+import asyncio
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from .authentication import CachedJWTAuthentication
+from .realtime import get_broker, user_channel
+
+MESSAGES_PATH = '/ws/messages/'
+
+# Códigos de cierre propios (rango 4000-4999 reservado a aplicaciones)
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_NOT_FOUND = 4404
+
+
+def _authenticate(raw_token):
+    # Mismo token de acceso SimpleJWT que usa la API REST
+    close_old_connections()
+    try:
+        authentication = CachedJWTAuthentication()
+        validated_token = authentication.get_validated_token(raw_token)
+        user = authentication.get_user(validated_token)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    finally:
+        close_old_connections()
+    return user if user.is_active else None
+
+
+async def websocket_application(scope, receive, send):
+    if scope['path'] != MESSAGES_PATH:
+        await receive()
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    await messages_socket(scope, receive, send)
+
+
+async def messages_socket(scope, receive, send):
+    # Entrega en tiempo real de los mensajes recibidos: ws(s)://host/ws/messages/?token=<access>
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    query = parse_qs(scope.get('query_string', b'').decode())
+    raw_token = (query.get('token') or [''])[0]
+    user = await sync_to_async(_authenticate)(raw_token) if raw_token else None
+    if user is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+
+    subscription = await get_broker().subscribe(user_channel(user.id))
+    await send({'type': 'websocket.accept'})
+
+    async def forward():
+        while True:
+            payload = await subscription.get()
+            await send({'type': 'websocket.send', 'text': payload})
+
+    forwarder = asyncio.create_task(forward())
+    try:
+        while True:
+            event = await receive()
+            if event['type'] == 'websocket.disconnect':
+                break
+            if event['type'] == 'websocket.receive' and event.get('text') == 'ping':
+                await send({'type': 'websocket.send', 'text': 'pong'})
+    finally:
+        forwarder.cancel()
+        await subscription.close()
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .models import Conversation, normalize_search
+
+User = get_user_model()
+
+DIRECTORY_ORDERING = ('username_search', 'id')
+SEARCH_ORDERING = ('match_rank', 'username_search', 'id')
+
+
+def directory_queryset(user):
+    # TODO ATENCION NOMBRE MODIFICABLE ADMIN
+    return User.objects.exclude(id=user.id).exclude(username='admin')
+
+
+def search_directory(user, query, fields):
+    # Devuelve (queryset, ordenación keyset). Sin búsqueda: orden alfabético.
+    # Con búsqueda: primero coincidencias por prefijo de username, luego de email
+    # y, desde DIRECTORY_SUBSTRING_MIN_LENGTH caracteres, por subcadena.
+    queryset = directory_queryset(user).only(*fields, 'username_search')
+    query = normalize_search(query).strip()
+    if not query:
+        return queryset, DIRECTORY_ORDERING
+
+    match = Q(username_search__startswith=query) | Q(email_search__startswith=query)
+    if len(query) >= settings.DIRECTORY_SUBSTRING_MIN_LENGTH:
+        match |= Q(username_search__contains=query) | Q(email_search__contains=query)
+    queryset = queryset.filter(match).annotate(match_rank=Case(
+        When(username_search__startswith=query, then=Value(0)),
+        When(email_search__startswith=query, then=Value(1)),
+        default=Value(2),
+        output_field=IntegerField(),
+    ))
+    return queryset, SEARCH_ORDERING
+
+
+def recent_contacts(user, limit):
+    # Contactos con los que se ha hablado más recientemente, a partir del
+    # resumen de conversaciones (una lectura por índice, acotada por limit)
+    conversations = Conversation.objects.for_user(user).order_by('-last_message_at', '-id')[:limit]
+    return [(conversation.counterpart(user), conversation.last_message_at) for conversation in conversations]
@@ -0,0 +1,231 @@
+import heapq
+import json
+import tempfile
+import zipfile
+from io import BytesIO, TextIOWrapper
+from itertools import islice
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import storage
+from .jobs import enqueue, heartbeat
+from .models import ArchivedMessage, CustomUser, Message, MessageExport
+
+# Exportación del historial de mensajes de un usuario a storage:
+#   exports/<usuario>/<exportación>-<token>/part-00001.jsonl (o .zip con messages.jsonl + images.txt)
+#   exports/<usuario>/<exportación>-<token>/manifest.json al terminar
+# Cada parte se lee con .iterator() y se escribe en un fichero temporal (a disco si crece),
+# así la memoria no depende del tamaño del historial. Tras subir cada parte se guarda el
+# punto de control; si el trabajo se corta, el reintento reescribe solo la parte en curso.
+# El historial incluye los mensajes de ArchivedMessage (conservan su id). Los archivados en
+# storage mezclan usuarios y no se leen: el manifiesto nombra esos archivos.
+
+CONTENT_TYPES = {MessageExport.JSONL: 'application/jsonl', MessageExport.ZIP: 'application/zip'}
+
+
+class ExportSuperseded(Exception):
+    # Otro worker ya guardó la parte que este estaba escribiendo
+    pass
+
+
+def active_export(user):
+    return MessageExport.objects.filter(user=user, status__in=[MessageExport.PENDING, MessageExport.RUNNING]).first()
+
+
+def start_export(user, export_format=MessageExport.JSONL):
+    # (exportación, creada): si ya hay una en marcha para el usuario se devuelve esa.
+    # Con dos POST a la vez la restricción export_one_active_per_user rechaza el segundo
+    # INSERT, que devuelve la exportación del primero.
+    active = active_export(user)
+    if active is not None:
+        return active, False
+    try:
+        with transaction.atomic():
+            export = MessageExport.objects.create(user=user, format=export_format)
+            enqueue('exports.run', {'export_id': export.id}, idempotency_key=job_key(export))
+    except IntegrityError:
+        return active_export(user), False
+    return export, True
+
+
+def job_key(export):
+    return f'export:{export.id}'
+
+
+def export_prefix(export):
+    # Las exportaciones anteriores al token siguen en exports/<usuario>/<exportación>/
+    folder = f'{export.id}-{export.token}' if export.token else export.id
+    return f'exports/{export.user_id}/{folder}/'
+
+
+def part_key(export, number):
+    return f'{export_prefix(export)}part-{number:05d}.{export.format}'
+
+
+def manifest_key(export):
+    return f'{export_prefix(export)}manifest.json'
+
+
+def part_keys(export):
+    return [part_key(export, number) for number in range(1, export.parts + 1)]
+
+
+def download_urls(export):
+    # URLs firmadas del manifiesto y las partes de una exportación terminada; caducan a los
+    # EXPORT_URL_EXPIRES segundos y se generan de nuevo en cada consulta del estado
+    if export.status != MessageExport.DONE:
+        return None
+    expires_in = settings.EXPORT_URL_EXPIRES
+    return {
+        'manifest': storage.presigned_get(manifest_key(export), expires_in),
+        'parts': [storage.presigned_get(key, expires_in) for key in part_keys(export)],
+    }
+
+
+def export_row(row):
+    return {
+        'id': row.id,
+        'sender': row.sender_id,
+        'sender_username': row.sender__username,
+        'receiver': row.receiver_id,
+        'receiver_username': row.receiver__username,
+        'content': row.content,
+        'image': row.image or None,
+        'sent_at': row.sent_at.isoformat(),
+        'delivered_at': row.delivered_at.isoformat() if row.delivered_at else None,
+        'read_at': row.read_at.isoformat() if row.read_at else None,
+    }
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def _write_lines(stream, rows, images):
+    # Una línea JSON por mensaje; devuelve (mensajes, último id)
+    text = TextIOWrapper(stream, encoding='utf-8', newline='\n')
+    count = 0
+    last_id = None
+    for row in rows:
+        text.write(_dumps(export_row(row)))
+        text.write('\n')
+        if row.image:
+            images.add(row.image)
+        count += 1
+        last_id = row.id
+    text.flush()
+    text.detach()
+    return count, last_id
+
+
+def _archived_rows(export):
+    # Los de ArchivedMessage con la forma de Message.rows(); los nombres de usuario se leen
+    # por bloques (los usuarios borrados quedan sin nombre)
+    rows = (
+        ArchivedMessage.objects.filter(Q(sender_id=export.user_id) | Q(receiver_id=export.user_id), id__gt=export.last_message_id)
+        .order_by('id')[:settings.EXPORT_PART_SIZE]
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    )
+    while chunk := list(islice(rows, settings.EXPORT_CHUNK_SIZE)):
+        usernames = dict(
+            CustomUser.objects.filter(id__in={row.sender_id for row in chunk} | {row.receiver_id for row in chunk})
+            .values_list('id', 'username')
+        )
+        for row in chunk:
+            yield SimpleNamespace(
+                id=row.id, sender_id=row.sender_id, sender__username=usernames.get(row.sender_id),
+                receiver_id=row.receiver_id, receiver__username=usernames.get(row.receiver_id),
+                content=row.content, image=row.image, sent_at=row.sent_at,
+                delivered_at=row.delivered_at, read_at=row.read_at,
+            )
+
+
+def _part_rows(export):
+    # Mensajes de la tabla y del archivo en orden de id desde el punto de control. La tabla se
+    # consulta primero: un mensaje archivado entretanto sale en la otra consulta, y si aparece
+    # en las dos se escribe una vez.
+    live = (
+        Message.objects.filter(Q(sender_id=export.user_id) | Q(receiver_id=export.user_id), id__gt=export.last_message_id)
+        .order_by('id')
+        .rows()[:settings.EXPORT_PART_SIZE]
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    )
+    last_id = None
+    for row in heapq.merge(live, _archived_rows(export), key=lambda row: row.id):
+        if row.id != last_id:
+            last_id = row.id
+            yield row
+
+
+def write_part(export):
+    # Escribe y sube la siguiente parte desde el punto de control; devuelve cuántos mensajes tenía
+    number = export.parts + 1
+    rows = islice(_part_rows(export), settings.EXPORT_PART_SIZE)
+    # Claves de imagen de la parte (acotadas por EXPORT_PART_SIZE)
+    images = set()
+    with tempfile.SpooledTemporaryFile(max_size=settings.EXPORT_SPOOL_MAX_SIZE) as spool:
+        if export.format == MessageExport.ZIP:
+            with zipfile.ZipFile(spool, 'w', zipfile.ZIP_DEFLATED) as archive:
+                with archive.open('messages.jsonl', 'w', force_zip64=True) as stream:
+                    count, last_id = _write_lines(stream, rows, images)
+                archive.writestr('images.txt', ''.join(f'{key}\n' for key in sorted(images)))
+        else:
+            count, last_id = _write_lines(spool, rows, images)
+        if not count:
+            return 0
+        spool.seek(0)
+        storage.upload_fileobj(spool, part_key(export, number), CONTENT_TYPES[export.format])
+
+    # Solo avanza el punto de control si nadie lo movió: un worker que siguiera con la
+    # exportación después de que claim la repartiera no cuenta dos veces los mensajes
+    updated = MessageExport.objects.filter(id=export.id, parts=number - 1).update(
+        last_message_id=last_id,
+        parts=number,
+        message_count=F('message_count') + count,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        raise ExportSuperseded(export.id)
+    export.last_message_id = last_id
+    export.parts = number
+    export.message_count += count
+    return count
+
+
+def write_manifest(export):
+    manifest = {
+        'export': export.id,
+        'user': export.user_id,
+        'format': export.format,
+        'messages': export.message_count,
+        'parts': part_keys(export),
+        # Archivos de mensajes archivados en storage (de todos los usuarios), no incluidos en las partes
+        'storage_archives': [item['Key'] for item in storage.list_objects('archive/messages/')],
+        'created_at': export.created_at.isoformat(),
+        'completed_at': export.completed_at.isoformat(),
+    }
+    storage.upload_fileobj(BytesIO(_dumps(manifest).encode()), manifest_key(export), 'application/json')
+
+
+def run_export(export_id):
+    # Ejecuta (o reanuda desde el punto de control) una exportación
+    export = MessageExport.objects.filter(id=export_id).first()
+    if export is None or export.status == MessageExport.DONE:
+        return export
+    MessageExport.objects.filter(id=export.id).update(status=MessageExport.RUNNING, updated_at=timezone.now())
+    try:
+        while write_part(export) == settings.EXPORT_PART_SIZE:
+            # Cada parte renueva el bloqueo del trabajo en la cola
+            heartbeat(job_key(export))
+    except ExportSuperseded:
+        # La terminará el worker que va por delante
+        return export
+    export.completed_at = timezone.now()
+    write_manifest(export)
+    export.status = MessageExport.DONE
+    export.save(update_fields=['status', 'completed_at', 'updated_at'])
+    return export
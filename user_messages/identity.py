@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+
+# Identidad cacheada para autenticar sin consultar la base de datos: lo que necesitan los
+# permisos y las vistas más frecuentes. El resto de columnas se cargan al usarse.
+CACHE_KEY = 'identity:v3:{}'
+IDENTITY_FIELDS = (
+    'id', 'username', 'email', 'first_name', 'last_name', 'avatar', 'avatar_processed',
+    'is_active', 'is_staff', 'is_superuser', 'token_version', 'profile_version',
+)
+# Claim del JWT con la token_version del usuario al emitirlo (ausente equivale a 0)
+TOKEN_VERSION_CLAIM = 'ver'
+
+
+def _cache():
+    return caches[settings.IDENTITY_CACHE_ALIAS]
+
+
+def get_identity(user_id):
+    # {campo: valor} de IDENTITY_FIELDS, o None si el usuario no existe
+    from .models import CustomUser
+
+    key = CACHE_KEY.format(user_id)
+    record = _cache().get(key)
+    if record is None:
+        values = CustomUser.objects.filter(id=user_id).values_list(*IDENTITY_FIELDS).first()
+        if values is None:
+            return None
+        record = dict(zip(IDENTITY_FIELDS, values))
+        _cache().set(key, record, settings.IDENTITY_CACHE_TIMEOUT)
+    return record
+
+
+def build_user(record):
+    # CustomUser con los campos de la identidad cargados y el resto diferidos
+    from .models import CustomUser
+
+    # from_db espera los valores en el orden de las columnas del modelo
+    field_names = [field.attname for field in CustomUser._meta.concrete_fields if field.attname in record]
+    return CustomUser.from_db(router.db_for_read(CustomUser), field_names, [record[name] for name in field_names])
+
+
+def token_is_current(validated_token, record):
+    return validated_token.get(TOKEN_VERSION_CLAIM, 0) == record['token_version']
+
+
+def invalidate_identity(user_id):
+    # Igual que invalidate_profile: ahora y otra vez tras el commit
+    key = CACHE_KEY.format(user_id)
+    _cache().delete(key)
+    transaction.on_commit(lambda: _cache().delete(key))
@@ -0,0 +1,86 @@
+import os
+import tempfile
+
+from django.conf import settings
+
+# Formato de salida -> (formato Pillow, extensión, content type)
+OUTPUT_FORMATS = {
+    'webp': ('WEBP', 'webp', 'image/webp'),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+}
+
+# Buffer en memoria antes de pasar a disco para cada imagen generada
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+
+class ImageProcessingError(Exception):
+    pass
+
+
+def output_format():
+    return OUTPUT_FORMATS[settings.IMAGE_OUTPUT_FORMAT]
+
+
+def processed_key(key):
+    # messages/1/abc.png -> messages/1/abc_png.webp. Con la extensión original: avatares
+    # antiguos como avatars/ana_yo.png y avatars/ana_yo.jpg no acaban en la misma clave
+    stem, extension = os.path.splitext(key)
+    return f"{stem}_{extension.lstrip('.').lower()}.{output_format()[1]}"
+
+
+def thumbnail_key(key, size):
+    # Clave determinista a partir de la imagen procesada: se puede calcular sin consultar nada
+    stem, _ = os.path.splitext(key)
+    return f"{stem}_{size}.{output_format()[1]}"
+
+
+def thumbnail_sizes(kind):
+    return settings.IMAGE_THUMBNAIL_SIZES[kind]
+
+
+def process_image(source, kind):
+    # Devuelve [(sufijo, archivo)] con la imagen reescalada sin EXIF y sus miniaturas.
+    # sufijo None es la imagen principal; cada archivo es un SpooledTemporaryFile.
+    # Pillow solo se carga en el worker de la cola, no al arrancar la web (models -> profiles -> images)
+    from PIL import Image, ImageOps
+
+    max_dimension = settings.IMAGE_MAX_DIMENSION[kind]
+    try:
+        with Image.open(source) as original:
+            if original.width * original.height > settings.IMAGE_MAX_PIXELS:
+                raise ImageProcessingError("La imagen es demasiado grande")
+            # En JPEG decodifica directamente a una escala reducida (1/2, 1/4, 1/8)
+            # en lugar de cargar la imagen completa en memoria.
+            original.draft('RGB', (max_dimension, max_dimension))
+            image = ImageOps.exif_transpose(original)
+            image = image.convert('RGBA' if _has_alpha(image) else 'RGB')
+            for metadata in ('exif', 'xmp'):
+                image.info.pop(metadata, None)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageProcessingError(str(e)) from e
+
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    outputs = [(None, _encode(image))]
+    for size in sorted(thumbnail_sizes(kind), reverse=True):
+        if kind == 'avatar':
+            thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        else:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+        outputs.append((size, _encode(thumbnail)))
+    return outputs
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _encode(image):
+    pillow_format = output_format()[0]
+    if pillow_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    # Sin exif=...: Pillow no copia los metadatos del original
+    encoded = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    image.save(encoded, pillow_format, quality=settings.IMAGE_QUALITY, optimize=pillow_format == 'JPEG')
+    encoded.seek(0)
+    return encoded
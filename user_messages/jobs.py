@@ -0,0 +1,121 @@
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DeadLetterJob, Job
+
+_handlers = {}
+
+
+def job(kind):
+    # Registra la función que ejecuta los trabajos de un tipo: @job('storage.delete_object')
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload=None, idempotency_key=None, delay=0, max_attempts=None):
+    # Se guarda en la transacción del llamante: si esta se deshace, el trabajo también.
+    # Con idempotency_key repetida devuelve el trabajo existente sin duplicarlo.
+    fields = {
+        'kind': kind,
+        'payload': payload or {},
+        'run_at': timezone.now() + timedelta(seconds=delay),
+        'max_attempts': max_attempts or settings.JOB_MAX_ATTEMPTS,
+    }
+    if idempotency_key is None:
+        return Job.objects.create(**fields)
+    try:
+        with transaction.atomic():
+            return Job.objects.create(idempotency_key=idempotency_key, **fields)
+    except IntegrityError:
+        return Job.objects.get(idempotency_key=idempotency_key)
+
+
+def retry_delay(attempts):
+    # Backoff exponencial: base, 2·base, 4·base... hasta el máximo
+    return min(settings.JOB_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), settings.JOB_RETRY_MAX_SECONDS)
+
+
+def claim(limit):
+    now = timezone.now()
+    # Trabajos de un worker caído: vuelven a la cola, o a DeadLetterJob si ya agotaron sus
+    # intentos (un trabajo que tumba al worker no se reintenta para siempre)
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT))
+    with transaction.atomic():
+        exhausted = stale.filter(attempts__gte=F('max_attempts'))
+        if connection.features.has_select_for_update_skip_locked:
+            exhausted = exhausted.select_for_update(skip_locked=True)
+        for job_obj in exhausted:
+            _fail(job_obj, "El worker no terminó el trabajo antes de JOB_LOCK_TIMEOUT")
+    stale.filter(attempts__lt=F('max_attempts')).update(status=Job.PENDING, locked_at=None)
+
+    with transaction.atomic():
+        queryset = Job.objects.filter(status=Job.PENDING, run_at__lte=now).order_by('run_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        ids = list(queryset.values_list('id', flat=True)[:limit])
+        Job.objects.filter(id__in=ids).update(status=Job.RUNNING, locked_at=now, attempts=F('attempts') + 1)
+    return list(Job.objects.filter(id__in=ids).order_by('run_at', 'id'))
+
+
+def heartbeat(idempotency_key):
+    # Los trabajos largos la llaman entre pasos para que claim no los dé por caídos
+    # tras JOB_LOCK_TIMEOUT y los reparta a otro worker mientras siguen en marcha
+    return Job.objects.filter(idempotency_key=idempotency_key, status=Job.RUNNING).update(locked_at=timezone.now())
+
+
+def run_job(job_obj):
+    handler = _handlers.get(job_obj.kind)
+    try:
+        if handler is None:
+            raise LookupError(f"Tipo de trabajo desconocido: {job_obj.kind}")
+        handler(**job_obj.payload)
+    except Exception:
+        _fail(job_obj, traceback.format_exc())
+        return False
+    Job.objects.filter(id=job_obj.id).update(status=Job.DONE, locked_at=None, last_error='')
+    return True
+
+
+def _fail(job_obj, error):
+    if job_obj.attempts >= job_obj.max_attempts:
+        with transaction.atomic():
+            DeadLetterJob.objects.create(
+                job_id=job_obj.id,
+                kind=job_obj.kind,
+                payload=job_obj.payload,
+                idempotency_key=job_obj.idempotency_key,
+                attempts=job_obj.attempts,
+                last_error=error,
+                created_at=job_obj.created_at,
+            )
+            job_obj.delete()
+        return
+    Job.objects.filter(id=job_obj.id).update(
+        status=Job.PENDING,
+        locked_at=None,
+        last_error=error,
+        run_at=timezone.now() + timedelta(seconds=retry_delay(job_obj.attempts)),
+    )
+
+
+def run_pending(limit=100):
+    # Ejecuta un lote de trabajos vencidos; devuelve cuántos se procesaron
+    jobs = claim(limit)
+    for job_obj in jobs:
+        run_job(job_obj)
+    return len(jobs)
+
+
+def run_until_empty(limit=100):
+    # Para tests: procesa la cola en el propio proceso hasta vaciarla
+    total = 0
+    while processed := run_pending(limit):
+        total += processed
+    return total
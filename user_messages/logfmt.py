@@ -0,0 +1,25 @@
+import logging
+
+
+class LogfmtFormatter(logging.Formatter):
+    # Una línea clave=valor por evento: time=... level=info logger=... msg="..." campo=valor.
+    # Los campos propios se pasan con extra={'fields': {...}}.
+    def format(self, record):
+        pairs = [
+            ('time', self.formatTime(record, '%Y-%m-%dT%H:%M:%S%z')),
+            ('level', record.levelname.lower()),
+            ('logger', record.name),
+            ('msg', record.getMessage()),
+            *getattr(record, 'fields', {}).items(),
+        ]
+        line = ' '.join(f'{key}={_quote(value)}' for key, value in pairs)
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def _quote(value):
+    text = str(value)
+    if not text or any(char in text for char in ' ="\\\n'):
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+    return text
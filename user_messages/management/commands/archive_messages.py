@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from user_messages.models import Message
+from user_messages.retention import STORAGE, TABLE, TARGETS, archive_batch, retention_cutoff
+
+
+class Command(BaseCommand):
+    help = (
+        "Saca de la tabla de mensajes los anteriores al horizonte de retención, por lotes: a la "
+        "tabla de archivo o a JSONL comprimido en storage. Con --target storage las imágenes de los "
+        "mensajes archivados se registran en ArchivedImage y purge_orphaned_images las conserva"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.MESSAGE_RETENTION_DAYS, help="Antigüedad mínima en días")
+        parser.add_argument('--target', choices=TARGETS, default=TABLE)
+        parser.add_argument('--batch-size', type=int, default=settings.MESSAGE_ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, help="Para tras este número de lotes")
+        parser.add_argument('--pause', type=float, default=0, help="Segundos de espera entre lotes")
+        parser.add_argument('--dry-run', action='store_true', help="Solo cuenta los mensajes a archivar")
+
+    def handle(self, *args, **options):
+        cutoff = retention_cutoff(options['days'])
+        if options['dry_run']:
+            count = Message.objects.filter(sent_at__lt=cutoff).count()
+            self.stdout.write(f"{count} mensajes anteriores a {cutoff:%Y-%m-%d %H:%M}")
+            return
+        total = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            archived = archive_batch(cutoff, options['batch_size'], options['target'])
+            if not archived:
+                break
+            total += archived
+            batches += 1
+            if options['pause']:
+                time.sleep(options['pause'])
+        where = "storage" if options['target'] == STORAGE else "la tabla de archivo"
+        self.stdout.write(self.style.SUCCESS(f"{total} mensajes archivados en {where} ({batches} lotes)"))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Greatest, Least
+
+from user_messages.models import Conversation, Message, SNIPPET_LENGTH
+
+
+class Command(BaseCommand):
+    help = "Crea o actualiza las conversaciones a partir de los mensajes existentes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # Último mensaje de cada par de usuarios, agregado en la base de datos
+        last_ids = (
+            Message.objects.order_by()
+            .values(low=Least('sender_id', 'receiver_id'), high=Greatest('sender_id', 'receiver_id'))
+            .annotate(last_id=Max('id'))
+            .values_list('last_id', flat=True)
+            .iterator(chunk_size=batch_size)
+        )
+        total = 0
+        batch = []
+        for last_id in last_ids:
+            batch.append(last_id)
+            if len(batch) >= batch_size:
+                total += self._upsert(batch)
+                batch = []
+        if batch:
+            total += self._upsert(batch)
+        self.stdout.write(self.style.SUCCESS(f"{total} conversaciones actualizadas"))
+
+    def _upsert(self, message_ids):
+        messages = Message.objects.filter(id__in=message_ids).only('id', 'sender_id', 'receiver_id', 'content', 'sent_at')
+        conversations = []
+        for message in messages:
+            low, high = sorted((message.sender_id, message.receiver_id))
+            conversations.append(Conversation(
+                user_low_id=low,
+                user_high_id=high,
+                last_message_id=message.id,
+                last_message_snippet=message.content[:SNIPPET_LENGTH],
+                last_message_at=message.sent_at,
+            ))
+        with transaction.atomic():
+            Conversation.objects.bulk_create(
+                conversations,
+                update_conflicts=True,
+                unique_fields=['user_low', 'user_high'],
+                update_fields=['last_message', 'last_message_snippet', 'last_message_at'],
+            )
+        return len(conversations)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from user_messages.models import Message
+from user_messages.search import full_text_enabled, search_vector
+
+
+class Command(BaseCommand):
+    help = "Rellena el índice de búsqueda de texto completo de los mensajes existentes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--all', action='store_true', help="Recalcula también los que ya tienen índice")
+
+    def handle(self, *args, **options):
+        if not full_text_enabled():
+            self.stdout.write("La búsqueda de texto completo solo está disponible en PostgreSQL")
+            return
+        batch_size = options['batch_size']
+        last_id = Message.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        total = 0
+        # Por rangos de id: cada lote es un UPDATE corto que no bloquea la tabla.
+        # update() no toca updated_at, así que no genera cambios de sincronización.
+        for start in range(0, last_id, batch_size):
+            messages = Message.objects.filter(id__gt=start, id__lte=start + batch_size)
+            if not options['all']:
+                messages = messages.filter(search_vector__isnull=True)
+            total += messages.update(search_vector=search_vector())
+        self.stdout.write(self.style.SUCCESS(f"{total} mensajes indexados"))
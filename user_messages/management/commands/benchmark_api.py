@@ -0,0 +1,192 @@
+import io
+import json
+import platform
+import random
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from rest_framework_simplejwt.tokens import AccessToken
+
+from user_messages import storage
+from user_messages.benchmarking import (
+    BENCH_PASSWORD, compare_results, http_request, http_server, seed_dataset, summary, test_database, wsgi_request,
+)
+from user_messages.models import CustomUser
+
+# Endpoint -> (método, ruta)
+ENDPOINTS = {
+    'messages': ('GET', '/api/messages/'),
+    'messages_received': ('GET', '/api/messages/received/'),
+    'send_message': ('POST', '/api/messages/send/'),
+    'users': ('GET', '/api/users/'),
+    'token': ('POST', '/api/token/'),
+}
+MODES = ('inprocess', 'http')
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark de la API de mensajería sobre un dataset sintético (base de datos de pruebas y "
+        "S3 en memoria): p50/p95/p99, req/s y consultas SQL por endpoint, en proceso y por HTTP. "
+        "La salida JSON se puede comparar entre commits con --compare"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--messages', type=int, default=5000)
+        parser.add_argument('--skew', type=float, default=1.1, help="Exponente de Zipf del reparto de mensajes por usuario")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--requests', type=int, default=200, help="Peticiones por endpoint y modo")
+        parser.add_argument('--warmup', type=int, default=10, help="Peticiones previas sin medir por endpoint y modo")
+        parser.add_argument('--concurrency', type=int, default=4, help="Hilos lanzando peticiones a la vez")
+        parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=list(ENDPOINTS))
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+        parser.add_argument('--output', help="Fichero donde guardar el resultado en JSON ('-' para stdout)")
+        parser.add_argument('--compare', help="Resultado JSON anterior con el que comparar")
+        parser.add_argument('--threshold', type=float, default=0.2, help="Empeoramiento relativo tolerado con --compare")
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError("Hacen falta al menos 2 usuarios")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        results = {}
+        with test_database():
+            storage.set_client(storage.InMemoryS3Client())
+            try:
+                started = time.perf_counter()
+                dataset = seed_dataset(options['users'], options['messages'], options['skew'], options['seed'])
+                call_command('backfill_conversations', stdout=io.StringIO())
+                self.stderr.write(f"Dataset creado en {time.perf_counter() - started:.1f}s")
+                database = connections['default'].vendor
+                plans = self._plan(dataset, options)
+                for mode in options['modes']:
+                    results[mode] = self._run_mode(mode, plans, database, options)
+            finally:
+                storage.set_client(None)
+
+        report = {
+            'meta': {
+                'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'commit': self._git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': database,
+                'dataset': {key: options[key] for key in ('users', 'messages', 'skew', 'seed')},
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+            },
+            'results': results,
+        }
+        self._print(report)
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+                f.write('\n')
+        if baseline is not None:
+            regressions = compare_results(baseline, report, options['threshold'])
+            if regressions:
+                raise CommandError("Regresiones frente a {}:\n  {}".format(options['compare'], '\n  '.join(regressions)))
+            self.stderr.write(self.style.SUCCESS(f"Sin regresiones frente a {options['compare']}"))
+
+    def _plan(self, dataset, options):
+        # Las mismas peticiones (y en el mismo orden) en todos los modos. El usuario de cada
+        # petición sigue la misma distribución que los mensajes: los más activos piden más.
+        rng = random.Random(options['seed'])
+        user_ids, weights = dataset['user_ids'], dataset['weights']
+        usernames = dict(CustomUser.objects.filter(id__in=user_ids).values_list('id', 'username'))
+        tokens = {}
+        plans = {}
+        for endpoint in options['endpoints']:
+            method, path = ENDPOINTS[endpoint]
+            plan = []
+            for _ in range(options['warmup'] + options['requests']):
+                user_id = rng.choices(user_ids, weights)[0]
+                token, body = None, b''
+                if endpoint == 'token':
+                    body = json.dumps({'username': usernames[user_id], 'password': BENCH_PASSWORD}).encode()
+                else:
+                    if user_id not in tokens:
+                        tokens[user_id] = str(AccessToken.for_user(CustomUser(id=user_id)))
+                    token = tokens[user_id]
+                if endpoint == 'send_message':
+                    receiver = user_id
+                    while receiver == user_id:
+                        receiver = rng.choices(user_ids, weights)[0]
+                    body = json.dumps({'receiver': receiver, 'content': 'mensaje del benchmark'}).encode()
+                plan.append((method, path, body, token))
+            plans[endpoint] = plan
+        return plans
+
+    def _run_mode(self, mode, plans, database, options):
+        results = {}
+        if mode == 'http':
+            with http_server() as base_url:
+                def call(request):
+                    return http_request(base_url, *request)
+                for endpoint, plan in plans.items():
+                    results[endpoint] = self._run_endpoint(call, endpoint, plan, database, options)
+        else:
+            def call(request):
+                return wsgi_request(*request)
+            for endpoint, plan in plans.items():
+                results[endpoint] = self._run_endpoint(call, endpoint, plan, database, options)
+        for connection in connections.all():
+            connection.close()
+        return results
+
+    def _run_endpoint(self, call, endpoint, plan, database, options):
+        concurrency = options['concurrency']
+        if database == 'sqlite' and ENDPOINTS[endpoint][0] == 'POST' and endpoint != 'token':
+            # SQLite bloquea la tabla con escrituras concurrentes: se serializan
+            concurrency = 1
+        warmup, measured = plan[:options['warmup']], plan[options['warmup']:]
+        for request in warmup:
+            call(request)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            raw = list(pool.map(call, measured))
+        result = summary(raw, time.perf_counter() - started)
+        return {
+            'requests': result['requests'],
+            'concurrency': concurrency,
+            'throughput': round(result['throughput'], 1),
+            'p50_ms': round(result['p50'] * 1000, 2),
+            'p95_ms': round(result['p95'] * 1000, 2),
+            'p99_ms': round(result['p99'] * 1000, 2),
+            'errors': result['errors'],
+            'queries': round(result['queries'], 2) if result['queries'] is not None else None,
+        }
+
+    def _print(self, report):
+        meta = report['meta']
+        self.stderr.write(
+            f"commit={meta['commit']} db={meta['database']} users={meta['dataset']['users']} "
+            f"messages={meta['dataset']['messages']} requests={meta['requests']} concurrency={meta['concurrency']}"
+        )
+        for mode, endpoints in report['results'].items():
+            for endpoint, result in endpoints.items():
+                self.stderr.write(
+                    f"{mode:9} {endpoint:17} {result['throughput']:8.1f} req/s  p50={result['p50_ms']:.1f}ms  "
+                    f"p95={result['p95_ms']:.1f}ms  p99={result['p99_ms']:.1f}ms  consultas={result['queries']}  "
+                    f"errores={result['errors']}"
+                )
+
+    def _git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
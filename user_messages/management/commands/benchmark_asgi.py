@@ -0,0 +1,115 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework_simplejwt.tokens import AccessToken
+
+from user_messages import storage
+from user_messages.benchmarking import asgi_request, summary, test_database, wsgi_request
+from user_messages.models import CustomUser, Message
+
+# Endpoint -> (método, ruta de la vista DRF/WSGI, ruta de la vista async/ASGI)
+ENDPOINTS = {
+    'list': ('GET', '/api/messages/', '/api/async/messages/'),
+    'send': ('POST', '/api/messages/send/', '/api/async/messages/send/'),
+    'profile': ('GET', '/api/profile/', '/api/async/profile/'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara el rendimiento con peticiones concurrentes del despliegue WSGI (workers "
+        "síncronos) frente al ASGI (vistas async) usando una base de datos de pruebas y un "
+        "S3 en memoria con latencia simulada"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='list')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=50, help="Peticiones en vuelo a la vez")
+        parser.add_argument('--workers', type=int, default=4, help="Workers síncronos del modo WSGI")
+        parser.add_argument('--s3-latency', type=float, default=0.05, help="Segundos por llamada a S3")
+        parser.add_argument('--db-latency', type=float, default=0.005, help="Segundos añadidos por consulta")
+
+    def handle(self, *args, **options):
+        db_latency = options['db_latency']
+
+        def slow_database(execute, sql, params, many, context):
+            time.sleep(db_latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            connection.execute_wrappers.append(slow_database)
+
+        if connections['default'].vendor == 'sqlite' and ENDPOINTS[options['endpoint']][0] != 'GET':
+            # SQLite bloquea la tabla con escrituras concurrentes: medir escrituras contra Postgres
+            self.stderr.write("Aviso: con SQLite las escrituras concurrentes fallan con 'database table is locked'")
+        with test_database():
+            storage.set_client(storage.InMemoryS3Client(latency=options['s3_latency']))
+            try:
+                request = self._prepare(options['endpoint'])
+                connection_created.connect(add_latency)
+                for connection in connections.all():
+                    connection.close()
+                wsgi = self._run_wsgi(request, options)
+                asgi = asyncio.run(self._run_asgi(request, options))
+            finally:
+                connection_created.disconnect(add_latency)
+                storage.set_client(None)
+
+        self.stdout.write(f"endpoint={options['endpoint']} requests={options['requests']} "
+                          f"concurrency={options['concurrency']} wsgi_workers={options['workers']}")
+        for name, result in (('wsgi', wsgi), ('asgi', asgi)):
+            self.stdout.write(
+                f"{name}: {result['throughput']:.1f} req/s  p50={result['p50'] * 1000:.0f}ms  "
+                f"p95={result['p95'] * 1000:.0f}ms  errores={result['errors']}"
+            )
+        if wsgi['errors'] or asgi['errors']:
+            # Las respuestas de error son más rápidas: la proporción no compararía lo mismo
+            raise CommandError("Hubo peticiones con error; sin comparación ASGI/WSGI")
+        self.stdout.write(self.style.SUCCESS(f"ASGI/WSGI: {asgi['throughput'] / wsgi['throughput']:.2f}x"))
+
+    def _prepare(self, endpoint):
+        alice = CustomUser.objects.create_user('bench-alice', 'bench-alice@example.com', 'secret123')
+        bob = CustomUser.objects.create_user('bench-bob', 'bench-bob@example.com', 'secret123')
+        Message.objects.bulk_create(
+            Message(sender=bob if i % 2 else alice, receiver=alice if i % 2 else bob, content=f'mensaje {i}')
+            for i in range(200)
+        )
+        key = f'messages/{alice.id}/{"0" * 32}.jpg'
+        storage.get_client().objects[(storage.bucket_name(), key)] = {'Body': b'x' * 100, 'ContentType': 'image/jpeg'}
+        method, wsgi_path, asgi_path = ENDPOINTS[endpoint]
+        body = json.dumps({'receiver': bob.id, 'content': 'hola', 'image_key': key}).encode() if method == 'POST' else b''
+        return {
+            'method': method,
+            'wsgi_path': wsgi_path,
+            'asgi_path': asgi_path,
+            'body': body,
+            'token': str(AccessToken.for_user(alice)),
+        }
+
+    def _run_wsgi(self, request, options):
+        # Cada hilo hace de un worker síncrono de gunicorn: una petición cada vez
+        def call(_):
+            return wsgi_request(request['method'], request['wsgi_path'], request['body'], request['token'])
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = list(pool.map(call, range(options['requests'])))
+        return summary(results, time.perf_counter() - started)
+
+    async def _run_asgi(self, request, options):
+        # Un único worker ASGI con hasta --concurrency peticiones en vuelo
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def call():
+            async with semaphore:
+                return await asgi_request(request['method'], request['asgi_path'], request['body'], request['token'])
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(call() for _ in range(options['requests'])))
+        return summary(results, time.perf_counter() - started)
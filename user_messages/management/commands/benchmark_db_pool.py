@@ -0,0 +1,112 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from rest_framework_simplejwt.tokens import AccessToken
+
+from user_messages.benchmarking import summary, test_database, wsgi_request
+from user_messages.models import CustomUser
+
+MODES = ('direct', 'persistent', 'pool')
+
+# Endpoint con una única consulta (el usuario del token): el coste de conectar domina
+PATH = '/api/protected/'
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga de las conexiones a Postgres: conexión nueva por petición, "
+        "conexiones persistentes y pool de psycopg; muestra el tiempo de conexión por petición"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300)
+        parser.add_argument('--workers', type=int, default=4, help="Hilos lanzando peticiones a la vez")
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'postgresql':
+            raise CommandError("Esta prueba de carga necesita PostgreSQL")
+        settings_dict = connections['default'].settings_dict
+        original = (settings_dict['CONN_MAX_AGE'], dict(settings_dict['OPTIONS']))
+        pool_options = original[1].get('pool') or {}
+        if pool_options is True:
+            pool_options = {}
+        pool_options = {**pool_options, 'max_size': max(pool_options.get('max_size', 0), options['workers'])}
+
+        connect_times = []
+        lock = threading.Lock()
+        wrapper_class = type(connections['default'])
+        get_new_connection = wrapper_class.get_new_connection
+
+        def timed_get_new_connection(wrapper, conn_params):
+            # Conexión nueva (direct/persistent) o préstamo del pool (pool)
+            started = time.perf_counter()
+            try:
+                return get_new_connection(wrapper, conn_params)
+            finally:
+                with lock:
+                    connect_times.append(time.perf_counter() - started)
+
+        results = {}
+        with test_database():
+            user = CustomUser.objects.create_user('bench-pool', 'bench-pool@example.com', 'secret123')
+            token = str(AccessToken.for_user(user))
+            wrapper_class.get_new_connection = timed_get_new_connection
+            try:
+                for mode in options['modes']:
+                    self._configure(settings_dict, mode, pool_options)
+                    connect_times.clear()
+                    results[mode] = self._run(token, options)
+                    results[mode]['connects'] = len(connect_times)
+                    results[mode]['connect_ms'] = sum(connect_times) / max(len(connect_times), 1) * 1000
+                    results[mode]['connect_ms_per_request'] = sum(connect_times) / options['requests'] * 1000
+            finally:
+                wrapper_class.get_new_connection = get_new_connection
+                self._configure(settings_dict, None, None)
+                settings_dict['CONN_MAX_AGE'], settings_dict['OPTIONS'] = original[0], original[1]
+
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode}: p50={result['p50'] * 1000:.1f}ms  p95={result['p95'] * 1000:.1f}ms  "
+                f"{result['throughput']:.0f} req/s  conexiones={result['connects']}  "
+                f"conectar={result['connect_ms']:.1f}ms ({result['connect_ms_per_request']:.2f}ms/petición)  "
+                f"errores={result['errors']}"
+            )
+        if 'direct' in results and 'pool' in results:
+            saved = results['direct']['p50'] - results['pool']['p50']
+            self.stdout.write(self.style.SUCCESS(f"El pool ahorra {saved * 1000:.1f}ms de p50 por petición"))
+
+    def _configure(self, settings_dict, mode, pool_options):
+        # Cierra lo abierto por el modo anterior y aplica el siguiente
+        connections['default'].close_pool()
+        connections.close_all()
+        if mode is None:
+            return
+        settings_dict['CONN_MAX_AGE'] = 600 if mode == 'persistent' else 0
+        settings_dict['OPTIONS'] = {key: value for key, value in settings_dict['OPTIONS'].items() if key != 'pool'}
+        if mode == 'pool':
+            settings_dict['OPTIONS']['pool'] = pool_options
+
+    def _run(self, token, options):
+        opened = set()
+
+        def call(_):
+            result = wsgi_request('GET', PATH, token=token)
+            opened.add(connections['default'])
+            return result
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = list(pool.map(call, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+        # Las conexiones persistentes se quedan abiertas en cada hilo
+        for connection in opened:
+            connection.inc_thread_sharing()
+            try:
+                connection.close()
+            finally:
+                connection.dec_thread_sharing()
+        return summary(results, elapsed)
@@ -0,0 +1,120 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from user_messages.benchmarking import compare_startup, percentile
+
+# Cada escenario corre en un intérprete nuevo (arranque en frío, sin caché de imports):
+#   manage:  django.setup(), lo que paga cualquier manage.py antes de empezar
+#   worker:  app WSGI + URLconf y vistas, lo que paga un worker sin preload_app
+#   preload: lo anterior + core.startup.warm_up(), una sola vez en el maestro con preload_app
+SCENARIOS = {
+    'manage': '',
+    'worker': 'import core.wsgi\nfrom django.urls import get_resolver\nget_resolver().url_patterns',
+    'preload': 'import core.wsgi\nfrom core.startup import warm_up\nwarm_up()',
+}
+
+SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter()
+{body}
+done = time.perf_counter()
+print(json.dumps({{
+    'setup': setup - started,
+    'total': done - started,
+    'modules': len(sys.modules),
+    's3_sdk': 'botocore' in sys.modules,
+    'pillow': 'PIL' in sys.modules,
+}}))
+'''
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el arranque en frío (imports) de manage.py y de los workers de gunicorn, cada "
+        "medida en un proceso nuevo. La salida JSON se puede comparar entre commits con --compare"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=10, help="Procesos por escenario")
+        parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+        parser.add_argument('--profile', default='core.settings.bench', help="Módulo de settings de los procesos medidos")
+        parser.add_argument('--output', help="Fichero donde guardar el resultado en JSON ('-' para stdout)")
+        parser.add_argument('--compare', help="Resultado JSON anterior con el que comparar")
+        parser.add_argument('--threshold', type=float, default=0.2, help="Empeoramiento relativo tolerado con --compare")
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError("Hace falta al menos una ejecución")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        results = {
+            scenario: self._run_scenario(scenario, options['runs'], options['profile'])
+            for scenario in options['scenarios']
+        }
+        report = {
+            'meta': {
+                'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'python': sys.version.split()[0],
+                'profile': options['profile'],
+                'runs': options['runs'],
+            },
+            'results': {'startup': results},
+        }
+        for scenario, result in results.items():
+            self.stderr.write(
+                f"{scenario:8} p50={result['p50_ms']:.1f}ms  p95={result['p95_ms']:.1f}ms  "
+                f"setup={result['setup_p50_ms']:.1f}ms  proceso={result['process_p50_ms']:.1f}ms  "
+                f"módulos={result['modules']}  s3_sdk={result['s3_sdk']}  pillow={result['pillow']}"
+            )
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+                f.write('\n')
+        if baseline is not None:
+            regressions = compare_startup(baseline, report, options['threshold'])
+            if regressions:
+                raise CommandError("Regresiones frente a {}:\n  {}".format(options['compare'], '\n  '.join(regressions)))
+            self.stderr.write(self.style.SUCCESS(f"Sin regresiones frente a {options['compare']}"))
+
+    def _run_scenario(self, scenario, runs, profile):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': profile, 'PYTHONDONTWRITEBYTECODE': '1'}
+        script = SCRIPT.format(body=SCENARIOS[scenario])
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            completed = subprocess.run(
+                [sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            elapsed = time.perf_counter() - started
+            if completed.returncode:
+                raise CommandError(f"El escenario {scenario} falló:\n{completed.stderr}")
+            samples.append((elapsed, json.loads(completed.stdout.strip().splitlines()[-1])))
+        totals = sorted(sample['total'] for _, sample in samples)
+        last = samples[-1][1]
+        return {
+            'runs': runs,
+            'p50_ms': round(statistics.median(totals) * 1000, 2),
+            'p95_ms': round(percentile(totals, 0.95) * 1000, 2),
+            'setup_p50_ms': round(statistics.median(sample['setup'] for _, sample in samples) * 1000, 2),
+            # Incluye arrancar el intérprete
+            'process_p50_ms': round(statistics.median(elapsed for elapsed, _ in samples) * 1000, 2),
+            'modules': last['modules'],
+            's3_sdk': last['s3_sdk'],
+            'pillow': last['pillow'],
+        }
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from user_messages.exports import manifest_key, run_export
+from user_messages.models import CustomUser, MessageExport
+
+
+class Command(BaseCommand):
+    help = (
+        "Exporta el historial de mensajes de un usuario a storage en este proceso, sin pasar por "
+        "la cola (p. ej. peticiones de cumplimiento); --resume continúa una exportación cortada"
+    )
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--user', help="Id o nombre del usuario")
+        target.add_argument('--resume', type=int, metavar='EXPORT_ID', help="Exportación a reanudar")
+        parser.add_argument('--format', choices=[choice for choice, _ in MessageExport.FORMAT_CHOICES], default=MessageExport.JSONL)
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            export = MessageExport.objects.filter(id=options['resume']).first()
+            if export is None:
+                raise CommandError(f"La exportación {options['resume']} no existe")
+        else:
+            lookup = {'id': options['user']} if options['user'].isdigit() else {'username': options['user']}
+            user = CustomUser.objects.filter(**lookup).first()
+            if user is None:
+                raise CommandError(f"El usuario {options['user']} no existe")
+            try:
+                export = MessageExport.objects.create(user=user, format=options['format'])
+            except IntegrityError:
+                raise CommandError(f"El usuario {user.username} ya tiene una exportación en marcha; usa --resume")
+
+        export = run_export(export.id)
+        self.stdout.write(self.style.SUCCESS(
+            f"Exportación #{export.id}: {export.message_count} mensajes en {export.parts} partes ({manifest_key(export)})"
+        ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from user_messages.models import CustomUser, Message
+from user_messages.tasks import enqueue_image_processing
+
+
+class Command(BaseCommand):
+    help = "Encola el procesado (reescalado y miniaturas) de los avatares e imágenes de mensajes aún sin procesar"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['avatar', 'message', 'all'], default='all')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        total = 0
+        if options['kind'] in ('avatar', 'all'):
+            users = CustomUser.objects.filter(avatar_processed=False).exclude(avatar='').exclude(avatar__isnull=True).values_list('id', 'avatar')
+            total += self._enqueue('avatar', users, options['batch_size'])
+        if options['kind'] in ('message', 'all'):
+            messages = Message.objects.filter(image_processed=False).exclude(image='').exclude(image__isnull=True).values_list('id', 'image')
+            total += self._enqueue('message', messages, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"{total} imágenes encoladas"))
+
+    def _enqueue(self, kind, rows, batch_size):
+        count = 0
+        batch = []
+        for row in rows.order_by('id').iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                count += self._flush(kind, batch)
+                batch = []
+        return count + self._flush(kind, batch)
+
+    def _flush(self, kind, batch):
+        with transaction.atomic():
+            for object_id, key in batch:
+                enqueue_image_processing(kind, key, object_id)
+        return len(batch)
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from user_messages import storage
+from user_messages.retention import orphaned_image_keys
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra las imágenes de messages/ en storage que ningún mensaje (activo o archivado, en la "
+        "tabla de archivo o en storage) usa, "
+        f"con DeleteObjects en lotes de {storage.DELETE_BATCH_SIZE} claves"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-seconds', type=int, default=settings.ORPHAN_IMAGE_GRACE_SECONDS,
+            help="No se tocan objetos más recientes (subidas sin confirmar)",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Solo lista las claves")
+
+    def handle(self, *args, **options):
+        keys = orphaned_image_keys(options['grace_seconds'])
+        if options['dry_run']:
+            for key in keys:
+                self.stdout.write(key)
+            self.stdout.write(f"{len(keys)} imágenes sin referencia")
+            return
+        failed = storage.delete_objects(keys)
+        if failed:
+            raise CommandError("No se pudieron borrar {} de {} imágenes: {}".format(len(failed), len(keys), ', '.join(failed[:10])))
+        self.stdout.write(self.style.SUCCESS(f"{len(keys)} imágenes borradas"))
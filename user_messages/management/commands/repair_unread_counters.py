@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from user_messages.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = "Recalcula los contadores de no leídos de las conversaciones a partir de los mensajes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Solo informa de las diferencias")
+
+    def handle(self, *args, **options):
+        # No leídos por (receptor, emisor), agregado en la base de datos sobre el índice parcial
+        unread = {
+            (receiver_id, sender_id): count
+            for receiver_id, sender_id, count in Message.objects.filter(read_at__isnull=True).order_by()
+            .values('receiver_id', 'sender_id').annotate(count=Count('id'))
+            .values_list('receiver_id', 'sender_id', 'count')
+            .iterator(chunk_size=options['batch_size'])
+        }
+        conversations = Conversation.objects.order_by().values_list('id', 'user_low_id', 'user_high_id', 'unread_low', 'unread_high')
+        mismatched = [
+            conversation_id
+            for conversation_id, low, high, unread_low, unread_high in conversations.iterator(chunk_size=options['batch_size'])
+            if (unread_low, unread_high) != self._expected(unread, low, high)
+        ]
+        if not options['dry_run']:
+            for conversation_id in mismatched:
+                self._repair(conversation_id)
+        verb = "con diferencias" if options['dry_run'] else "reparadas"
+        self.stdout.write(self.style.SUCCESS(f"{len(mismatched)} conversaciones {verb}"))
+
+    @staticmethod
+    def _expected(unread, low, high):
+        if low == high:
+            return unread.get((low, low), 0), 0
+        return unread.get((low, high), 0), unread.get((high, low), 0)
+
+    def _repair(self, conversation_id):
+        # Se vuelve a contar con la fila bloqueada: los envíos y lecturas concurrentes
+        # actualizan el contador de forma relativa y esperan a este bloqueo o lo aplican después.
+        with transaction.atomic():
+            conversation = Conversation.objects.select_for_update().get(id=conversation_id)
+            low, high = conversation.user_low_id, conversation.user_high_id
+            unread = {
+                (receiver_id, sender_id): count
+                for receiver_id, sender_id, count in Message.objects.filter(
+                    receiver_id__in=(low, high), sender_id__in=(low, high), read_at__isnull=True,
+                ).order_by().values('receiver_id', 'sender_id').annotate(count=Count('id'))
+                .values_list('receiver_id', 'sender_id', 'count')
+            }
+            conversation.unread_low, conversation.unread_high = self._expected(unread, low, high)
+            conversation.save(update_fields=['unread_low', 'unread_high'])
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from user_messages import jobs
+
+
+class Command(BaseCommand):
+    help = "Ejecuta los trabajos en segundo plano de la cola (subidas, borrados en S3...)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Vacía la cola y termina")
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--sleep', type=float, default=1.0, help="Espera entre sondeos con la cola vacía")
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            while True:
+                close_old_connections()
+                processed = jobs.run_pending(options['batch_size'])
+                total += processed
+                if processed:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"{total} trabajos procesados")
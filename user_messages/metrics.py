@@ -0,0 +1,249 @@
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+# Métricas en memoria del proceso con exposición en formato de texto de Prometheus
+# (GET /metrics). Con METRICS_DIR (gunicorn.conf.py) cada worker vuelca las suyas a
+# <METRICS_DIR>/<pid>-<id>.json cada METRICS_FLUSH_SECONDS y al salir, y /metrics suma las
+# de todos: el scraper ve el servidor entero sea cual sea el worker que le responda. Los
+# volcados de workers ya terminados se quedan para que los contadores no bajen.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(values, other):
+        # Suma en `values` las de otro proceso
+        for label_values, value in other.items():
+            values[label_values] = values.get(label_values, 0) + value
+
+    def samples(self, values=None):
+        values = self.snapshot() if values is None else values
+        for label_values, value in sorted(values.items()):
+            yield self.name, self._label_pairs(label_values), value
+
+    def _label_pairs(self, label_values, **extra):
+        return [*zip(self.labels, label_values), *extra.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        # Cuenta por bucket (no acumulada) + suma; la acumulación se hace al exportar
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: ([*counts], total) for labels, (counts, total) in self._values.items()}
+
+    @staticmethod
+    def merge(values, other):
+        for label_values, (counts, total) in other.items():
+            current = values.get(label_values)
+            if current is None:
+                values[label_values] = ([*counts], total)
+            else:
+                values[label_values] = ([a + b for a, b in zip(current[0], counts)], current[1] + total)
+
+    def samples(self, values=None):
+        values = self.snapshot() if values is None else values
+        for label_values, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', self._label_pairs(label_values, le=_format_value(bound)), cumulative
+            yield f'{self.name}_sum', self._label_pairs(label_values), total
+            yield f'{self.name}_count', self._label_pairs(label_values), cumulative
+
+
+REQUESTS = Counter('http_requests_total', 'Peticiones HTTP atendidas', ('view', 'method', 'status'))
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Latencia de las peticiones HTTP', ('view', 'method'))
+RESPONSE_SIZE = Histogram('http_response_size_bytes', 'Tamaño del cuerpo de la respuesta', ('view',), SIZE_BUCKETS)
+REQUEST_DB_QUERIES = Histogram('http_request_db_queries', 'Consultas SQL por petición', ('view',), COUNT_BUCKETS)
+REQUEST_DB_DURATION = Histogram('http_request_db_duration_seconds', 'Tiempo en la base de datos por petición', ('view',))
+REQUEST_S3_CALLS = Histogram('http_request_s3_calls', 'Llamadas a S3 por petición', ('view',), COUNT_BUCKETS)
+REQUEST_S3_DURATION = Histogram('http_request_s3_duration_seconds', 'Tiempo esperando a S3 por petición', ('view',))
+S3_CALLS = Counter('s3_calls_total', 'Llamadas a S3', ('operation', 'outcome'))
+S3_DURATION = Histogram('s3_call_duration_seconds', 'Latencia de las llamadas a S3', ('operation',))
+PROFILE_CACHE = Counter('profile_cache_lookups_total', 'Perfiles buscados en la caché', ('result',))
+
+REGISTRY = [
+    REQUESTS, REQUEST_DURATION, RESPONSE_SIZE, REQUEST_DB_QUERIES, REQUEST_DB_DURATION,
+    REQUEST_S3_CALLS, REQUEST_S3_DURATION, S3_CALLS, S3_DURATION, PROFILE_CACHE,
+]
+
+
+class S3Stats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+# Llamadas a S3 de la petición en curso (la crea el middleware de métricas)
+_request_s3 = ContextVar('request_s3', default=None)
+
+
+def start_request():
+    stats = S3Stats()
+    return stats, _request_s3.set(stats)
+
+
+def end_request(token):
+    _request_s3.reset(token)
+
+
+def timed_s3(operation):
+    # Decorador para las funciones de storage: latencia y resultado de cada llamada
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = func(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                duration = time.perf_counter() - started
+                S3_CALLS.inc(operation, outcome)
+                S3_DURATION.observe(duration, operation)
+                stats = _request_s3.get()
+                if stats is not None:
+                    stats.count += 1
+                    stats.duration += duration
+        return wrapper
+    return decorator
+
+
+# (pid, nombre del volcado): el id distingue a un worker nuevo que repita el pid de otro
+_snapshot_name = None
+
+
+def _snapshot_path(directory):
+    global _snapshot_name
+    pid = os.getpid()
+    if _snapshot_name is None or _snapshot_name[0] != pid:
+        _snapshot_name = (pid, f'{pid}-{uuid.uuid4().hex[:8]}.json')
+    return os.path.join(directory, _snapshot_name[1])
+
+
+def _write_snapshot(directory, values):
+    # Escritura atómica: quien lee ve el volcado anterior o el nuevo, nunca uno a medias
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory)
+    data = {name: [[list(labels), value] for labels, value in metric_values.items()] for name, metric_values in values.items()}
+    with open(f'{path}.tmp', 'w') as snapshot:
+        json.dump(data, snapshot, separators=(',', ':'))
+    os.replace(f'{path}.tmp', path)
+    return path
+
+
+def _read_snapshots(directory, own_path):
+    for entry in os.scandir(directory):
+        if not entry.name.endswith('.json') or entry.path == own_path:
+            continue
+        try:
+            with open(entry.path) as snapshot:
+                data = json.load(snapshot)
+        except (OSError, ValueError):
+            continue
+        yield {name: {tuple(labels): value for labels, value in pairs} for name, pairs in data.items()}
+
+
+def flush():
+    # Vuelca las métricas del proceso a METRICS_DIR (si está configurado)
+    if settings.METRICS_DIR:
+        _write_snapshot(settings.METRICS_DIR, {metric.name: metric.snapshot() for metric in REGISTRY})
+
+
+def start_flusher(interval):
+    # Hilo del worker que vuelca sus métricas cada `interval` segundos (core.startup.after_fork)
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                flush()
+            except OSError:
+                pass
+
+    threading.Thread(target=loop, name='metrics-flush', daemon=True).start()
+
+
+def collect():
+    # {nombre: valores} del proceso, más los volcados de los demás procesos con METRICS_DIR
+    values = {metric.name: metric.snapshot() for metric in REGISTRY}
+    if settings.METRICS_DIR:
+        own_path = _write_snapshot(settings.METRICS_DIR, values)
+        for other in _read_snapshots(settings.METRICS_DIR, own_path):
+            for metric in REGISTRY:
+                metric.merge(values[metric.name], other.get(metric.name, {}))
+    return values
+
+
+def render():
+    lines = []
+    values = collect()
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples(values[metric.name]):
+            label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+            lines.append(f'{name}{{{label_text}}} {_format_value(value)}' if label_text else f'{name} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    for metric in REGISTRY:
+        metric.reset()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,143 @@
+import math
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import metrics
+
+
+class QueryStats:
+    # Tiempo y número de consultas SQL; se instala con connection.execute_wrapper
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class HybridMiddleware:
+    # Base para middleware síncrono y asíncrono: bajo ASGI, si uno de la cadena solo es
+    # síncrono Django la pasa entera a modo síncrono y las vistas async corren en un hilo.
+    # Las subclases implementan __call__ y __acall__.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+
+class QueryTimingMiddleware(HybridMiddleware):
+    # Contabiliza las consultas de cada petición en request.query_stats y en la
+    # cabecera Server-Timing (visible en las herramientas de red del navegador)
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, wrappers = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self._stop(wrappers)
+        return self._finish(response, stats)
+
+    async def __acall__(self, request):
+        # Las conexiones son de cada hilo: los wrappers se instalan en el hilo donde el ORM
+        # async y sync_to_async ejecutan las consultas de esta petición
+        stats, wrappers = await sync_to_async(self._start)(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(self._stop)(wrappers)
+        return self._finish(response, stats)
+
+    def _start(self, request):
+        request.query_stats = stats = QueryStats()
+        wrappers = [connection.execute_wrapper(stats) for connection in connections.all()]
+        for wrapper in wrappers:
+            wrapper.__enter__()
+        return stats, wrappers
+
+    def _stop(self, wrappers):
+        for wrapper in reversed(wrappers):
+            wrapper.__exit__(None, None, None)
+
+    def _finish(self, response, stats):
+        response['Server-Timing'] = f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"'
+        return response
+
+
+class MetricsMiddleware(HybridMiddleware):
+    # Latencia, estado, tamaño de respuesta, consultas SQL y llamadas a S3 por vista
+    # (metrics.py, GET /metrics). Va antes que QueryTimingMiddleware, de la que toma
+    # las consultas. Con METRICS_ENABLED=False Django lo descarta al arrancar.
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        s3_stats, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._record(request, response, time.perf_counter() - started, s3_stats)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        s3_stats, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._record(request, response, time.perf_counter() - started, s3_stats)
+
+    def _record(self, request, response, duration, s3_stats):
+        # Nombre de la ruta, no la URL: cardinalidad acotada
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        metrics.REQUESTS.inc(view, request.method, str(response.status_code))
+        metrics.REQUEST_DURATION.observe(duration, view, request.method)
+        if not response.streaming:
+            metrics.RESPONSE_SIZE.observe(len(response.content), view)
+        query_stats = getattr(request, 'query_stats', None)
+        if query_stats is not None:
+            metrics.REQUEST_DB_QUERIES.observe(query_stats.count, view)
+            metrics.REQUEST_DB_DURATION.observe(query_stats.duration, view)
+        metrics.REQUEST_S3_CALLS.observe(s3_stats.count, view)
+        metrics.REQUEST_S3_DURATION.observe(s3_stats.duration, view)
+        return response
+
+
+class RateLimitHeadersMiddleware(HybridMiddleware):
+    # Cabeceras X-RateLimit-* con la decisión del throttling (throttling.py) de la petición;
+    # en las rechazadas (429) DRF añade además Retry-After
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self._add_headers(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self._add_headers(request, await self.get_response(request))
+
+    def _add_headers(self, request, response):
+        decision = getattr(request, 'rate_limit', None)
+        if decision is not None:
+            response['X-RateLimit-Limit'] = str(decision.limit)
+            response['X-RateLimit-Remaining'] = str(decision.remaining)
+            response['X-RateLimit-Reset'] = str(math.ceil(decision.reset))
+        return response
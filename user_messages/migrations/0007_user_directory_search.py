@@ -0,0 +1,82 @@
+# Generated by Django 5.2 on 2026-10-18 13:05
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def _normalize(value):
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def fill_search_columns(apps, schema_editor):
+    CustomUser = apps.get_model('user_messages', 'CustomUser')
+    batch = []
+    for user in CustomUser.objects.only('id', 'username', 'email').iterator(chunk_size=1000):
+        user.username_search = _normalize(user.username)
+        user.email_search = _normalize(user.email)
+        batch.append(user)
+        if len(batch) >= 1000:
+            CustomUser.objects.bulk_update(batch, ['username_search', 'email_search'])
+            batch = []
+    CustomUser.objects.bulk_update(batch, ['username_search', 'email_search'])
+
+
+# Índices trigram para búsqueda por subcadena (LIKE '%abc%'); solo en Postgres
+TRIGRAM_INDEXES = {
+    'user_username_trgm_idx': 'username_search',
+    'user_email_trgm_idx': 'email_search',
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, column in TRIGRAM_INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON user_messages_customuser USING gin ({column} gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('user_messages', '0006_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='email_search',
+            field=models.CharField(blank=True, editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='username_search',
+            field=models.CharField(blank=True, editable=False, max_length=150),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['username_search', 'id'], name='user_directory_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['username_search'], name='user_username_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['email_search'], name='user_email_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(fill_search_columns, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
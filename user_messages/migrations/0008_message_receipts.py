@@ -0,0 +1,45 @@
+# Generated by Django 5.2 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+def mark_history_read(apps, schema_editor):
+    # Los mensajes anteriores a los acuses ya los habían visto: sin esto todo el historial
+    # contaría como no leído (y entraría en message_unread_idx)
+    Message = apps.get_model('user_messages', 'Message')
+    Conversation = apps.get_model('user_messages', 'Conversation')
+    Message.objects.filter(read_at__isnull=True).update(delivered_at=models.F('sent_at'), read_at=models.F('sent_at'))
+    Conversation.objects.update(unread_low=0, unread_high=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_messages', '0007_user_directory_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='delivered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_history_read, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(condition=models.Q(('unread_low__gt', 0)), fields=['user_low'], name='conversation_low_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(condition=models.Q(('unread_high__gt', 0)), fields=['user_high'], name='conversation_high_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('read_at__isnull', True)), fields=['receiver', 'sender', 'id'], name='message_unread_idx'),
+        ),
+    ]
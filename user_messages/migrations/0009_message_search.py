@@ -0,0 +1,54 @@
+# Generated by Django 5.2 on 2026-10-18 13:12
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# El diccionario debe coincidir con SEARCH_CONFIG en user_messages/search.py
+CREATE_SEARCH_TRIGGER = """
+CREATE OR REPLACE FUNCTION user_messages_message_search_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := to_tsvector('pg_catalog.spanish', coalesce(NEW.content, ''));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS message_search_update ON user_messages_message;
+CREATE TRIGGER message_search_update
+    BEFORE INSERT OR UPDATE OF content ON user_messages_message
+    FOR EACH ROW EXECUTE FUNCTION user_messages_message_search_update();
+
+CREATE INDEX IF NOT EXISTS message_search_idx ON user_messages_message USING gin (search_vector);
+"""
+
+DROP_SEARCH_TRIGGER = """
+DROP INDEX IF EXISTS message_search_idx;
+DROP TRIGGER IF EXISTS message_search_update ON user_messages_message;
+DROP FUNCTION IF EXISTS user_messages_message_search_update();
+"""
+
+
+def create_search_trigger(apps, schema_editor):
+    # Solo en Postgres; en SQLite (tests) la búsqueda usa LIKE sobre el contenido
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_SEARCH_TRIGGER)
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEARCH_TRIGGER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_messages', '0008_message_receipts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_messages', '0011_message_export'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('sender_id', models.BigIntegerField()),
+                ('receiver_id', models.BigIntegerField()),
+                ('content', models.TextField()),
+                ('image', models.CharField(blank=True, default='', max_length=100)),
+                ('sent_at', models.DateTimeField()),
+                ('delivered_at', models.DateTimeField(blank=True, null=True)),
+                ('read_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['receiver_id', '-sent_at', '-id'], name='archive_receiver_sent_idx'), models.Index(fields=['sender_id', '-sent_at', '-id'], name='archive_sender_sent_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 14:27
+
+import user_messages.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_messages', '0012_archived_message'),
+    ]
+
+    operations = [
+        # Las exportaciones ya existentes se quedan sin token: sus ficheros siguen en la ruta antigua
+        migrations.AddField(
+            model_name='messageexport',
+            name='token',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='messageexport',
+            name='token',
+            field=models.CharField(blank=True, default=user_messages.models.new_export_token, editable=False, max_length=32),
+        ),
+        migrations.AddConstraint(
+            model_name='messageexport',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('user',), name='export_one_active_per_user'),
+        ),
+    ]
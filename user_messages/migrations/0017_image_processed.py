@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 14:41
+
+from django.db import migrations, models
+
+from user_messages.images import output_format
+
+
+def mark_processed(apps, schema_editor):
+    # El procesado anterior dejaba la imagen en <nombre>.<formato de salida> junto a sus
+    # miniaturas; el resto (pendientes o rechazadas) las tendrá al pasar por process_images
+    extension = f'.{output_format()[1]}'
+    apps.get_model('user_messages', 'CustomUser').objects.filter(avatar__endswith=extension).update(avatar_processed=True)
+    apps.get_model('user_messages', 'Message').objects.filter(image__endswith=extension).update(image_processed=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_messages', '0016_version_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='avatar_processed',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='image_processed',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_processed, migrations.RunPython.noop),
+    ]
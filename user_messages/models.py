@@ -1,19 +1,462 @@
+import secrets
+import unicodedata
+
+from django.contrib.auth.hashers import acheck_password, check_password
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import IntegrityError, models, transaction
 from django.conf import settings
+from django.utils import timezone
+
+from .identity import invalidate_identity
+from .profiles import invalidate_profile
+
+# Columnas de usuario que se muestran junto a un mensaje (resto diferidas)
+PARTICIPANT_FIELDS = ('id', 'username', 'avatar', 'avatar_processed')
+
+# Columnas que se ven en el perfil o el directorio: guardarlas sube profile_version
+PROFILE_FIELDS = {'username', 'email', 'avatar', 'is_active'}
+
+# Columnas de Message.objects.rows() que lee MessageRowSerializer
+MESSAGE_ROW_FIELDS = (
+    'id', 'sender_id', 'receiver_id', 'content', 'image', 'image_processed', 'sent_at', 'delivered_at', 'read_at',
+    'sender__username', 'sender__avatar', 'sender__avatar_processed',
+    'receiver__username', 'receiver__avatar', 'receiver__avatar_processed',
+)
+
+
+def normalize_search(value):
+    # Minúsculas y sin tildes: "José" y "jose" se encuentran igual
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
 
 class CustomUser(AbstractUser):
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True)
+    # El avatar actual es la versión procesada y tiene miniaturas (tasks.process_image)
+    avatar_processed = models.BooleanField(default=False, editable=False)
+    # Copias normalizadas de username/email para la búsqueda del directorio
+    username_search = models.CharField(max_length=150, blank=True, editable=False)
+    email_search = models.CharField(max_length=254, blank=True, editable=False)
+    # Sube al cambiar la contraseña o desactivar la cuenta: revoca los JWT ya emitidos
+    token_version = models.PositiveIntegerField(default=0, editable=False)
+    # Sube con cada cambio del perfil: entra en los ETag (conditional.py), igual en todos los procesos
+    profile_version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Orden y paginación del directorio
+            models.Index(fields=['username_search', 'id'], name='user_directory_idx'),
+            # Búsqueda por prefijo (LIKE 'abc%') en Postgres con cualquier collation
+            models.Index(fields=['username_search'], name='user_username_prefix_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['email_search'], name='user_email_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return self.username
-    
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Para detectar la desactivación al guardar (None si no se cargó)
+        instance._active_in_db = instance.__dict__.get('is_active')
+        return instance
+
+    def set_password(self, raw_password):
+        super().set_password(raw_password)
+        if self.pk is not None:
+            self.token_version += 1
+
+    # Al iniciar sesión Django vuelve a cifrar la contraseña si cambió el hasher o sus
+    # iteraciones, y lo hace con set_password. Es la misma contraseña: no revoca los tokens.
+    def _rehash(self, raw_password):
+        super().set_password(raw_password)
+        self._password = None
+
+    def check_password(self, raw_password):
+        def setter(raw_password):
+            self._rehash(raw_password)
+            self.save(update_fields=['password'])
+
+        return check_password(raw_password, self.password, setter)
+
+    async def acheck_password(self, raw_password):
+        async def setter(raw_password):
+            self._rehash(raw_password)
+            await self.asave(update_fields=['password'])
+
+        return await acheck_password(raw_password, self.password, setter)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'username', 'email'} & set(update_fields):
+            self.username_search = normalize_search(self.username)
+            self.email_search = normalize_search(self.email)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'username_search', 'email_search'}
+        if getattr(self, '_active_in_db', None) and not self.is_active:
+            self.token_version += 1
+        if update_fields is not None and {'password', 'is_active'} & set(update_fields):
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'token_version'}
+        # En la base de datos: dos guardados a la vez no pueden dejar la misma versión
+        adding = self._state.adding
+        bump = not adding and (update_fields is None or PROFILE_FIELDS & set(update_fields))
+        if bump:
+            self.profile_version = models.F('profile_version') + 1
+            if update_fields is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'profile_version'}
+        super().save(*args, **kwargs)
+        if bump:
+            # Se vuelve a leer al usarse
+            del self.profile_version
+        if adding or bump:
+            VersionCounter.objects.bump(VersionCounter.DIRECTORY)
+        self._active_in_db = self.__dict__.get('is_active')
+        invalidate_profile(self.id)
+        invalidate_identity(self.id)
+
+
+class VersionCounterManager(models.Manager):
+    def bump(self, name):
+        # En la transacción del cambio: un ETag calculado con el valor nuevo nunca va con datos viejos
+        if not self.filter(name=name).update(value=models.F('value') + 1):
+            self.get_or_create(name=name, defaults={'value': 1})
+
+    def value(self, name):
+        return self.filter(name=name).values_list('value', flat=True).first() or 0
+
+
+class VersionCounter(models.Model):
+    # Marcas de agua globales para los validadores ETag (conditional.py): una lectura por
+    # clave primaria en lugar de recorrer la tabla que resumen
+    DIRECTORY = 'directory'
+
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    objects = VersionCounterManager()
+
+    def __str__(self):
+        return f"{self.name}={self.value}"
+
+
+class MessageQuerySet(models.QuerySet):
+    def with_participants(self):
+        # Trae emisor y receptor en el mismo JOIN y solo con las columnas que se serializan
+        return self.select_related('sender', 'receiver').only(
+            'id', 'sender', 'receiver', 'content', 'image', 'image_processed', 'sent_at', 'updated_at', 'delivered_at', 'read_at',
+            *(f'sender__{field}' for field in PARTICIPANT_FIELDS),
+            *(f'receiver__{field}' for field in PARTICIPANT_FIELDS),
+        )
+
+    def rows(self, *extra):
+        # Tuplas con nombre en lugar de instancias (listados con MessageRowSerializer);
+        # `extra`: columnas o anotaciones adicionales, p. ej. las de la paginación
+        return self.values_list(*MESSAGE_ROW_FIELDS, *(name for name in extra if name not in MESSAGE_ROW_FIELDS), named=True)
+
+    def for_timeline(self, user):
+        return self.filter(models.Q(sender=user) | models.Q(receiver=user)).with_participants()
+
+    def timeline_branches(self, user):
+        # for_timeline en dos ramas disjuntas, cada una sobre su índice (emisor, sent_at, id) o
+        # (receptor, sent_at, id): con el OR Postgres combina ambos índices con BitmapOr sobre
+        # todo el historial y ordena. Los mensajes a uno mismo van solo en la primera.
+        return [
+            self.filter(sender=user).with_participants(),
+            self.filter(receiver=user).exclude(sender=user).with_participants(),
+        ]
+
+    def received_by(self, user):
+        return self.filter(receiver=user).with_participants()
+
+    def sent_by(self, user):
+        return self.filter(sender=user).with_participants()
+
+
 class Message(models.Model):
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='sent_messages', on_delete=models.CASCADE)
     receiver = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='received_messahes', on_delete=models.CASCADE)
     content = models.TextField()
     image = models.ImageField(upload_to='messages/', blank=True, null=True)
+    # La imagen es la versión procesada y tiene miniaturas (tasks.process_image)
+    image_processed = models.BooleanField(default=False, editable=False)
     sent_at = models.DateTimeField(auto_now_add=True)
+    # Última modificación; base del token de sincronización incremental
+    updated_at = models.DateTimeField(auto_now=True)
+    # Acuses del receptor: entregado en su dispositivo y leído
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+    # Índice de búsqueda de texto completo; en Postgres lo mantiene un trigger (migración 0009)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = MessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Índices para la paginación keyset (sent_at, id) de bandeja de entrada y enviados
+            models.Index(fields=['receiver', '-sent_at', '-id'], name='message_receiver_sent_idx'),
+            models.Index(fields=['sender', '-sent_at', '-id'], name='message_sender_sent_idx'),
+            # Índices para /api/messages/sync/ (cambios posteriores a un token)
+            models.Index(fields=['receiver', 'updated_at', 'id'], name='message_receiver_updated_idx'),
+            models.Index(fields=['sender', 'updated_at', 'id'], name='message_sender_updated_idx'),
+            # Solo los no leídos: marcar una conversación como leída y reparar contadores
+            models.Index(fields=['receiver', 'sender', 'id'], name='message_unread_idx', condition=models.Q(read_at__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f"De {self.sender.username} a {self.receiver.username} - {self.sent_at.strftime('%d/%m/%Y %H:%M:%S')}"
+
+
+class MessageTombstone(models.Model):
+    # Rastro de un mensaje borrado para que los clientes lo eliminen al sincronizar.
+    # Sin claves foráneas: debe sobrevivir al borrado del mensaje y de los usuarios.
+    message_id = models.BigIntegerField()
+    sender_id = models.BigIntegerField()
+    receiver_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['receiver_id', 'id'], name='tombstone_receiver_idx'),
+            models.Index(fields=['sender_id', 'id'], name='tombstone_sender_idx'),
+        ]
+
+    def __str__(self):
+        return f"Mensaje {self.message_id} borrado"
+
+
+class ArchivedMessage(models.Model):
+    # Mensaje sacado de la tabla caliente por archive_messages (user_messages/retention.py).
+    # Mismo id que tenía; sin claves foráneas, como MessageTombstone.
+    id = models.BigIntegerField(primary_key=True)
+    sender_id = models.BigIntegerField()
+    receiver_id = models.BigIntegerField()
+    content = models.TextField()
+    image = models.CharField(max_length=100, blank=True, default='')
+    sent_at = models.DateTimeField()
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['receiver_id', '-sent_at', '-id'], name='archive_receiver_sent_idx'),
+            models.Index(fields=['sender_id', '-sent_at', '-id'], name='archive_sender_sent_idx'),
+        ]
+
+    def __str__(self):
+        return f"Mensaje {self.id} archivado"
+
+
+class ArchivedImage(models.Model):
+    # Imagen de un mensaje archivado en storage (JSONL): el mensaje ya no está en ninguna
+    # tabla, pero el archivo la sigue nombrando y purge_orphaned_images no debe borrarla
+    image = models.CharField(max_length=100, unique=True)
+    archive_key = models.CharField(max_length=255)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.image} ({self.archive_key})"
+
+
+# Longitud del extracto del último mensaje que se guarda en la conversación
+SNIPPET_LENGTH = 120
+
+
+class ConversationQuerySet(models.QuerySet):
+    def for_user(self, user):
+        return self.filter(models.Q(user_low=user) | models.Q(user_high=user)).select_related(
+            'user_low', 'user_high'
+        ).only(
+            'id', 'user_low', 'user_high', 'last_message', 'last_message_snippet',
+            'last_message_at', 'unread_low', 'unread_high',
+            *(f'user_low__{field}' for field in PARTICIPANT_FIELDS),
+            *(f'user_high__{field}' for field in PARTICIPANT_FIELDS),
+        )
+
+
+class ConversationManager(models.Manager.from_queryset(ConversationQuerySet)):
+    def record_message(self, message):
+        # Actualiza el resumen de la conversación; llamar dentro de la misma
+        # transacción que crea el mensaje. Un UPDATE en el caso habitual.
+        low, high = sorted((message.sender_id, message.receiver_id))
+        unread_field = Conversation.unread_field(message.receiver_id, message.sender_id)
+        summary = {
+            'last_message': message,
+            'last_message_snippet': message.content[:SNIPPET_LENGTH],
+            'last_message_at': message.sent_at,
+        }
+        lookup = self.filter(user_low_id=low, user_high_id=high)
+        if lookup.update(**summary, **{unread_field: models.F(unread_field) + 1}):
+            return
+        try:
+            with transaction.atomic():
+                self.create(user_low_id=low, user_high_id=high, **summary, **{unread_field: 1})
+        except IntegrityError:
+            # Otra petición creó la conversación a la vez
+            lookup.update(**summary, **{unread_field: models.F(unread_field) + 1})
+
+    def record_broadcast(self, sender, messages):
+        # Versión por lotes de record_message para un mensaje de `sender` a cada
+        # receptor (receptores distintos): un INSERT de las conversaciones que falten
+        # y un UPDATE por posición del emisor dentro del par.
+        if not messages:
+            return
+        self.bulk_create([
+            Conversation(
+                user_low_id=min(sender.id, message.receiver_id),
+                user_high_id=max(sender.id, message.receiver_id),
+                last_message_at=message.sent_at,
+            )
+            for message in messages
+        ], ignore_conflicts=True)
+        for sender_side, receiver_side in (('user_low', 'user_high'), ('user_high', 'user_low')):
+            if sender_side == 'user_low':
+                group = [message for message in messages if message.receiver_id > sender.id]
+            else:
+                group = [message for message in messages if message.receiver_id <= sender.id]
+            if not group:
+                continue
+            unread_field = 'unread_high' if sender_side == 'user_low' else 'unread_low'
+            receiver_column = f'{receiver_side}_id'
+            self.filter(**{sender_side: sender, f'{receiver_column}__in': [message.receiver_id for message in group]}).update(
+                last_message_id=models.Case(
+                    *(models.When(**{receiver_column: message.receiver_id}, then=models.Value(message.id)) for message in group),
+                    output_field=models.BigIntegerField(),
+                ),
+                last_message_at=models.Case(
+                    *(models.When(**{receiver_column: message.receiver_id}, then=models.Value(message.sent_at)) for message in group),
+                    output_field=models.DateTimeField(),
+                ),
+                last_message_snippet=group[0].content[:SNIPPET_LENGTH],
+                **{unread_field: models.F(unread_field) + 1},
+            )
+
+
+class Conversation(models.Model):
+    # Par de usuarios no ordenado: siempre user_low.id <= user_high.id
+    user_low = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    user_high = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    last_message = models.ForeignKey(Message, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    last_message_snippet = models.CharField(max_length=SNIPPET_LENGTH, blank=True)
+    last_message_at = models.DateTimeField()
+    unread_low = models.PositiveIntegerField(default=0)
+    unread_high = models.PositiveIntegerField(default=0)
+    # Último archivado de mensajes del par (retention.py): cambia el ETag de los listados
+    archived_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ConversationManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='conversation_unique_pair'),
+            models.CheckConstraint(condition=models.Q(user_low__lte=models.F('user_high')), name='conversation_ordered_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['user_low', '-last_message_at', '-id'], name='conversation_low_recent_idx'),
+            models.Index(fields=['user_high', '-last_message_at', '-id'], name='conversation_high_recent_idx'),
+            # Contadores de no leídos pendientes de cada usuario
+            models.Index(fields=['user_low'], name='conversation_low_unread_idx', condition=models.Q(unread_low__gt=0)),
+            models.Index(fields=['user_high'], name='conversation_high_unread_idx', condition=models.Q(unread_high__gt=0)),
+        ]
+
+    def __str__(self):
+        return f"{self.user_low_id} <-> {self.user_high_id}"
+
+    def counterpart(self, user):
+        return self.user_high if self.user_low_id == user.id else self.user_low
+
+    def unread_for(self, user):
+        return self.unread_low if self.user_low_id == user.id else self.unread_high
+
+    @staticmethod
+    def unread_field(receiver_id, sender_id):
+        # Contador del receptor dentro del par ordenado
+        return 'unread_low' if receiver_id <= sender_id else 'unread_high'
+
+
+def new_export_token():
+    return secrets.token_hex(16)
+
+
+class MessageExport(models.Model):
+    # Exportación del historial de un usuario a storage (user_messages/exports.py): partes de
+    # como mucho EXPORT_PART_SIZE mensajes y un manifest.json al terminar. last_message_id es
+    # el punto de control: un reintento sigue desde ahí en lugar de empezar de nuevo.
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = [(PENDING, 'Pendiente'), (RUNNING, 'En curso'), (DONE, 'Terminada')]
+    JSONL = 'jsonl'
+    ZIP = 'zip'
+    FORMAT_CHOICES = [(JSONL, 'JSON Lines'), (ZIP, 'Zip')]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='message_exports', on_delete=models.CASCADE)
+    # Parte aleatoria de la ruta en storage: los ids son secuenciales y se adivinan
+    token = models.CharField(max_length=32, blank=True, default=new_export_token, editable=False)
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default=JSONL)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    last_message_id = models.BigIntegerField(default=0)
+    parts = models.PositiveIntegerField(default=0)
+    message_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='export_user_recent_idx'),
+        ]
+        constraints = [
+            # Una sola exportación en marcha por usuario, también con POST concurrentes
+            models.UniqueConstraint(
+                fields=['user'], condition=models.Q(status__in=['pending', 'running']), name='export_one_active_per_user',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Exportación #{self.id} de {self.user_id} ({self.status})"
+
+
+class Job(models.Model):
+    # Cola de trabajos en segundo plano (user_messages/jobs.py, manage.py run_jobs)
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = [(PENDING, 'Pendiente'), (RUNNING, 'En curso'), (DONE, 'Terminado')]
+
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_at', 'id'], name='job_pending_idx', condition=models.Q(status='pending')),
+            models.Index(fields=['locked_at'], name='job_running_idx', condition=models.Q(status='running')),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
+
+
+class DeadLetterJob(models.Model):
+    # Trabajos que agotaron sus reintentos, para revisarlos o relanzarlos a mano
+    job_id = models.BigIntegerField()
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True)
+    attempts = models.PositiveIntegerField()
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    failed_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"De {self.sender.username} a {self.receiver.username} - {self.sent_at.strftime('%d/%m/%Y %H:%M:%S')}"
\ No newline at end of file
+        return f"{self.kind} #{self.job_id} (fallido)"
@@ -0,0 +1,207 @@
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetCursorPagination(BasePagination):
+    # Paginación por cursor opaco sobre una clave compuesta (keyset).
+    # A diferencia de LIMIT/OFFSET el coste de cada página no depende de
+    # cuántas filas haya antes, y las inserciones nuevas no desplazan páginas.
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Cursor inválido'
+
+    # Campos de ordenación; el último debe ser único (normalmente 'id')
+    ordering = ('-id',)
+
+    def __init__(self):
+        self.page_size = None
+        self.max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 100)
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(getattr(view, 'keyset_ordering', None) or self.ordering)
+
+    def get_page_size(self, request):
+        default = getattr(settings, 'API_PAGE_SIZE', 50)
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, default))
+        except (TypeError, ValueError):
+            size = default
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # `queryset` también puede ser una lista de ramas (ver _page_queryset)
+        pages, position, reverse = self._page_queryset(queryset, request, view)
+        if isinstance(pages, list):
+            return self._set_page(self._merge([list(page) for page in pages], reverse), position, reverse)
+        return self._set_page(list(pages), position, reverse)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # Para vistas async: la consulta se lanza con el ORM async
+        pages, position, reverse = self._page_queryset(queryset, request, view)
+        if isinstance(pages, list):
+            return self._set_page(self._merge([[obj async for obj in page] for page in pages], reverse), position, reverse)
+        return self._set_page([obj async for obj in pages], position, reverse)
+
+    def _page_queryset(self, queryset, request, view):
+        # Con varias ramas disjuntas (p. ej. enviados y recibidos de un usuario) cada una se
+        # recorre por su propio índice con LIMIT página+1 y después se mezclan: en Postgres en
+        # una sola consulta (UNION ALL de las ramas limitadas); si la base de datos no admite
+        # LIMIT dentro de un UNION (SQLite), una consulta por rama y la mezcla en Python.
+        branches = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, branches[0], view)
+
+        position, reverse = self.decode_cursor(request, branches[0])
+        query_ordering = _flip(self.ordering) if reverse else self.ordering
+
+        pages = []
+        for branch in branches:
+            branch = branch.order_by(*query_ordering)
+            if position is not None:
+                branch = branch.filter(keyset_filter(query_ordering, position))
+            pages.append(branch[:self.page_size + 1])
+        if len(pages) == 1:
+            return pages[0], position, reverse
+        if connections[pages[0].db].features.supports_slicing_ordering_in_compound:
+            merged = pages[0].union(*pages[1:], all=True).order_by(*query_ordering)
+            return merged[:self.page_size + 1], position, reverse
+        return pages, position, reverse
+
+    def _merge(self, pages, reverse):
+        # Ordena las filas de todas las ramas según query_ordering (orden estable campo a campo)
+        results = [row for page in pages for row in page]
+        for field in reversed(_flip(self.ordering) if reverse else self.ordering):
+            results.sort(key=lambda row: getattr(row, field.lstrip('-')), reverse=field.startswith('-'))
+        return results[:self.page_size + 1]
+
+    def _set_page(self, results, position, reverse):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self._position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self._link(self._position(self.page[0]), reverse=True)
+
+    def _link(self, position, reverse):
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(position, reverse))
+
+    def _position(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def encode_cursor(self, position, reverse=False):
+        payload = {'p': [_encode_value(value) for value in position]}
+        if reverse:
+            payload['r'] = 1
+        raw = json.dumps(payload, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            payload = json.loads(raw)
+            values = payload['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                _decode_value(queryset.model, field.lstrip('-'), value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(payload.get('r'))
+
+
+class MessageCursorPagination(KeysetCursorPagination):
+    ordering = ('-sent_at', '-id')
+
+
+class ConversationCursorPagination(KeysetCursorPagination):
+    ordering = ('-last_message_at', '-id')
+
+
+class UserCursorPagination(KeysetCursorPagination):
+    ordering = ('username_search', 'id')
+
+
+def _flip(ordering):
+    return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+
+def keyset_filter(ordering, position):
+    # Construye (a, b, c) < (x, y, z) como
+    #   a <= x AND (a < x OR (b <= y AND (b < y OR c < z)))
+    # para que el primer campo quede como condición de rango sobre el índice.
+    field, value = ordering[0], position[0]
+    name = field.lstrip('-')
+    strict, loose = ('lt', 'lte') if field.startswith('-') else ('gt', 'gte')
+    if len(ordering) == 1:
+        return Q(**{f'{name}__{strict}': value})
+    rest = keyset_filter(ordering[1:], position[1:])
+    return Q(**{f'{name}__{loose}': value}) & (Q(**{f'{name}__{strict}': value}) | rest)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(model, name, value):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return value
+    return field.to_python(value)
@@ -0,0 +1,91 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import metrics
+from .images import thumbnail_key, thumbnail_sizes
+
+# Registro compacto por usuario con lo necesario para pintarlo junto a un mensaje
+CACHE_KEY = 'profile:v2:{}'
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _cache():
+    return caches[settings.PROFILE_CACHE_ALIAS]
+
+
+def _count(hits, misses):
+    if hits or misses:
+        with _stats_lock:
+            _stats['hits'] += hits
+            _stats['misses'] += misses
+    # Y en /metrics (profile_cache_lookups_total)
+    if hits:
+        metrics.PROFILE_CACHE.inc('hit', amount=hits)
+    if misses:
+        metrics.PROFILE_CACHE.inc('miss', amount=misses)
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.update(hits=0, misses=0)
+
+
+def build_profile(user):
+    avatar = user.avatar.name if user.avatar else ''
+    storage = user.avatar.storage
+    return {
+        'id': user.id,
+        'username': user.username,
+        'avatar': avatar,
+        'avatar_url': storage.url(avatar) if avatar else None,
+        'avatar_thumbnails': {
+            str(size): storage.url(thumbnail_key(avatar, size)) for size in thumbnail_sizes('avatar')
+        } if avatar and user.avatar_processed else None,
+    }
+
+
+def get_profiles(user_ids, loaded=None):
+    # {id: registro}. Los que no están en caché se construyen con los usuarios ya
+    # cargados en `loaded` ({id: usuario}) o, si faltan, con una única consulta IN.
+    from .models import CustomUser, PARTICIPANT_FIELDS
+
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    cache = _cache()
+    cached = cache.get_many([CACHE_KEY.format(user_id) for user_id in user_ids])
+    profiles = {profile['id']: profile for profile in cached.values()}
+    missing = user_ids - profiles.keys()
+    _count(len(profiles), len(missing))
+    if missing:
+        loaded = loaded or {}
+        users = [loaded[user_id] for user_id in missing if user_id in loaded]
+        to_query = missing - loaded.keys()
+        if to_query:
+            users += list(CustomUser.objects.filter(id__in=to_query).only(*PARTICIPANT_FIELDS))
+        built = {user.id: build_profile(user) for user in users}
+        cache.set_many({CACHE_KEY.format(user_id): profile for user_id, profile in built.items()}, settings.PROFILE_CACHE_TIMEOUT)
+        profiles.update(built)
+    return profiles
+
+
+def get_profile(user_id, loaded=None):
+    return get_profiles([user_id], {user_id: loaded} if loaded is not None else None).get(user_id)
+
+
+def invalidate_profile(user_id):
+    # Ahora (para leer lo que se acaba de escribir) y otra vez tras el commit,
+    # por si otra petición volvió a cachear el valor antiguo entretanto.
+    key = CACHE_KEY.format(user_id)
+    _cache().delete(key)
+    transaction.on_commit(lambda: _cache().delete(key))
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class InMemoryBroker:
+    # Pub/sub en memoria del proceso. Sirve para tests y para un único proceso
+    # ASGI que atiende HTTP y WebSocket; con varios procesos usar RedisBroker.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def publish(self, channel, data):
+        # Se llama desde vistas síncronas: entrega a cada suscriptor en su bucle
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, data)
+
+    async def subscribe(self, channel):
+        subscription = _QueueSubscription(self, channel)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            channel_subscriptions = self._subscriptions.get(subscription.channel)
+            if channel_subscriptions is not None:
+                channel_subscriptions.discard(subscription)
+                if not channel_subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+
+class _QueueSubscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    async def get(self):
+        return await self.queue.get()
+
+    async def close(self):
+        self.broker._unsubscribe(self)
+
+
+class RedisBroker:
+    # Mismo interfaz sobre PUBLISH/SUBSCRIBE de Redis. Los clientes se pueden
+    # inyectar para usar un sustituto local compatible (p. ej. fakeredis).
+    def __init__(self, url=None, client=None, async_client=None):
+        url = url or settings.REALTIME_REDIS_URL
+        if client is None or async_client is None:
+            import redis
+            import redis.asyncio
+            client = client or redis.Redis.from_url(url)
+            async_client = async_client or redis.asyncio.Redis.from_url(url)
+        self._client = client
+        self._async_client = async_client
+
+    def publish(self, channel, data):
+        self._client.publish(channel, data)
+
+    async def subscribe(self, channel):
+        pubsub = self._async_client.pubsub()
+        await pubsub.subscribe(channel)
+        return _RedisSubscription(pubsub, channel)
+
+
+class _RedisSubscription:
+    def __init__(self, pubsub, channel):
+        self.pubsub = pubsub
+        self.channel = channel
+
+    async def get(self):
+        while True:
+            message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+            if message and message.get('type') == 'message':
+                data = message['data']
+                return data.decode() if isinstance(data, bytes) else data
+
+    async def close(self):
+        await self.pubsub.unsubscribe(self.channel)
+        await self.pubsub.aclose()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.REALTIME_BROKER)()
+    return _broker
+
+
+def set_broker(broker):
+    # Permite sustituir el backend (tests, benchmarks)
+    global _broker
+    with _broker_lock:
+        _broker = broker
+
+
+def publish_on_commit(user_id, event_type, data):
+    payload = json.dumps({'type': event_type, 'data': data}, ensure_ascii=False, default=str)
+    channel = user_channel(user_id)
+    transaction.on_commit(lambda: get_broker().publish(channel, payload))
+
+
+def notify_new_message(message, data):
+    # Envía el mensaje serializado al receptor cuando la transacción confirme
+    publish_on_commit(message.receiver_id, 'message.created', data)
+
+
+def notify_receipt(sender_id, event_type, reader_id, up_to_id, at):
+    # Avisa al emisor de que el receptor ha recibido/leído sus mensajes hasta up_to_id
+    publish_on_commit(sender_id, event_type, {'user': reader_id, 'up_to': up_to_id, 'at': at.isoformat()})
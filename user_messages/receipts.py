@@ -0,0 +1,55 @@
+from django.db import transaction
+from django.db.models import DateTimeField, F, Q, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Conversation, Message
+from .realtime import notify_receipt
+
+
+def _received_from(user, counterpart_id, up_to_id):
+    return Message.objects.filter(receiver=user, sender_id=counterpart_id, id__lte=up_to_id, read_at__isnull=True)
+
+
+def mark_read(user, counterpart_id, up_to_id):
+    # Un UPDATE para los mensajes y otro para el contador, en la misma transacción.
+    # El descuento es relativo: no pisa envíos concurrentes. Devuelve cuántos se marcaron.
+    now = timezone.now()
+    with transaction.atomic():
+        count = _received_from(user, counterpart_id, up_to_id).update(
+            read_at=now,
+            delivered_at=Coalesce('delivered_at', Value(now, output_field=DateTimeField())),
+            updated_at=now,
+        )
+        if count:
+            low, high = sorted((user.id, counterpart_id))
+            unread_field = Conversation.unread_field(user.id, counterpart_id)
+            Conversation.objects.filter(user_low_id=low, user_high_id=high).update(
+                **{unread_field: Greatest(F(unread_field) - count, Value(0))}
+            )
+            notify_receipt(counterpart_id, 'messages.read', user.id, up_to_id, now)
+    return count, now
+
+
+def mark_delivered(user, counterpart_id, up_to_id):
+    # Leído implica entregado: solo se tocan los no leídos (índice parcial)
+    now = timezone.now()
+    with transaction.atomic():
+        count = _received_from(user, counterpart_id, up_to_id).filter(delivered_at__isnull=True).update(
+            delivered_at=now, updated_at=now,
+        )
+        if count:
+            notify_receipt(counterpart_id, 'messages.delivered', user.id, up_to_id, now)
+    return count, now
+
+
+def unread_counts(user):
+    # Todos los contadores del usuario en una lectura sobre los índices parciales
+    rows = Conversation.objects.filter(
+        Q(user_low=user, unread_low__gt=0) | Q(user_high=user, unread_high__gt=0)
+    ).values_list('user_low_id', 'user_high_id', 'unread_low', 'unread_high')
+    conversations = [
+        {'user': high, 'unread': unread_low} if low == user.id else {'user': low, 'unread': unread_high}
+        for low, high, unread_low, unread_high in rows
+    ]
+    return {'total': sum(row['unread'] for row in conversations), 'conversations': conversations}
@@ -0,0 +1,145 @@
+import gzip
+import json
+import os
+import re
+from collections import Counter
+from datetime import timedelta
+from functools import reduce
+from io import BytesIO
+from operator import or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import storage
+from .models import ArchivedImage, ArchivedMessage, Conversation, Message
+
+# Ciclo de vida de los mensajes: los anteriores al horizonte de retención salen de la tabla
+# caliente por lotes, a ArchivedMessage o a JSONL comprimido en storage
+# (archive/messages/<primer id>-<último id>.jsonl.gz, con sus imágenes en ArchivedImage).
+# Cada lote es una transacción corta que solo bloquea sus filas, así que los envíos y
+# acuses no esperan.
+#
+# Message no se particiona por sent_at en Postgres: la clave primaria tendría que incluir
+# sent_at y Conversation.last_message ya no podría apuntar a la tabla. Archivar mantiene la
+# tabla (y sus índices) acotada al periodo de retención, que es lo que leen las vistas.
+
+TABLE = 'table'
+STORAGE = 'storage'
+TARGETS = (TABLE, STORAGE)
+
+ARCHIVE_FIELDS = ('id', 'sender_id', 'receiver_id', 'content', 'image', 'sent_at', 'delivered_at', 'read_at')
+
+# messages/1/abc.png, messages/1/abc.webp y la miniatura messages/1/abc_256.webp -> messages/1/abc
+_THUMBNAIL_SUFFIX = re.compile(r'_\d+$')
+
+
+def retention_cutoff(days=None):
+    return timezone.now() - timedelta(days=settings.MESSAGE_RETENTION_DAYS if days is None else days)
+
+
+def archive_key(rows):
+    return f"archive/messages/{rows[0]['id']:012d}-{rows[-1]['id']:012d}.jsonl.gz"
+
+
+def archive_batch(cutoff, batch_size=None, target=TABLE):
+    # Archiva el siguiente lote; devuelve cuántos mensajes salieron de la tabla (0 = terminado).
+    # Los ids crecen con sent_at: los más antiguos están al principio de la clave primaria y
+    # basta leer su cabeza, sin índice sobre sent_at ni recorrer la tabla.
+    batch_size = batch_size or settings.MESSAGE_ARCHIVE_BATCH_SIZE
+    head = Message.objects.order_by('id').values_list('id', 'sent_at')[:batch_size]
+    ids = []
+    for message_id, sent_at in head:
+        if sent_at >= cutoff:
+            break
+        ids.append(message_id)
+    if not ids:
+        return 0
+
+    with transaction.atomic():
+        # Las filas que otra transacción tiene bloqueadas se quedan para el siguiente lote
+        rows = list(
+            Message.objects.select_for_update(skip_locked=True)
+            .filter(id__in=ids, sent_at__lt=cutoff).order_by('id').values(*ARCHIVE_FIELDS)
+        )
+        if not rows:
+            return 0
+        if target == STORAGE:
+            key = _upload_rows(rows)
+            ArchivedImage.objects.bulk_create(
+                [ArchivedImage(image=row['image'], archive_key=key) for row in rows if row['image']], ignore_conflicts=True,
+            )
+        else:
+            ArchivedMessage.objects.bulk_create(
+                [ArchivedMessage(**{**row, 'image': row['image'] or ''}) for row in rows], ignore_conflicts=True,
+            )
+        _release_conversations(rows)
+        _delete_rows([row['id'] for row in rows])
+    return len(rows)
+
+
+def _delete_rows(ids):
+    # DELETE directo, sin el borrado de Django: sin señales (archivar no es borrar, no se crean
+    # tombstones para la sincronización) ni la lectura previa de las filas que este necesita
+    table = connection.ops.quote_name(Message._meta.db_table)
+    column = connection.ops.quote_name(Message._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({', '.join(['%s'] * len(ids))})", ids)
+
+
+def _upload_rows(rows):
+    # Lote de como mucho MESSAGE_ARCHIVE_BATCH_SIZE mensajes: cabe en memoria.
+    # La clave depende solo de los ids: si la transacción falla, el reintento la sobrescribe.
+    buffer = BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as archive:
+        for row in rows:
+            record = {key: value.isoformat() if hasattr(value, 'isoformat') else value for key, value in row.items()}
+            archive.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode())
+            archive.write(b'\n')
+    buffer.seek(0)
+    key = archive_key(rows)
+    storage.upload_fileobj(buffer, key, 'application/gzip')
+    return key
+
+
+def _release_conversations(rows):
+    # Las conversaciones dejan de apuntar a los mensajes archivados (conservan el extracto)
+    # y los no leídos archivados se descuentan, como en receipts.mark_read. archived_at marca
+    # los pares afectados: los mensajes salen de los listados sin tombstone y su ETag
+    # (conditional.message_watermark) tiene que cambiar igualmente.
+    Conversation.objects.filter(last_message_id__in=[row['id'] for row in rows]).update(last_message=None)
+    pairs = {tuple(sorted((row['sender_id'], row['receiver_id']))) for row in rows}
+    Conversation.objects.filter(
+        reduce(or_, (Q(user_low_id=low, user_high_id=high) for low, high in pairs))
+    ).update(archived_at=timezone.now())
+    unread = Counter((row['receiver_id'], row['sender_id']) for row in rows if row['read_at'] is None)
+    for (receiver_id, sender_id), count in unread.items():
+        low, high = sorted((receiver_id, sender_id))
+        unread_field = Conversation.unread_field(receiver_id, sender_id)
+        Conversation.objects.filter(user_low_id=low, user_high_id=high).update(
+            **{unread_field: Greatest(F(unread_field) - count, Value(0))}
+        )
+
+
+def image_stem(key):
+    return _THUMBNAIL_SUFFIX.sub('', os.path.splitext(key)[0])
+
+
+def orphaned_image_keys(grace_seconds=None):
+    # Objetos de messages/ (originales, procesados y miniaturas) sin mensaje que los use, ni
+    # en las tablas ni en los archivos de storage.
+    # Los recientes se respetan: pueden ser subidas directas aún sin confirmar. Las
+    # referencias se leen después del listado para que un envío entretanto no se pierda.
+    grace_seconds = settings.ORPHAN_IMAGE_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    older_than = timezone.now() - timedelta(seconds=grace_seconds)
+    candidates = [item['Key'] for item in storage.list_objects('messages/') if item['LastModified'] < older_than]
+    if not candidates:
+        return []
+    referenced = set()
+    for model in (Message, ArchivedMessage, ArchivedImage):
+        images = model.objects.exclude(image__isnull=True).exclude(image='').values_list('image', flat=True)
+        referenced.update(image_stem(image) for image in images.iterator(chunk_size=settings.MESSAGE_ARCHIVE_BATCH_SIZE))
+    return [key for key in candidates if image_stem(key) not in referenced]
@@ -0,0 +1,41 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+
+from .models import Message
+
+# Diccionario de Postgres; debe coincidir con el trigger de la migración 0009
+SEARCH_CONFIG = 'spanish'
+
+RANKED_ORDERING = ('-rank', '-sent_at', '-id')
+RECENT_ORDERING = ('-sent_at', '-id')
+
+
+def full_text_enabled():
+    return connection.vendor == 'postgresql'
+
+
+def rank(query):
+    # ts_rank devuelve real (float4) y el cursor lleva el valor como float de Python: comparado
+    # con un real, el texto decimal no siempre vuelve al mismo valor y los empates (muy
+    # frecuentes) se repetirían o saltarían entre páginas. En double precision sí es exacto.
+    return Cast(SearchRank(F('search_vector'), query), FloatField())
+
+
+def search_messages(user, text):
+    # Devuelve (queryset, ordenación keyset) con los mensajes del usuario que coinciden.
+    # En Postgres usa el índice GIN de search_vector y ordena por relevancia. En otras bases
+    # de datos (desarrollo y tests) recurre a LIKE sobre el contenido, del más reciente al más
+    # antiguo: recorre todos los mensajes del usuario sin índice, no sirve para producción.
+    messages = Message.objects.for_timeline(user)
+    if not full_text_enabled():
+        return messages.filter(content__icontains=text), RECENT_ORDERING
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    messages = messages.filter(search_vector=query).annotate(rank=rank(query))
+    return messages, RANKED_ORDERING
+
+
+def search_vector():
+    # Misma expresión que el trigger, para rellenar mensajes existentes
+    return SearchVector('content', config=SEARCH_CONFIG)
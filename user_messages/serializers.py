@@ -1,11 +1,34 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from rest_framework.validators import UniqueValidator
-from .models import Message
-from django.utils.timezone import localtime
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from .authentication import user_for_token
+from .models import Conversation, CustomUser, Message, MessageExport
+from django.utils.encoding import iri_to_uri
+from django.utils.timezone import get_current_timezone, localtime
+from .exports import download_urls
+from .identity import TOKEN_VERSION_CLAIM
+from .images import thumbnail_key, thumbnail_sizes
+from .profiles import get_profile, get_profiles
 
 User = get_user_model()
 
+
+def format_local_datetime(value, timezone=None):
+    local_value = localtime(value, timezone)
+    timezone_name = local_value.tzname() or ''  # Evita None si no tiene zona definida
+    return f"{local_value.strftime('%d/%m/%Y %H:%M:%S')} {timezone_name}"
+
+
+def thumbnail_url(request, field_file, processed, size):
+    # URL de la miniatura generada por el procesado de imágenes (clave determinista); sin
+    # procesar (pendiente o rechazada) no existe
+    if not field_file or not processed:
+        return None
+    url = field_file.storage.url(thumbnail_key(field_file.name, size))
+    return request.build_absolute_uri(url) if request else url
+
+
 class RegisterSerializer(serializers.ModelSerializer):
     username = serializers.CharField(
         required=True,
@@ -29,47 +52,212 @@ class RegisterSerializer(serializers.ModelSerializer):
         )
         return user
 
-class MessageSerializer(serializers.ModelSerializer):
+
+class VersionedTokenObtainPairSerializer(TokenObtainPairSerializer):
+    # Login: el token lleva la token_version actual (la copia también el de acceso)
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[TOKEN_VERSION_CLAIM] = user.token_version
+        return token
+
+
+class VersionedTokenRefreshSerializer(TokenRefreshSerializer):
+    # No renueva tokens revocados por un cambio de contraseña o una desactivación
+    def validate(self, attrs):
+        user_for_token(self.token_class(attrs['refresh']))
+        return super().validate(attrs)
+
+def loaded_related(obj, name):
+    # El objeto relacionado si ya está cargado (select_related), sin lanzar consultas
+    field = obj._meta.get_field(name)
+    return getattr(obj, name) if field.is_cached(obj) else None
+
+
+class ProfileListSerializer(serializers.ListSerializer):
+    # Lee de la caché los perfiles de todas las filas con un único get_many
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        users = {}
+        for item in items:
+            users.update(self.child.profile_users(item))
+        self.child.profiles = get_profiles(users, {user_id: user for user_id, user in users.items() if user is not None})
+        return super().to_representation(items)
+
+
+class ProfileSerializerMixin:
+    profiles = None
+
+    def profile(self, user_id, user=None):
+        if self.profiles is None:
+            self.profiles = {}
+        if user_id not in self.profiles:
+            self.profiles[user_id] = get_profile(user_id, user)
+        return self.profiles[user_id]
+
+    def absolute_url(self, url):
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request and url else url
+
+    def avatar_url(self, user_id, user=None):
+        profile = self.profile(user_id, user)
+        return self.absolute_url(profile['avatar_url']) if profile else None
+
+    def avatar_thumbnail_url(self, user_id, user=None, size=None):
+        profile = self.profile(user_id, user)
+        if not profile or not profile['avatar_thumbnails']:
+            return None
+        return self.absolute_url(profile['avatar_thumbnails'][str(size or min(thumbnail_sizes('avatar')))])
+
+
+class MessageSerializer(ProfileSerializerMixin, serializers.ModelSerializer):
     sender_username = serializers.CharField(source='sender.username', read_only=True)
     receiver_username = serializers.CharField(source='receiver.username', read_only=True)
     sent_at = serializers.SerializerMethodField()
+    delivered_at = serializers.SerializerMethodField()
+    read_at = serializers.SerializerMethodField()
 
     # Obtener la URL de la imagen de la persona que envía/recibe el mensaje
     sender_avatar_url = serializers.SerializerMethodField()
     receiver_avatar_url = serializers.SerializerMethodField()
 
+    # Miniaturas: la más pequeña de cada tipo
+    image_thumbnail_url = serializers.SerializerMethodField()
+    sender_avatar_thumbnail_url = serializers.SerializerMethodField()
+    receiver_avatar_thumbnail_url = serializers.SerializerMethodField()
+
     class Meta:
         model = Message
-        fields = ['id', 'sender', 'sender_username', 'sender_avatar_url', 'receiver', 'receiver_username', 'receiver_avatar_url', 'content', 'image', 'sent_at']
+        fields = ['id', 'sender', 'sender_username', 'sender_avatar_url', 'receiver', 'receiver_username', 'receiver_avatar_url', 'content', 'image', 'sent_at', 'image_thumbnail_url', 'sender_avatar_thumbnail_url', 'receiver_avatar_thumbnail_url', 'delivered_at', 'read_at']
         read_only_fields = ['sender', 'sent_at']
+        list_serializer_class = ProfileListSerializer
+
+    def profile_users(self, obj):
+        return {obj.sender_id: loaded_related(obj, 'sender'), obj.receiver_id: loaded_related(obj, 'receiver')}
 
     def get_sent_at(self, obj):
-        local_sent = localtime(obj.sent_at)
-        timezone_name = local_sent.tzname() or ''  # Evita None si no tiene zona definida
-        return f"{local_sent.strftime('%d/%m/%Y %H:%M:%S')} {timezone_name}"
+        return format_local_datetime(obj.sent_at)
+
+    def get_delivered_at(self, obj):
+        return format_local_datetime(obj.delivered_at) if obj.delivered_at else None
+
+    def get_read_at(self, obj):
+        return format_local_datetime(obj.read_at) if obj.read_at else None
     
     # Obtener la URL de la imagen de la persona que envía/recibe el mensaje
     def get_sender_avatar_url(self, obj):
-        request = self.context.get('request')
-        return request.build_absolute_uri(obj.sender.avatar.url) if obj.sender.avatar else None
+        return self.avatar_url(obj.sender_id, loaded_related(obj, 'sender'))
     
     def get_receiver_avatar_url(self, obj):
-        request = self.context.get('request')
-        return request.build_absolute_uri(obj.receiver.avatar.url) if obj.receiver.avatar else None
+        return self.avatar_url(obj.receiver_id, loaded_related(obj, 'receiver'))
+
+    def get_image_thumbnail_url(self, obj):
+        return thumbnail_url(self.context.get('request'), obj.image, obj.image_processed, min(thumbnail_sizes('message')))
+
+    def get_sender_avatar_thumbnail_url(self, obj):
+        return self.avatar_thumbnail_url(obj.sender_id, loaded_related(obj, 'sender'))
+
+    def get_receiver_avatar_thumbnail_url(self, obj):
+        return self.avatar_thumbnail_url(obj.receiver_id, loaded_related(obj, 'receiver'))
     
-class UserSerializer(serializers.ModelSerializer):
+class AbsoluteUrls:
+    # request.build_absolute_uri con el esquema y host calculados una vez por petición
+    def __init__(self, request):
+        self.request = request
+        self.prefix = None
+
+    def __call__(self, url):
+        if not url or self.request is None:
+            return url
+        # El caso habitual de build_absolute_uri (ruta absoluta sin '.' ni '..'), sin urlsplit
+        if url.startswith('/') and not url.startswith('//') and '/./' not in url and '/../' not in url:
+            if self.prefix is None:
+                self.prefix = self.request.build_absolute_uri('/')[:-1]
+            return iri_to_uri(self.prefix + url)
+        return self.request.build_absolute_uri(url)
+
+
+class MessageRowSerializer:
+    # Misma salida que MessageSerializer(many=True), para listados: trabaja sobre las filas
+    # de Message.objects.rows() sin instanciar modelos ni pasar por los campos de DRF.
+    # Zona horaria, prefijo de URL y URLs de avatar se calculan una vez por lote.
+    def __init__(self, rows, context=None):
+        self.rows = rows
+        self.context = context or {}
+
+    @property
+    def data(self):
+        return list(self.iter_data())
+
+    def iter_data(self):
+        rows = list(self.rows)
+        absolute = AbsoluteUrls(self.context.get('request'))
+        timezone = get_current_timezone()
+        image_storage = Message._meta.get_field('image').storage
+        image_size = min(thumbnail_sizes('message'))
+        avatar_size = str(min(thumbnail_sizes('avatar')))
+
+        users = {}
+        for row in rows:
+            users[row.sender_id] = CustomUser(
+                id=row.sender_id, username=row.sender__username, avatar=row.sender__avatar, avatar_processed=row.sender__avatar_processed,
+            )
+            users[row.receiver_id] = CustomUser(
+                id=row.receiver_id, username=row.receiver__username, avatar=row.receiver__avatar, avatar_processed=row.receiver__avatar_processed,
+            )
+        avatars = {}
+        for user_id, profile in get_profiles(users, users).items():
+            thumbnails = profile['avatar_thumbnails']
+            avatars[user_id] = (
+                absolute(profile['avatar_url']),
+                absolute(thumbnails[avatar_size]) if thumbnails else None,
+            )
+
+        for row in rows:
+            sender_avatar, sender_thumbnail = avatars.get(row.sender_id, (None, None))
+            receiver_avatar, receiver_thumbnail = avatars.get(row.receiver_id, (None, None))
+            image = row.image
+            yield {
+                'id': row.id,
+                'sender': row.sender_id,
+                'sender_username': row.sender__username,
+                'sender_avatar_url': sender_avatar,
+                'receiver': row.receiver_id,
+                'receiver_username': row.receiver__username,
+                'receiver_avatar_url': receiver_avatar,
+                'content': row.content,
+                'image': absolute(image_storage.url(image)) if image else None,
+                'sent_at': format_local_datetime(row.sent_at, timezone),
+                'image_thumbnail_url': absolute(image_storage.url(thumbnail_key(image, image_size))) if image and row.image_processed else None,
+                'sender_avatar_thumbnail_url': sender_thumbnail,
+                'receiver_avatar_thumbnail_url': receiver_thumbnail,
+                'delivered_at': format_local_datetime(row.delivered_at, timezone) if row.delivered_at else None,
+                'read_at': format_local_datetime(row.read_at, timezone) if row.read_at else None,
+            }
+
+
+class UserSerializer(ProfileSerializerMixin, serializers.ModelSerializer):
     avatar_url = serializers.SerializerMethodField()
+    avatar_thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'avatar', 'avatar_url']
+        fields = ['id', 'username', 'email', 'avatar', 'avatar_url', 'avatar_thumbnails']
         read_only_fields = ['id', 'username', 'email']
+        list_serializer_class = ProfileListSerializer
+
+    def profile_users(self, obj):
+        return {obj.id: obj}
     
     def get_avatar_url(self, obj):
-        request = self.context.get('request')
-        if obj.avatar:
-            return request.build_absolute_uri(obj.avatar.url) if request else obj.avatar.url
-        return None
+        return self.avatar_url(obj.id, obj)
+
+    def get_avatar_thumbnails(self, obj):
+        # {"40": url, "128": url} o None si no hay avatar
+        profile = self.profile(obj.id, obj)
+        if not profile or not profile['avatar_thumbnails']:
+            return None
+        return {size: self.absolute_url(url) for size, url in profile['avatar_thumbnails'].items()}
     
     def to_representation(self, instance):
         # Fuerza avatar como ruta relativa si hay imagen
@@ -77,4 +265,79 @@ class UserSerializer(serializers.ModelSerializer):
         ret = super().to_representation(instance)
         if instance.avatar:
             ret['avatar'] = instance.avatar.url
-        return ret
\ No newline at end of file
+        return ret
+
+
+class UserPickerSerializer(ProfileSerializerMixin, serializers.ModelSerializer):
+    # Representación ligera para el selector de contactos
+    avatar_thumbnail_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'avatar_thumbnail_url']
+        list_serializer_class = ProfileListSerializer
+
+    def profile_users(self, obj):
+        return {obj.id: obj}
+
+    def get_avatar_thumbnail_url(self, obj):
+        return self.avatar_thumbnail_url(obj.id, obj)
+
+
+class ConversationSerializer(serializers.ModelSerializer):
+    # Resumen de una conversación desde el punto de vista del usuario autenticado
+    counterpart = serializers.SerializerMethodField()
+    counterpart_username = serializers.SerializerMethodField()
+    counterpart_avatar_url = serializers.SerializerMethodField()
+    counterpart_avatar_thumbnail_url = serializers.SerializerMethodField()
+    last_message_id = serializers.IntegerField(read_only=True)
+    last_message_at = serializers.SerializerMethodField()
+    unread_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Conversation
+        fields = ['id', 'counterpart', 'counterpart_username', 'counterpart_avatar_url', 'counterpart_avatar_thumbnail_url', 'last_message_id', 'last_message_snippet', 'last_message_at', 'unread_count']
+
+    def _counterpart(self, obj):
+        return obj.counterpart(self.context['request'].user)
+
+    def get_counterpart(self, obj):
+        return self._counterpart(obj).id
+
+    def get_counterpart_username(self, obj):
+        return self._counterpart(obj).username
+
+    def get_counterpart_avatar_url(self, obj):
+        request = self.context.get('request')
+        counterpart = self._counterpart(obj)
+        return request.build_absolute_uri(counterpart.avatar.url) if counterpart.avatar else None
+
+    def get_counterpart_avatar_thumbnail_url(self, obj):
+        counterpart = self._counterpart(obj)
+        return thumbnail_url(self.context.get('request'), counterpart.avatar, counterpart.avatar_processed, min(thumbnail_sizes('avatar')))
+
+    def get_last_message_at(self, obj):
+        return format_local_datetime(obj.last_message_at)
+
+    def get_unread_count(self, obj):
+        return obj.unread_for(self.context['request'].user)
+
+
+class MessageExportSerializer(serializers.ModelSerializer):
+    created_at = serializers.SerializerMethodField()
+    completed_at = serializers.SerializerMethodField()
+    # Manifiesto y partes, solo cuando la exportación ha terminado
+    files = serializers.SerializerMethodField()
+
+    class Meta:
+        model = MessageExport
+        fields = ['id', 'format', 'status', 'message_count', 'parts', 'created_at', 'completed_at', 'files']
+
+    def get_created_at(self, obj):
+        return format_local_datetime(obj.created_at)
+
+    def get_completed_at(self, obj):
+        return format_local_datetime(obj.completed_at) if obj.completed_at else None
+
+    def get_files(self, obj):
+        return download_urls(obj)
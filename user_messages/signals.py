@@ -0,0 +1,25 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .identity import invalidate_identity
+from .models import CustomUser, Message, MessageTombstone, VersionCounter
+from .profiles import invalidate_profile
+
+
+@receiver(post_delete, sender=Message)
+def record_message_tombstone(sender, instance, **kwargs):
+    # Incluye borrados en cascada (p. ej. al eliminar un usuario)
+    MessageTombstone.objects.create(
+        message_id=instance.id,
+        sender_id=instance.sender_id,
+        receiver_id=instance.receiver_id,
+    )
+
+
+@receiver(post_delete, sender=CustomUser)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    # Un token de un usuario borrado no debe autenticar con la identidad cacheada;
+    # el directorio y los listados donde aparecía cambian
+    invalidate_identity(instance.id)
+    invalidate_profile(instance.id)
+    VersionCounter.objects.bump(VersionCounter.DIRECTORY)
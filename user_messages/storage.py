@@ -0,0 +1,266 @@
+import threading
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .metrics import timed_s3
+
+# Máximo de claves por llamada a DeleteObjects
+DELETE_BATCH_SIZE = 1000
+
+# boto3/botocore se importan al crear el cliente (o en preload()): cargarlos cuesta ~200 ms
+# y ni manage.py ni las peticiones que no tocan S3 los necesitan.
+
+# Un único cliente S3 por proceso. Los clientes de boto3 son thread-safe y
+# mantienen su propio pool de conexiones HTTP, así que reutilizarlo evita
+# resolver credenciales y negociar TLS en cada petición.
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_client()
+    return _client
+
+
+def set_client(client):
+    # Sustituye el cliente (tests, benchmarks); None fuerza a crearlo de nuevo
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def preload():
+    # Importa el SDK sin crear el cliente: en el proceso maestro de gunicorn (preload_app)
+    # los workers lo heredan ya cargado. El cliente se crea en cada worker tras el fork.
+    import boto3.session  # noqa: F401
+    import botocore.config  # noqa: F401
+    import botocore.exceptions  # noqa: F401
+
+
+def _create_client():
+    import boto3.session
+    from botocore.config import Config
+
+    session = boto3.session.Session(
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        region_name=settings.AWS_S3_REGION_NAME,
+    )
+    client_config = settings.AWS_S3_CLIENT_CONFIG
+    if isinstance(client_config, dict):
+        client_config = Config(**client_config)
+    return session.client('s3', config=client_config)
+
+
+def bucket_name():
+    return settings.AWS_STORAGE_BUCKET_NAME
+
+
+@timed_s3('upload_fileobj')
+def upload_fileobj(fileobj, key, content_type):
+    get_client().upload_fileobj(
+        fileobj,
+        bucket_name(),
+        key,
+        ExtraArgs={
+            "ContentType": content_type,
+            "ContentDisposition": "inline",
+        }
+    )
+
+
+@timed_s3('download_fileobj')
+def download_fileobj(key, fileobj):
+    get_client().download_fileobj(bucket_name(), key, fileobj)
+
+
+@timed_s3('delete_object')
+def delete_object(key):
+    get_client().delete_object(Bucket=bucket_name(), Key=key)
+
+
+@timed_s3('delete_objects')
+def _delete_batch(keys):
+    response = get_client().delete_objects(
+        Bucket=bucket_name(),
+        Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True},
+    )
+    return [error['Key'] for error in response.get('Errors', [])]
+
+
+def delete_objects(keys):
+    # Borra en lotes de DELETE_BATCH_SIZE (una llamada por lote); devuelve las claves que fallaron
+    keys = list(keys)
+    failed = []
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        failed.extend(_delete_batch(keys[start:start + DELETE_BATCH_SIZE]))
+    return failed
+
+
+@timed_s3('list_objects')
+def _list_page(prefix, token):
+    kwargs = {'Bucket': bucket_name(), 'Prefix': prefix}
+    if token:
+        kwargs['ContinuationToken'] = token
+    return get_client().list_objects_v2(**kwargs)
+
+
+def list_objects(prefix):
+    # Recorre los objetos bajo `prefix` página a página (hasta 1000 por llamada)
+    token = None
+    while True:
+        page = _list_page(prefix, token)
+        yield from page.get('Contents', [])
+        if not page.get('IsTruncated'):
+            return
+        token = page['NextContinuationToken']
+
+
+@timed_s3('head_object')
+def head_object(key):
+    # Metadatos del objeto o None si no existe
+    from botocore.exceptions import ClientError
+
+    try:
+        return get_client().head_object(Bucket=bucket_name(), Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+@timed_s3('presigned_post')
+def presigned_post(key, content_type, max_size, expires_in):
+    # Formulario firmado para que el cliente suba directamente a S3;
+    # S3 rechaza cuerpos de otro tipo o fuera del rango de tamaño.
+    return get_client().generate_presigned_post(
+        Bucket=bucket_name(),
+        Key=key,
+        Fields={'Content-Type': content_type, 'Content-Disposition': 'inline'},
+        Conditions=[
+            {'Content-Type': content_type},
+            {'Content-Disposition': 'inline'},
+            ['content-length-range', 1, max_size],
+        ],
+        ExpiresIn=expires_in,
+    )
+
+
+@timed_s3('presigned_get')
+def presigned_get(key, expires_in):
+    # URL de descarga temporal de un objeto: la firma caduca a los expires_in segundos
+    return get_client().generate_presigned_url(
+        'get_object', Params={'Bucket': bucket_name(), 'Key': key}, ExpiresIn=expires_in,
+    )
+
+
+# Versiones no bloqueantes para las vistas async: la llamada a boto3 corre en un hilo
+# del pool (thread_sensitive=False) y el bucle de eventos sigue atendiendo otras
+# peticiones mientras se espera a S3.
+aupload_fileobj = sync_to_async(upload_fileobj, thread_sensitive=False)
+adownload_fileobj = sync_to_async(download_fileobj, thread_sensitive=False)
+adelete_object = sync_to_async(delete_object, thread_sensitive=False)
+ahead_object = sync_to_async(head_object, thread_sensitive=False)
+apresigned_post = sync_to_async(presigned_post, thread_sensitive=False)
+
+
+class InMemoryS3Client:
+    # Sustituto local de un cliente S3 con el subconjunto de la API que usa la app.
+    # latency (segundos) simula la espera de red de cada llamada en los benchmarks.
+    def __init__(self, latency=0):
+        self.objects = {}
+        self.calls = []
+        self.latency = latency
+        self._lock = threading.Lock()
+
+    def _record(self, operation):
+        with self._lock:
+            self.calls.append(operation)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _missing(self, operation):
+        from botocore.exceptions import ClientError
+
+        return ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, operation)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None):
+        self._record('upload_fileobj')
+        self.objects[(Bucket, Key)] = {'Body': Fileobj.read(), 'LastModified': datetime.now(timezone.utc), **(ExtraArgs or {})}
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        self._record('put_object')
+        body = Body.read() if hasattr(Body, 'read') else Body
+        self.objects[(Bucket, Key)] = {'Body': body, 'LastModified': datetime.now(timezone.utc), **kwargs}
+        return {}
+
+    def download_fileobj(self, Bucket, Key, Fileobj, **kwargs):
+        self._record('download_fileobj')
+        try:
+            Fileobj.write(self.objects[(Bucket, Key)]['Body'])
+        except KeyError:
+            raise self._missing('GetObject')
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._record('get_object')
+        try:
+            stored = self.objects[(Bucket, Key)]
+        except KeyError:
+            raise self._missing('GetObject')
+        return {'Body': BytesIO(stored['Body']), 'ContentLength': len(stored['Body']), 'ContentType': stored.get('ContentType')}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._record('head_object')
+        try:
+            stored = self.objects[(Bucket, Key)]
+        except KeyError:
+            raise self._missing('HeadObject')
+        return {'ContentLength': len(stored['Body']), 'ContentType': stored.get('ContentType')}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._record('delete_object')
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self._record('delete_objects')
+        if len(Delete['Objects']) > DELETE_BATCH_SIZE:
+            from botocore.exceptions import ClientError
+
+            raise ClientError({'Error': {'Code': 'MalformedXML', 'Message': 'Too many keys'}}, 'DeleteObjects')
+        for item in Delete['Objects']:
+            self.objects.pop((Bucket, item['Key']), None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, MaxKeys=1000, **kwargs):
+        self._record('list_objects_v2')
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        if ContinuationToken:
+            keys = [key for key in keys if key > ContinuationToken]
+        page = keys[:MaxKeys]
+        contents = []
+        for key in page:
+            stored = self.objects[(Bucket, key)]
+            # Los objetos creados a mano en los tests no llevan fecha: cuentan como antiguos
+            modified = stored.get('LastModified', datetime(2000, 1, 1, tzinfo=timezone.utc))
+            contents.append({'Key': key, 'LastModified': modified, 'Size': len(stored['Body'])})
+        response = {'Contents': contents, 'IsTruncated': len(keys) > MaxKeys}
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def generate_presigned_post(self, Bucket, Key, Fields=None, Conditions=None, ExpiresIn=3600):
+        self._record('generate_presigned_post')
+        return {'url': f'https://{Bucket}.s3.local/', 'fields': {'key': Key, **(Fields or {})}}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, HttpMethod=None):
+        self._record('generate_presigned_url')
+        return f"https://{Params['Bucket']}.s3.local/{Params['Key']}?X-Amz-Expires={ExpiresIn}&X-Amz-Signature=local"
@@ -0,0 +1,73 @@
+import base64
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Message, MessageTombstone
+from .pagination import keyset_filter
+
+SYNC_ORDERING = ('updated_at', 'id')
+
+
+class InvalidSyncToken(ValueError):
+    pass
+
+
+def encode_token(position, tombstone_id):
+    payload = {'m': [position[0].isoformat(), position[1]] if position else None, 't': tombstone_id}
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_token(token):
+    if not token:
+        return None, 0
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        position = payload['m']
+        if position is not None:
+            updated_at = parse_datetime(position[0])
+            if updated_at is None:
+                raise ValueError
+            position = (updated_at, int(position[1]))
+        return position, int(payload['t'])
+    except (TypeError, ValueError, KeyError, IndexError):
+        raise InvalidSyncToken(token)
+
+
+def changes_since(user, token, limit):
+    # Devuelve los mensajes creados/modificados y los borrados después del token.
+    # Solo se entregan cambios anteriores a "ahora - SYNC_SETTLE_SECONDS": así una
+    # transacción concurrente que confirme tarde con un updated_at menor no queda
+    # por detrás de un token ya emitido.
+    position, tombstone_id = decode_token(token)
+    horizon = timezone.now() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+
+    messages = Message.objects.for_timeline(user).filter(updated_at__lte=horizon).order_by(*SYNC_ORDERING)
+    if position is not None:
+        messages = messages.filter(keyset_filter(SYNC_ORDERING, position))
+    messages = list(messages[:limit + 1])
+
+    tombstones = list(
+        MessageTombstone.objects.filter(Q(sender_id=user.id) | Q(receiver_id=user.id))
+        .filter(id__gt=tombstone_id, deleted_at__lte=horizon)
+        .order_by('id')
+        .values_list('id', 'message_id')[:limit + 1]
+    )
+
+    has_more = len(messages) > limit or len(tombstones) > limit
+    messages, tombstones = messages[:limit], tombstones[:limit]
+    if messages:
+        position = (messages[-1].updated_at, messages[-1].id)
+    if tombstones:
+        tombstone_id = tombstones[-1][0]
+    return {
+        'messages': messages,
+        'deleted': [message_id for _, message_id in tombstones],
+        'has_more': has_more,
+        'token': encode_token(position, tombstone_id),
+    }
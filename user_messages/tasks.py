@@ -0,0 +1,69 @@
+import tempfile
+
+from django.db.models import F
+from django.utils import timezone
+
+from . import exports, images, storage
+from .jobs import enqueue, job
+from .identity import invalidate_identity
+from .models import CustomUser, Message, VersionCounter
+from .profiles import invalidate_profile
+
+
+def enqueue_image_processing(kind, key, object_id):
+    return enqueue('images.process', {'kind': kind, 'key': key, 'object_id': object_id})
+
+
+@job('images.process')
+def process_uploaded_image(kind, key, object_id):
+    # Reescala, quita EXIF, recodifica y genera miniaturas; después apunta el
+    # modelo a la imagen procesada y borra el original.
+    with tempfile.TemporaryFile() as source:
+        storage.download_fileobj(key, source)
+        source.seek(0)
+        try:
+            outputs = images.process_image(source, kind)
+        except images.ImageProcessingError:
+            # No es una imagen que se pueda procesar: se conserva el original
+            return
+
+    new_key = images.processed_key(key)
+    targets = [new_key if size is None else images.thumbnail_key(new_key, size) for size, _ in outputs]
+    content_type = images.output_format()[2]
+    for target, (_, encoded) in zip(targets, outputs):
+        with encoded:
+            storage.upload_fileobj(encoded, target, content_type)
+
+    # Hasta aquí el modelo apunta al original y no anuncia miniaturas
+    if kind == 'avatar':
+        updated = CustomUser.objects.filter(pk=object_id, avatar=key).update(
+            avatar=new_key, avatar_processed=True, profile_version=F('profile_version') + 1,
+        )
+        # update() no pasa por save(): las cachés del usuario y el directorio se invalidan a mano
+        invalidate_profile(object_id)
+        invalidate_identity(object_id)
+        if updated:
+            VersionCounter.objects.bump(VersionCounter.DIRECTORY)
+    else:
+        # Todos los mensajes con esa imagen: un envío masivo la comparte entre receptores
+        updated = Message.objects.filter(image=key).update(image=new_key, image_processed=True, updated_at=timezone.now())
+    if updated:
+        storage.delete_object(key)
+    else:
+        # El avatar cambió mientras tanto: lo generado ya no se usa
+        storage.delete_objects(targets)
+
+
+@job('storage.delete_avatar')
+def delete_avatar(key):
+    # El mismo nombre puede haberse vuelto a asignar mientras el trabajo esperaba
+    if CustomUser.objects.filter(avatar=key).exists():
+        return
+    # Con sus miniaturas (si las hay): purge_orphaned_images solo mira messages/
+    storage.delete_objects([key, *(images.thumbnail_key(key, size) for size in images.thumbnail_sizes('avatar'))])
+
+
+@job('exports.run')
+def run_export(export_id):
+    # Los reintentos de la cola reanudan desde el punto de control de la exportación
+    exports.run_export(export_id)
@@ -1,3 +1,1647 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.postgres.search import SearchQuery
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, FloatField
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import benchmarking, exports, identity, images, jobs, metrics, profiles, realtime, retention, search, storage, tasks, throttling
+from .consumers import websocket_application
+from .logfmt import LogfmtFormatter
+from .models import ArchivedImage, ArchivedMessage, Conversation, CustomUser, DeadLetterJob, Job, Message, MessageExport, MessageTombstone
+from .serializers import AbsoluteUrls, MessageRowSerializer, MessageSerializer
+
+
+class MessagePaginationTests(TestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def _send(self, count, sender=None, receiver=None):
+        return [
+            Message.objects.create(sender=sender or self.bob, receiver=receiver or self.alice, content=f'msg {i}')
+            for i in range(count)
+        ]
+
+    def _walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_walks_every_message_once_in_order(self):
+        messages = self._send(7)
+        # Empates en sent_at: el id desempata
+        Message.objects.filter(id__in=[m.id for m in messages[2:5]]).update(sent_at=messages[2].sent_at)
+        ids = self._walk(reverse('messages_received') + '?page_size=3')
+        expected = list(Message.objects.order_by('-sent_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_timeline_merges_sent_and_received(self):
+        self._send(4)
+        self._send(3, sender=self.alice, receiver=self.bob)
+        self._send(2, sender=self.alice, receiver=self.alice)
+        ids = self._walk(reverse('messages') + '?page_size=3')
+        expected = list(Message.objects.order_by('-sent_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        first = self.client.get(reverse('messages') + '?page_size=3').data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual([r['id'] for r in back['results']], [r['id'] for r in first['results']])
+
+    def test_new_messages_do_not_shift_pages(self):
+        self._send(4)
+        first = self.client.get(reverse('messages') + '?page_size=2').data
+        self._send(3)
+        second = self.client.get(first['next']).data
+        seen = [row['id'] for row in first['results'] + second['results']]
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertTrue(all(row['id'] < first['results'][-1]['id'] for row in second['results']))
+
+    def test_previous_link_returns_previous_page(self):
+        self._send(5, sender=self.alice, receiver=self.bob)
+        first = self.client.get(reverse('messages_sent') + '?page_size=2').data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual([r['id'] for r in back['results']], [r['id'] for r in first['results']])
+
+    def test_page_size_is_capped(self):
+        self._send(3)
+        with self.settings(API_MAX_PAGE_SIZE=2):
+            response = self.client.get(reverse('messages') + '?page_size=500')
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('messages') + '?cursor=nope')
+        self.assertEqual(response.status_code, 404)
+
+
+def timeline_queries():
+    # /api/messages/: un UNION ALL de enviados y recibidos, o una consulta por rama
+    # si la base de datos no admite LIMIT dentro de un UNION (SQLite)
+    return 1 if connection.features.supports_slicing_ordering_in_compound else 2
+
+
+class MessageQueryCountTests(TestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123', avatar='avatars/alice.png')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123', avatar='avatars/bob.png')
+        for i in range(30):
+            sender, receiver = (self.alice, self.bob) if i % 2 else (self.bob, self.alice)
+            Message.objects.create(sender=sender, receiver=receiver, content=f'msg {i}')
+        Conversation.objects.record_message(Message.objects.last())
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'][0]['sender_avatar_url'])
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_independent_of_page_size(self):
+        for name in ('messages', 'messages_received', 'messages_sent'):
+            counts = {size: self._count_queries(f'{reverse(name)}?page_size={size}') for size in (1, 5, 15)}
+            self.assertEqual(len(set(counts.values())), 1, (name, counts))
+            # Los buzones añaden la consulta de la marca de agua del ETag (ver conditional.py)
+            self.assertEqual(counts[1], timeline_queries() if name == 'messages' else 2, name)
+
+    def test_server_timing_reports_query_count(self):
+        response = self.client.get(reverse('messages'))
+        self.assertRegex(response['Server-Timing'], rf'^db;dur=\d+\.\d;desc="{timeline_queries()} queries"$')
+
+    def test_send_message_query_count(self):
+        # Lectura del receptor, INSERT del mensaje y UPDATE de la conversación (+ savepoint)
+        with self.assertNumQueries(5):
+            response = self.client.post(reverse('send_message'), {'receiver': self.bob.id, 'content': 'hola'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['data']['receiver_username'], 'bob')
+
+
+class ConversationTests(TestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        self.carol = CustomUser.objects.create_user('carol', 'carol@example.com', 'secret123')
+        self.client = APIClient()
+
+    def _send(self, sender, receiver, content):
+        self.client.force_authenticate(sender)
+        response = self.client.post(reverse('send_message'), {'receiver': receiver.id, 'content': content})
+        self.assertEqual(response.status_code, 201)
+        return response.data['data']['id']
+
+    def test_send_updates_summary_and_unread_counts(self):
+        self._send(self.bob, self.alice, 'hola')
+        last_id = self._send(self.bob, self.alice, 'qué tal')
+        self._send(self.alice, self.bob, 'bien')
+        self._send(self.carol, self.alice, 'hey')
+
+        self.client.force_authenticate(self.alice)
+        with self.assertNumQueries(1):
+            rows = self.client.get(reverse('conversations')).data['results']
+        self.assertEqual([r['counterpart_username'] for r in rows], ['carol', 'bob'])
+        self.assertEqual(rows[1]['last_message_snippet'], 'bien')
+        self.assertEqual(rows[1]['unread_count'], 2)
+        self.assertEqual(rows[0]['unread_count'], 1)
+
+        conversation = Conversation.objects.get(user_low=self.alice, user_high=self.bob)
+        self.assertEqual(conversation.unread_for(self.bob), 1)
+        self.assertGreater(conversation.last_message_id, last_id)
+
+    def test_backfill_command(self):
+        Message.objects.create(sender=self.alice, receiver=self.bob, content='uno')
+        last = Message.objects.create(sender=self.bob, receiver=self.alice, content='dos')
+        Message.objects.create(sender=self.carol, receiver=self.bob, content='tres')
+        call_command('backfill_conversations', batch_size=1, stdout=open(os.devnull, 'w'))
+        self.assertEqual(Conversation.objects.count(), 2)
+        conversation = Conversation.objects.get(user_low=self.alice, user_high=self.bob)
+        self.assertEqual(conversation.last_message_id, last.id)
+        self.assertEqual(conversation.last_message_snippet, 'dos')
+
+
+class WebSocketClient:
+    # Cliente ASGI mínimo para probar websocket_application sin servidor
+    def __init__(self, path, query_string=b''):
+        self.scope = {'type': 'websocket', 'path': path, 'query_string': query_string}
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+
+    async def connect(self):
+        self.task = asyncio.create_task(websocket_application(self.scope, self.incoming.get, self.outgoing.put))
+        await self.incoming.put({'type': 'websocket.connect'})
+        return await self.receive()
+
+    async def receive(self):
+        return await asyncio.wait_for(self.outgoing.get(), timeout=2)
+
+    async def disconnect(self):
+        await self.incoming.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self.task, timeout=2)
+
+
+class RealtimeDeliveryTests(TestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        self.token = str(AccessToken.for_user(self.alice))
+        realtime.set_broker(realtime.InMemoryBroker())
+
+    def tearDown(self):
+        realtime.set_broker(None)
+
+    def _send_from_bob(self, content):
+        client = APIClient()
+        client.force_authenticate(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse('send_message'), {'receiver': self.alice.id, 'content': content})
+        return response.data['data']
+
+    async def test_receiver_gets_message_after_commit(self):
+        socket = WebSocketClient('/ws/messages/', f'token={self.token}'.encode())
+        self.assertEqual((await socket.connect())['type'], 'websocket.accept')
+
+        data = await sync_to_async(self._send_from_bob)('hola alice')
+        event = await socket.receive()
+        payload = json.loads(event['text'])
+        self.assertEqual(payload['type'], 'message.created')
+        self.assertEqual(payload['data']['id'], data['id'])
+        self.assertEqual(payload['data']['content'], 'hola alice')
+        await socket.disconnect()
+        self.assertFalse(realtime.get_broker()._subscriptions)
+
+    async def test_rejects_invalid_token(self):
+        socket = WebSocketClient('/ws/messages/', b'token=invalid')
+        event = await socket.connect()
+        self.assertEqual(event, {'type': 'websocket.close', 'code': 4401})
+
+    async def test_unknown_path(self):
+        socket = WebSocketClient('/ws/other/')
+        event = await socket.connect()
+        self.assertEqual(event['code'], 4404)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class MessageSyncTests(TestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def _sync(self, token=None, limit=None):
+        params = {}
+        if token:
+            params['since'] = token
+        if limit:
+            params['limit'] = limit
+        response = self.client.get(reverse('messages_sync'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_returns_only_changes_after_token(self):
+        old = Message.objects.create(sender=self.bob, receiver=self.alice, content='viejo')
+        first = self._sync()
+        self.assertEqual([m['id'] for m in first['messages']], [old.id])
+        self.assertFalse(first['has_more'])
+
+        new = Message.objects.create(sender=self.alice, receiver=self.bob, content='nuevo')
+        Message.objects.create(sender=self.bob, receiver=self.bob, content='ajeno')
+        second = self._sync(first['token'])
+        self.assertEqual([m['id'] for m in second['messages']], [new.id])
+        self.assertEqual(self._sync(second['token'])['messages'], [])
+
+    def test_deletions_are_reported_as_tombstones(self):
+        message = Message.objects.create(sender=self.bob, receiver=self.alice, content='borrar')
+        token = self._sync()['token']
+        message_id = message.id
+        message.delete()
+        changes = self._sync(token)
+        self.assertEqual(changes['deleted'], [message_id])
+        self.assertEqual(self._sync(changes['token'])['deleted'], [])
+
+    def test_bounded_batches(self):
+        for i in range(5):
+            Message.objects.create(sender=self.bob, receiver=self.alice, content=f'msg {i}')
+        seen, token, has_more = [], None, True
+        while has_more:
+            changes = self._sync(token, limit=2)
+            seen += [m['id'] for m in changes['messages']]
+            token, has_more = changes['token'], changes['has_more']
+        self.assertEqual(seen, list(Message.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_invalid_token(self):
+        response = self.client.get(reverse('messages_sync'), {'since': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+
+class StorageServiceTests(TestCase):
+    def setUp(self):
+        self.s3 = storage.InMemoryS3Client()
+        storage.set_client(self.s3)
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123', avatar='avatars/old.png')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def tearDown(self):
+        storage.set_client(None)
+
+    def test_client_is_created_once_per_process(self):
+        storage.set_client(None)
+        with override_settings(AWS_ACCESS_KEY_ID='test', AWS_SECRET_ACCESS_KEY='test'):
+            clients = []
+            threads = [threading.Thread(target=lambda: clients.append(storage.get_client())) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len({id(client) for client in clients}), 1)
+        self.assertEqual(clients[0].meta.config.max_pool_connections, 10)
+
+    def test_profile_put_replaces_avatar(self):
+        self.s3.objects[(storage.bucket_name(), 'avatars/old.png')] = {'Body': b'old'}
+        avatar = SimpleUploadedFile('me.png', b'png-bytes', content_type='image/png')
+        response = self.client.put(reverse('profile'), {'avatar': avatar}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        # El archivo se sube en la petición; el borrado del anterior queda en la cola
+        self.assertEqual(self.s3.calls, ['upload_fileobj'])
+        jobs.run_until_empty()
+        self.assertEqual(set(self.s3.objects), {(storage.bucket_name(), 'avatars/alice_me.png')})
+        self.assertEqual(self.s3.objects[(storage.bucket_name(), 'avatars/alice_me.png')]['ContentType'], 'image/png')
+
+    def test_send_message_with_image(self):
+        image = SimpleUploadedFile('foto.jpg', b'jpeg-bytes', content_type='image/jpeg')
+        response = self.client.post(reverse('send_message'), {'receiver': self.bob.id, 'content': 'mira', 'image': image}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        key = Message.objects.get().image.name
+        self.assertTrue(key.startswith('messages/') and key.endswith('.jpg'))
+        self.assertEqual(self.s3.objects[(storage.bucket_name(), key)]['Body'], b'jpeg-bytes')
+        self.assertEqual(Job.objects.get().kind, 'images.process')
+
+
+class PresignedUploadTests(TestCase):
+    def setUp(self):
+        self.s3 = storage.InMemoryS3Client()
+        storage.set_client(self.s3)
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def tearDown(self):
+        storage.set_client(None)
+
+    def _presign(self, kind, content_type='image/png', size=100):
+        response = self.client.post(reverse('uploads'), {'kind': kind, 'content_type': content_type, 'size': size}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data
+
+    def _upload(self, key, body=b'x' * 100, content_type='image/png'):
+        self.s3.objects[(storage.bucket_name(), key)] = {'Body': body, 'ContentType': content_type}
+
+    def test_presign_chooses_key_under_prefix(self):
+        upload = self._presign('message')
+        self.assertRegex(upload['key'], rf'^messages/{self.alice.id}/[0-9a-f]{{32}}\.png$')
+        self.assertEqual(upload['fields']['key'], upload['key'])
+
+    def test_presign_rejects_bad_requests(self):
+        for data in ({'kind': 'other', 'content_type': 'image/png'},
+                     {'kind': 'avatar', 'content_type': 'text/html'},
+                     {'kind': 'avatar', 'content_type': 'image/png', 'size': 10 ** 9}):
+            self.assertEqual(self.client.post(reverse('uploads'), data, format='json').status_code, 400)
+
+    def test_send_message_with_uploaded_key(self):
+        key = self._presign('message')['key']
+        data = {'receiver': self.bob.id, 'content': 'foto', 'image_key': key}
+        self.assertEqual(self.client.post(reverse('send_message'), data, format='json').status_code, 400)
+        self._upload(key)
+        response = self.client.post(reverse('send_message'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Message.objects.get().image.name, key)
+        self.assertNotIn('upload_fileobj', self.s3.calls)
+
+    def test_send_with_image_is_single_insert(self):
+        key = self._presign('message')['key']
+        self._upload(key)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse('send_message'), {'receiver': self.bob.id, 'content': 'foto', 'image_key': key}, format='json')
+        writes = [q['sql'] for q in ctx.captured_queries if 'user_messages_message"' in q['sql'] and not q['sql'].startswith('SELECT')]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('INSERT'))
+
+    def test_confirm_rejects_foreign_or_oversized_keys(self):
+        foreign = f'avatars/{self.bob.id}/{"a" * 32}.png'
+        self._upload(foreign)
+        response = self.client.put(reverse('profile'), {'avatar_key': foreign}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # Una clave válida con un salto de línea al final no es la misma clave
+        trailing = f'{self._presign("avatar")["key"]}\n'
+        self._upload(trailing)
+        response = self.client.put(reverse('profile'), {'avatar_key': trailing}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        key = self._presign('avatar')['key']
+        with self.settings(UPLOAD_AVATAR_MAX_BYTES=10):
+            self._upload(key)
+            response = self.client.put(reverse('profile'), {'avatar_key': key}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_profile_avatar_key_replaces_previous(self):
+        first = self._presign('avatar')['key']
+        self._upload(first)
+        self.assertEqual(self.client.put(reverse('profile'), {'avatar_key': first}, format='json').status_code, 200)
+        second = self._presign('avatar', content_type='image/jpeg')['key']
+        self._upload(second, content_type='image/jpeg')
+        self.client.put(reverse('profile'), {'avatar_key': second}, format='json')
+        jobs.run_until_empty()
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.avatar.name, second)
+        self.assertNotIn((storage.bucket_name(), first), self.s3.objects)
+
+
+_calls = []
+
+
+@jobs.job('tests.flaky')
+def flaky_job(fail_times):
+    _calls.append(fail_times)
+    if len(_calls) <= fail_times:
+        raise RuntimeError('fallo')
+
+
+@override_settings(JOB_RETRY_BASE_SECONDS=10, JOB_RETRY_MAX_SECONDS=60, JOB_MAX_ATTEMPTS=3)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        _calls.clear()
+
+    def _advance(self):
+        Job.objects.update(run_at=timezone.now() - timedelta(seconds=1))
+
+    def test_retries_with_backoff_until_success(self):
+        job = jobs.enqueue('tests.flaky', {'fail_times': 2})
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertIn('RuntimeError', job.last_error)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=5))
+        self.assertEqual(jobs.run_pending(), 0)
+
+        self._advance()
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=15))
+
+        self._advance()
+        call_command('run_jobs', once=True, stdout=open(os.devnull, 'w'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 3))
+
+    def test_exhausted_jobs_go_to_dead_letter(self):
+        job = jobs.enqueue('tests.flaky', {'fail_times': 10}, max_attempts=2)
+        jobs.run_pending()
+        self._advance()
+        jobs.run_pending()
+        self.assertFalse(Job.objects.exists())
+        dead = DeadLetterJob.objects.get()
+        self.assertEqual((dead.job_id, dead.kind, dead.attempts), (job.id, 'tests.flaky', 2))
+
+    def test_idempotency_key_deduplicates(self):
+        first = jobs.enqueue('tests.flaky', {'fail_times': 0}, idempotency_key='once')
+        second = jobs.enqueue('tests.flaky', {'fail_times': 0}, idempotency_key='once')
+        self.assertEqual(first.id, second.id)
+        jobs.run_until_empty()
+        self.assertEqual(_calls, [0])
+
+    def test_stale_running_jobs_are_reclaimed(self):
+        job = jobs.enqueue('tests.flaky', {'fail_times': 0})
+        Job.objects.update(status=Job.RUNNING, locked_at=timezone.now() - timedelta(hours=1))
+        jobs.run_until_empty()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+
+    def test_stale_exhausted_jobs_go_to_dead_letter(self):
+        # El último intento tumbó al worker: no vuelve a la cola
+        job = jobs.enqueue('tests.flaky', {'fail_times': 0}, max_attempts=2)
+        Job.objects.update(status=Job.RUNNING, attempts=2, locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.run_until_empty(), 0)
+        self.assertFalse(Job.objects.exists())
+        dead = DeadLetterJob.objects.get()
+        self.assertEqual((dead.job_id, dead.attempts), (job.id, 2))
+        self.assertIn('JOB_LOCK_TIMEOUT', dead.last_error)
+        self.assertEqual(_calls, [])
+
+
+def make_image(size=(1200, 800), format='JPEG', exif_orientation=None):
+    image = Image.new('RGB', size, (200, 30, 30))
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    if exif_orientation:
+        exif[0x0112] = exif_orientation
+    exif[0x010F] = 'PhoneMaker'
+    image.save(buffer, format, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+@override_settings(IMAGE_MAX_DIMENSION={'message': 600, 'avatar': 256}, IMAGE_THUMBNAIL_SIZES={'message': [100], 'avatar': [40, 128]})
+class ImageProcessingTests(TestCase):
+    def setUp(self):
+        self.s3 = storage.InMemoryS3Client()
+        storage.set_client(self.s3)
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def tearDown(self):
+        storage.set_client(None)
+
+    def _stored_image(self, key):
+        return Image.open(io.BytesIO(self.s3.objects[(storage.bucket_name(), key)]['Body']))
+
+    def test_process_image_caps_size_and_strips_exif(self):
+        outputs = images.process_image(io.BytesIO(make_image(exif_orientation=6)), 'message')
+        self.assertEqual([size for size, _ in outputs], [None, 100])
+        main = Image.open(outputs[0][1])
+        # Orientación 6: la imagen se gira y queda vertical
+        self.assertEqual(main.size, (400, 600))
+        self.assertEqual(main.format, 'WEBP')
+        self.assertFalse(main.getexif())
+        self.assertEqual(max(Image.open(outputs[1][1]).size), 100)
+
+    def test_rejects_huge_or_invalid_images(self):
+        with self.settings(IMAGE_MAX_PIXELS=1000):
+            with self.assertRaises(images.ImageProcessingError):
+                images.process_image(io.BytesIO(make_image()), 'message')
+        with self.assertRaises(images.ImageProcessingError):
+            images.process_image(io.BytesIO(b'not an image'), 'message')
+
+    def test_message_image_pipeline(self):
+        key = self.client.post(reverse('uploads'), {'kind': 'message', 'content_type': 'image/jpeg'}, format='json').data['key']
+        self.s3.objects[(storage.bucket_name(), key)] = {'Body': make_image(), 'ContentType': 'image/jpeg'}
+        response = self.client.post(reverse('send_message'), {'receiver': self.bob.id, 'content': 'foto', 'image_key': key}, format='json')
+        self.assertEqual(response.status_code, 201)
+        jobs.run_until_empty()
+
+        message = Message.objects.get()
+        self.assertEqual(message.image.name, images.processed_key(key))
+        self.assertNotIn((storage.bucket_name(), key), self.s3.objects)
+        self.assertEqual(self._stored_image(message.image.name).size, (600, 400))
+        self.assertEqual(self._stored_image(images.thumbnail_key(message.image.name, 100)).size, (100, 67))
+
+        row = self.client.get(reverse('messages_sent')).data['results'][0]
+        self.assertTrue(row['image_thumbnail_url'].endswith(images.thumbnail_key(message.image.name, 100)))
+
+    def test_thumbnails_only_once_processed(self):
+        key = f'messages/{self.alice.id}/{"c" * 32}.png'
+        self.s3.objects[(storage.bucket_name(), key)] = {'Body': b'no es una imagen', 'ContentType': 'image/png'}
+        self.client.post(reverse('send_message'), {'receiver': self.bob.id, 'content': 'foto', 'image_key': key}, format='json')
+        row = self.client.get(reverse('messages_sent')).data['results'][0]
+        self.assertIsNone(row['image_thumbnail_url'])
+        # El procesado la rechaza: sigue sin miniaturas y con el original
+        jobs.run_until_empty()
+        row = self.client.get(reverse('messages_sent')).data['results'][0]
+        self.assertTrue(row['image'].endswith(key))
+        self.assertIsNone(row['image_thumbnail_url'])
+
+    def test_processed_keys_keep_the_original_extension(self):
+        self.assertNotEqual(images.processed_key('avatars/ana_yo.png'), images.processed_key('avatars/ana_yo.jpg'))
+
+    def test_delete_avatar_removes_thumbnails(self):
+        key = 'avatars/alice_me_png.webp'
+        for name in (key, *(images.thumbnail_key(key, size) for size in (40, 128))):
+            self.s3.objects[(storage.bucket_name(), name)] = {'Body': b'x'}
+        tasks.delete_avatar(key)
+        self.assertFalse(self.s3.objects)
+
+    def test_avatar_pipeline_from_multipart(self):
+        avatar = SimpleUploadedFile('me.png', make_image(format='PNG'), content_type='image/png')
+        self.client.put(reverse('profile'), {'avatar': avatar}, format='multipart')
+        self.assertEqual(identity.get_identity(self.alice.id)['avatar'], 'avatars/alice_me.png')
+        self.assertIsNone(self.client.get(reverse('profile')).data['avatar_thumbnails'])
+        jobs.run_until_empty()
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.avatar.name, 'avatars/alice_me_png.webp')
+        self.assertEqual(identity.get_identity(self.alice.id)['avatar'], 'avatars/alice_me_png.webp')
+        for size in (40, 128):
+            self.assertEqual(self._stored_image(f'avatars/alice_me_png_{size}.webp').size, (size, size))
+        data = self.client.get(reverse('profile')).data
+        self.assertTrue(data['avatar_thumbnails']['40'].endswith('avatars/alice_me_png_40.webp'))
+
+
+class ProfileCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        profiles.reset_stats()
+        metrics.reset()
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123', avatar='avatars/alice.webp', avatar_processed=True)
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        for i in range(6):
+            Message.objects.create(sender=self.bob, receiver=self.alice, content=f'msg {i}')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_message_list_reads_profiles_once_per_page(self):
+        self.client.get(reverse('messages_received'))
+        self.assertEqual(profiles.stats(), {'hits': 0, 'misses': 2})
+        rows = self.client.get(reverse('messages_received')).data['results']
+        self.assertEqual(profiles.stats(), {'hits': 2, 'misses': 2})
+        text = metrics.render()
+        self.assertIn('profile_cache_lookups_total{result="hit"} 2', text)
+        self.assertIn('profile_cache_lookups_total{result="miss"} 2', text)
+        self.assertTrue(rows[0]['receiver_avatar_url'].endswith('avatars/alice.webp'))
+        self.assertTrue(rows[0]['receiver_avatar_thumbnail_url'].endswith('avatars/alice_40.webp'))
+        self.assertIsNone(rows[0]['sender_avatar_url'])
+
+    def test_user_list_and_profile_use_cache(self):
+        self.client.get(reverse('user_list'))
+        self.client.get(reverse('profile'))
+        # El validador del ETag y la página; los perfiles salen de la caché
+        with self.assertNumQueries(2):
+            data = self.client.get(reverse('user_list')).data
+        self.assertEqual(data['results'][0]['username'], 'bob')
+        self.assertEqual(profiles.stats()['hits'], 1)
+
+    def test_profile_update_invalidates(self):
+        self.client.get(reverse('profile'))
+        self.alice.avatar = 'avatars/new.webp'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.save()
+        data = self.client.get(reverse('profile')).data
+        self.assertTrue(data['avatar_url'].endswith('avatars/new.webp'))
+        self.assertEqual(profiles.stats(), {'hits': 0, 'misses': 2})
+
+
+class UserDirectoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.me = CustomUser.objects.create_user('me', 'me@example.com', 'secret123')
+        for username, email in [
+            ('álvaro', 'alvaro@example.com'),
+            ('Alba', 'alba@correo.es'),
+            ('bruno', 'bruno@alpha.dev'),
+            ('carla', 'carla@example.com'),
+            ('malvina', 'mv@example.com'),
+        ]:
+            CustomUser.objects.create_user(username, email, 'secret123')
+        CustomUser.objects.create_user('admin', 'admin@example.com', 'secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def usernames(self, name, **params):
+        return [row['username'] for row in self.client.get(reverse(name), params).data['results']]
+
+    def test_search_fields_are_normalized(self):
+        user = CustomUser.objects.get(username='álvaro')
+        self.assertEqual(user.username_search, 'alvaro')
+        user.username = 'ÁLVARO'
+        user.save(update_fields=['username'])
+        user.refresh_from_db()
+        self.assertEqual(user.username_search, 'alvaro')
+
+    def test_list_is_paginated_and_excludes_self_and_admin(self):
+        response = self.client.get(reverse('user_list'), {'page_size': 2})
+        self.assertEqual([row['username'] for row in response.data['results']], ['Alba', 'álvaro'])
+        seen = [row['username'] for row in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [row['username'] for row in response.data['results']]
+        self.assertEqual(seen, ['Alba', 'álvaro', 'bruno', 'carla', 'malvina'])
+
+    def test_prefix_search_is_accent_and_case_insensitive(self):
+        self.assertEqual(self.usernames('user_list', q='AL'), ['Alba', 'álvaro'])
+        self.assertEqual(self.usernames('user_list', q='Álv'), ['álvaro', 'malvina'])
+
+    def test_username_prefix_ranks_before_email_and_substring(self):
+        # Prefijo de username, luego de email; por subcadena solo desde 3 caracteres
+        self.assertEqual(self.usernames('user_list', q='alv'), ['álvaro', 'malvina'])
+        self.assertEqual(self.usernames('user_list', q='mv'), ['malvina'])
+        self.assertEqual(self.usernames('user_list', q='lp'), [])
+        self.assertEqual(self.usernames('user_list', q='alp'), ['bruno'])
+
+    def test_search_pagination(self):
+        response = self.client.get(reverse('user_list'), {'q': 'al', 'page_size': 1})
+        self.assertEqual([row['username'] for row in response.data['results']], ['Alba'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['username'] for row in response.data['results']], ['álvaro'])
+        self.assertIsNone(response.data['next'])
+
+    def test_picker_is_lightweight(self):
+        rows = self.client.get(reverse('user_picker'), {'q': 'car'}).data['results']
+        self.assertEqual(set(rows[0]), {'id', 'username', 'avatar_thumbnail_url'})
+        self.assertEqual(rows[0]['username'], 'carla')
+
+    def test_recent_contacts_follow_last_message(self):
+        bruno = CustomUser.objects.get(username='bruno')
+        carla = CustomUser.objects.get(username='carla')
+        for sender, receiver in [(self.me, carla), (bruno, self.me), (carla, bruno)]:
+            message = Message.objects.create(sender=sender, receiver=receiver, content='hola')
+            Conversation.objects.record_message(message)
+        with self.assertNumQueries(1):
+            rows = self.client.get(reverse('user_recent')).data['results']
+        self.assertEqual([row['username'] for row in rows], ['bruno', 'carla'])
+        self.assertIn('last_message_at', rows[0])
+        self.assertEqual(len(self.client.get(reverse('user_recent'), {'limit': 1}).data['results']), 1)
+        self.assertEqual(self.client.get(reverse('user_recent'), {'limit': 'x'}).status_code, 400)
+
+
+class RecordingBroker:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, channel, payload):
+        self.published.append((channel, json.loads(payload)))
+
+
+class ReadReceiptTests(TestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        self.carol = CustomUser.objects.create_user('carol', 'carol@example.com', 'secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.ids = [self.send(self.bob, self.alice, f'hola {i}') for i in range(3)]
+        self.send(self.carol, self.alice, 'hola de carol')
+        self.send(self.alice, self.bob, 'respuesta')
+        self.broker = RecordingBroker()
+        realtime.set_broker(self.broker)
+
+    def tearDown(self):
+        realtime.set_broker(None)
+
+    def send(self, sender, receiver, content):
+        client = APIClient()
+        client.force_authenticate(sender)
+        return client.post(reverse('send_message'), {'receiver': receiver.id, 'content': content}).data['data']['id']
+
+    def test_unread_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse('unread_counts')).data
+        self.assertEqual(data['total'], 4)
+        self.assertEqual(
+            sorted((row['user'], row['unread']) for row in data['conversations']),
+            [(self.bob.id, 3), (self.carol.id, 1)],
+        )
+
+    def test_mark_read_up_to_id(self):
+        url = reverse('conversation_read', args=[self.bob.id])
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(url, {'up_to': self.ids[1]}, format='json')
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(response.data['updated'], 2)
+
+        read = Message.objects.filter(sender=self.bob, receiver=self.alice, read_at__isnull=False)
+        self.assertEqual(sorted(read.values_list('id', flat=True)), self.ids[:2])
+        self.assertTrue(all(m.delivered_at for m in read))
+        conversation = Conversation.objects.get(user_low=self.alice, user_high=self.bob)
+        self.assertEqual(conversation.unread_for(self.alice), 1)
+        self.assertEqual(conversation.unread_for(self.bob), 1)
+        self.assertEqual(self.client.get(reverse('unread_counts')).data['total'], 2)
+
+        channel, event = self.broker.published[0]
+        self.assertEqual(channel, realtime.user_channel(self.bob.id))
+        self.assertEqual(event['type'], 'messages.read')
+        self.assertEqual(event['data']['up_to'], self.ids[1])
+
+        # Repetir no descuenta dos veces
+        self.assertEqual(self.client.post(url, {'up_to': self.ids[1]}, format='json').data['updated'], 0)
+        self.assertEqual(Conversation.objects.get(id=conversation.id).unread_for(self.alice), 1)
+
+    def test_mark_delivered_keeps_unread(self):
+        response = self.client.post(reverse('conversation_delivered', args=[self.bob.id]), {'up_to': self.ids[-1]}, format='json')
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual(Message.objects.filter(receiver=self.alice, delivered_at__isnull=False).count(), 3)
+        self.assertEqual(self.client.get(reverse('unread_counts')).data['total'], 4)
+        row = self.client.get(reverse('messages_received')).data['results'][1]
+        self.assertIsNotNone(row['delivered_at'])
+        self.assertIsNone(row['read_at'])
+
+    def test_invalid_up_to(self):
+        response = self.client.post(reverse('conversation_read', args=[self.bob.id]), {'up_to': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_repair_command_reconciles_counters(self):
+        Message.objects.filter(id=self.ids[0]).update(read_at=timezone.now())
+        Conversation.objects.filter(user_low=self.alice, user_high=self.bob).update(unread_low=9, unread_high=9)
+        out = io.StringIO()
+        call_command('repair_unread_counters', '--dry-run', stdout=out)
+        self.assertIn('1 conversaciones con diferencias', out.getvalue())
+        self.assertEqual(Conversation.objects.get(user_low=self.alice, user_high=self.bob).unread_low, 9)
+
+        call_command('repair_unread_counters', stdout=io.StringIO())
+        conversation = Conversation.objects.get(user_low=self.alice, user_high=self.bob)
+        self.assertEqual((conversation.unread_low, conversation.unread_high), (2, 1))
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        self.carol = CustomUser.objects.create_user('carol', 'carol@example.com', 'secret123')
+        for i in range(5):
+            Message.objects.create(sender=self.bob, receiver=self.alice, content=f'quedamos para cenar {i}')
+        Message.objects.create(sender=self.alice, receiver=self.bob, content='¿Cenar mañana?')
+        Message.objects.create(sender=self.bob, receiver=self.carol, content='cenar con carol')
+        Message.objects.create(sender=self.bob, receiver=self.alice, content='otro tema')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_only_own_messages_match(self):
+        rows = self.client.get(reverse('messages_search'), {'q': 'cenar'}).data['results']
+        self.assertEqual(len(rows), 6)
+        self.assertNotIn('cenar con carol', [row['content'] for row in rows])
+        self.assertEqual(rows[0]['content'], '¿Cenar mañana?')
+
+    def test_paginated_without_n_plus_one(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('messages_search'), {'q': 'cenar', 'page_size': 4})
+        self.assertEqual(len(response.data['results']), 4)
+        rest = self.client.get(response.data['next']).data
+        self.assertEqual(len(rest['results']), 2)
+        self.assertIsNone(rest['next'])
+
+    def test_query_required(self):
+        self.assertEqual(self.client.get(reverse('messages_search'), {'q': ' '}).status_code, 400)
+
+    def test_pages_through_ties(self):
+        # Mismo contenido y misma fecha: todo el orden recae en el desempate
+        Message.objects.bulk_create(
+            [Message(sender=self.bob, receiver=self.alice, content='empate') for _ in range(11)]
+        )
+        Message.objects.filter(content='empate').update(sent_at=timezone.now())
+        ids = []
+        url, params = reverse('messages_search'), {'q': 'empate', 'page_size': 3}
+        while url:
+            data = self.client.get(url, params).data
+            ids += [row['id'] for row in data['results']]
+            url, params = data['next'], None
+        self.assertEqual(len(ids), 11)
+        self.assertEqual(set(ids), set(Message.objects.filter(content='empate').values_list('id', flat=True)))
+
+    def test_rank_is_double_precision(self):
+        # El cursor compara la relevancia con un float de Python (ver search.rank)
+        self.assertIsInstance(search.rank(SearchQuery('cenar')).output_field, FloatField)
+
+    def test_backfill_requires_postgres(self):
+        out = io.StringIO()
+        call_command('backfill_message_search', stdout=out)
+        self.assertIn('PostgreSQL', out.getvalue())
+
+
+class BroadcastTests(TestCase):
+    def setUp(self):
+        self.s3 = storage.InMemoryS3Client()
+        storage.set_client(self.s3)
+        realtime.set_broker(RecordingBroker())
+        self.operator = CustomUser.objects.create_user('operator', 'operator@example.com', 'secret123', is_staff=True)
+        self.users = [CustomUser.objects.create_user(f'user{i}', f'user{i}@example.com', 'secret123') for i in range(6)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.operator)
+
+    def tearDown(self):
+        storage.set_client(None)
+        realtime.set_broker(None)
+
+    def broadcast(self, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('broadcast_message'), data, format='json')
+
+    def test_sends_to_listed_receivers(self):
+        previous = Message.objects.create(sender=self.users[0], receiver=self.operator, content='hola')
+        Conversation.objects.record_message(previous)
+        ids = [user.id for user in self.users[:3]]
+        response = self.broadcast({'receivers': ids + [ids[0], 999999], 'content': 'aviso'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['sent'], 3)
+        self.assertEqual([row['receiver'] for row in response.data['results']], ids + [999999])
+        self.assertIn('error', response.data['results'][-1])
+
+        for user in self.users[:3]:
+            conversation = Conversation.objects.get(user_low=min(user, self.operator, key=lambda u: u.id), user_high=max(user, self.operator, key=lambda u: u.id))
+            self.assertEqual(conversation.last_message.content, 'aviso')
+            self.assertEqual(conversation.unread_for(user), 1)
+        self.assertEqual(Conversation.objects.get(last_message__receiver=self.users[0]).unread_for(self.operator), 1)
+        self.assertEqual(len(realtime.get_broker().published), 3)
+
+    def test_query_count_independent_of_receivers(self):
+        def count(receivers):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.broadcast({'receivers': receivers, 'content': 'aviso'}).status_code, 201)
+            return len(ctx.captured_queries)
+        self.assertEqual(count([self.users[0].id]), count([user.id for user in self.users[1:]]))
+
+    def test_chunks_in_one_transaction(self):
+        with self.settings(BROADCAST_BATCH_SIZE=2):
+            response = self.broadcast({'filter': {'q': 'user'}, 'content': 'aviso'})
+        self.assertEqual(response.data['sent'], 6)
+        self.assertEqual(Message.objects.filter(content='aviso').count(), 6)
+        self.assertEqual(Conversation.objects.count(), 6)
+
+    def test_shared_image_processed_once(self):
+        key = f'messages/{self.operator.id}/{"a" * 32}.jpg'
+        self.s3.objects[(storage.bucket_name(), key)] = {'Body': make_image(), 'ContentType': 'image/jpeg'}
+        self.broadcast({'receivers': [user.id for user in self.users[:2]], 'content': 'foto', 'image_key': key})
+        self.assertEqual(Job.objects.filter(kind='images.process').count(), 1)
+        jobs.run_until_empty()
+        self.assertEqual(set(Message.objects.values_list('image', flat=True)), {images.processed_key(key)})
+
+    def test_requires_staff_and_valid_input(self):
+        self.assertEqual(self.broadcast({'receivers': 'x', 'content': 'aviso'}).status_code, 400)
+        self.assertEqual(self.broadcast({'receivers': [self.users[0].id]}).status_code, 400)
+        self.client.force_authenticate(self.users[0])
+        self.assertEqual(self.broadcast({'receivers': [self.users[1].id], 'content': 'aviso'}).status_code, 403)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.s3 = storage.InMemoryS3Client()
+        storage.set_client(self.s3)
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123', avatar='avatars/alice.webp')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        for i in range(5):
+            Message.objects.create(sender=self.bob, receiver=self.alice, content=f'msg {i}')
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.alice)}'}
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=self.headers['Authorization'])
+
+    def tearDown(self):
+        storage.set_client(None)
+
+    async def test_list_matches_sync_view(self):
+        expected = (await sync_to_async(self.client.get)(reverse('messages'), {'page_size': 2})).content
+        response = await self.async_client.get(reverse('async_messages'), {'page_size': 2}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.replace(b'/async', b''), expected)
+
+    async def test_middleware_runs_async(self):
+        from django.core.handlers.asgi import ASGIHandler
+        from .middleware import MetricsMiddleware, QueryTimingMiddleware, RateLimitHeadersMiddleware
+
+        handler = ASGIHandler()
+        for middleware in (MetricsMiddleware, QueryTimingMiddleware, RateLimitHeadersMiddleware):
+            self.assertTrue(middleware.async_capable)
+        # Con toda la cadena async la vista recibe la corrutina, sin pasar por un hilo
+        self.assertTrue(iscoroutinefunction(handler._middleware_chain))
+        response = await self.async_client.get(reverse('async_messages'), headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('queries', response['Server-Timing'])
+        self.assertNotIn('db;dur=0.0;desc="0 queries"', response['Server-Timing'])
+
+    async def test_rate_limit_runs_off_the_event_loop(self):
+        # La caché de los cubos es síncrona: no puede bloquear el bucle de eventos
+        threads = []
+        check_rate = throttling.check_rate
+
+        def recording(*args):
+            threads.append(threading.get_ident())
+            return check_rate(*args)
+
+        with mock.patch('user_messages.async_views.check_rate', recording):
+            response = await self.async_client.get(reverse('async_messages'), headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get(reverse('async_messages'))
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get(reverse('async_profile'), headers={'Authorization': 'Bearer invalid'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_send_with_uploaded_key(self):
+        key = f'messages/{self.alice.id}/{"a" * 32}.png'
+        data = {'receiver': self.bob.id, 'content': 'foto', 'image_key': key}
+        response = await self.async_client.post(reverse('async_send_message'), data, content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.s3.objects[(storage.bucket_name(), key)] = {'Body': b'x' * 10, 'ContentType': 'image/png'}
+        response = await self.async_client.post(reverse('async_send_message'), data, content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.json()['data']['image'].endswith(key))
+        self.assertTrue(await Conversation.objects.filter(last_message_id=response.json()['data']['id']).aexists())
+
+    async def test_send_validation(self):
+        response = await self.async_client.post(reverse('async_send_message'), {'receiver': 999999, 'content': 'x'}, content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.post(reverse('async_send_message'), {'content': 'x'}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_profile(self):
+        expected = (await sync_to_async(self.client.get)(reverse('profile'))).content
+        response = await self.async_client.get(reverse('async_profile'), headers=self.headers)
+        self.assertEqual(response.content, expected)
+
+        key = f'avatars/{self.alice.id}/{"b" * 32}.png'
+        self.s3.objects[(storage.bucket_name(), key)] = {'Body': b'x' * 10, 'ContentType': 'image/png'}
+        response = await self.async_client.put(reverse('async_profile'), {'avatar_key': key}, content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        await self.alice.arefresh_from_db()
+        self.assertEqual(self.alice.avatar.name, key)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.s3 = storage.InMemoryS3Client()
+        storage.set_client(self.s3)
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def tearDown(self):
+        storage.set_client(None)
+
+    @override_settings(DEBUG=True)
+    def test_records_requests_per_view(self):
+        self.client.get(reverse('messages'))
+        self.client.get(reverse('messages'))
+        self.client.get('/api/does-not-exist/')
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('http_requests_total{view="messages",method="GET",status="200"} 2', text)
+        self.assertIn('http_requests_total{view="unmatched",method="GET",status="404"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{view="messages",method="GET"} 2', text)
+        self.assertIn(f'http_request_db_queries_bucket{{view="messages",le="{timeline_queries()}"}} 2', text)
+        self.assertIn('# TYPE http_response_size_bytes histogram', text)
+
+    def test_records_s3_calls_per_request(self):
+        key = f'messages/{self.alice.id}/{"a" * 32}.png'
+        self.client.post(reverse('send_message'), {'receiver': self.alice.id, 'content': 'x', 'image_key': key}, format='json')
+        text = metrics.render()
+        self.assertIn('s3_calls_total{operation="head_object",outcome="ok"} 1', text)
+        self.assertIn('http_request_s3_calls_bucket{view="send_message",le="0"} 0', text)
+        self.assertIn('http_request_s3_calls_bucket{view="send_message",le="1"} 1', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'prueba', ('view',), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 3):
+            histogram.observe(value, 'a')
+        samples = {(name, dict(labels).get('le')): value for name, labels, value in histogram.samples()}
+        self.assertEqual(samples[('test_seconds_bucket', '0.1')], 1)
+        self.assertEqual(samples[('test_seconds_bucket', '1')], 3)
+        self.assertEqual(samples[('test_seconds_bucket', '+Inf')], 4)
+        self.assertEqual(samples[('test_seconds_count', None)], 4)
+
+    def test_render_sums_every_worker(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIR=directory):
+            metrics.REQUESTS.inc('messages', 'GET', '200')
+            metrics.REQUEST_DURATION.observe(0.2, 'messages', 'GET')
+            metrics.flush()
+            # Otro worker con el mismo volcado
+            (name,) = os.listdir(directory)
+            with open(os.path.join(directory, name)) as source, open(os.path.join(directory, 'otro.json'), 'w') as target:
+                target.write(source.read())
+            metrics.REQUESTS.inc('messages', 'GET', '200')
+            text = metrics.render()
+        self.assertIn('http_requests_total{view="messages",method="GET",status="200"} 3', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="messages",method="GET",le="0.25"} 2', text)
+        self.assertIn('http_request_duration_seconds_count{view="messages",method="GET"} 2', text)
+
+    @override_settings(METRICS_TOKEN='secreto')
+    def test_token_protects_endpoint(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secreto').status_code, 200)
+
+    def test_without_token_only_in_debug(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_logfmt_formatter(self):
+        record = logging.LogRecord('user_messages.views', logging.INFO, __file__, 1, 'Avatar recibido', None, None)
+        record.fields = {'user': 1, 'file': 'mi foto.png'}
+        line = LogfmtFormatter().format(record)
+        self.assertIn('level=info logger=user_messages.views msg="Avatar recibido" user=1 file="mi foto.png"', line)
+
+
+class BenchmarkTests(TestCase):
+    def test_seed_dataset_is_skewed(self):
+        dataset = benchmarking.seed_dataset(20, 500, skew=1.2, seed=1)
+        self.assertEqual(len(dataset['user_ids']), 20)
+        self.assertEqual(Message.objects.count(), 500)
+        self.assertFalse(Message.objects.filter(sender=F('receiver')).exists())
+        per_user = Counter(Message.objects.values_list('sender_id', flat=True))
+        top, bottom = dataset['user_ids'][0], dataset['user_ids'][-1]
+        self.assertGreater(per_user[top], 5 * per_user[bottom])
+        # Usable para pedir tokens y en el directorio
+        self.assertTrue(CustomUser.objects.get(id=top).check_password(benchmarking.BENCH_PASSWORD))
+        self.assertTrue(CustomUser.objects.filter(username_search='bench00000').exists())
+
+    def test_summary_percentiles_and_queries(self):
+        results = [(i / 1000, 200, 3) for i in range(1, 101)] + [(0.5, 500, None)]
+        result = benchmarking.summary(results, elapsed=2)
+        self.assertEqual(result['p95'], 0.096)
+        self.assertEqual(result['p99'], 0.1)
+        self.assertEqual(result['errors'], 1)
+        self.assertEqual(result['queries'], 3)
+        self.assertIsNone(benchmarking.summary([(0.1, 200)], elapsed=1)['queries'])
+
+    def test_server_timing_queries(self):
+        self.assertEqual(benchmarking.server_timing_queries('db;dur=1.50;desc="4 queries"'), 4)
+        self.assertIsNone(benchmarking.server_timing_queries(None))
+
+    def test_compare_results_flags_regressions(self):
+        def report(p95, throughput, queries):
+            return {'results': {'inprocess': {'messages': {
+                'p95_ms': p95, 'throughput': throughput, 'queries': queries, 'errors': 0,
+            }}}}
+        baseline = report(10, 100, 2)
+        self.assertEqual(benchmarking.compare_results(baseline, report(11, 95, 2), 0.2), [])
+        regressions = benchmarking.compare_results(baseline, report(20, 50, 3), 0.2)
+        self.assertEqual(len(regressions), 3)
+        self.assertIn('inprocess/messages: 2 -> 3 consultas por petición', regressions)
+
+    def test_startup_does_not_load_s3_sdk_or_pillow(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'startup.json')
+            call_command(
+                'benchmark_startup', '--runs', '1', '--scenarios', 'manage', 'worker',
+                '--profile', 'core.settings.test', '--output', output, stderr=io.StringIO(),
+            )
+            with open(output) as f:
+                report = json.load(f)
+        for scenario in ('manage', 'worker'):
+            result = report['results']['startup'][scenario]
+            self.assertFalse(result['s3_sdk'], scenario)
+            self.assertFalse(result['pillow'], scenario)
+            self.assertGreater(result['p50_ms'], 0)
+
+        slower = {'results': {'startup': {'manage': {**report['results']['startup']['manage'], 's3_sdk': True}}}}
+        slower['results']['startup']['manage']['p50_ms'] *= 2
+        self.assertEqual(len(benchmarking.compare_startup(report, slower, 0.2)), 2)
+
+
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.client = APIClient()
+
+    def _login(self):
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'alice', 'password': 'secret123'})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def _get(self, access):
+        return self.client.get(reverse('protected/'), headers={'Authorization': f'Bearer {access}'})
+
+    def test_identity_needs_no_queries_once_cached(self):
+        access = self._login()['access']
+        self.assertEqual(self._get(access).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self._get(access)
+        self.assertEqual(response.data['message'], 'Hola, alice. Estás autenticado')
+
+    def test_views_see_the_full_user(self):
+        access = self._login()['access']
+        self._get(access)
+        response = self.client.get(reverse('profile'), headers={'Authorization': f'Bearer {access}'})
+        self.assertEqual(response.data['email'], 'alice@example.com')
+
+    def test_password_change_revokes_tokens(self):
+        tokens = self._login()
+        self._get(tokens['access'])
+        self.alice.set_password('nueva-clave')
+        self.alice.save()
+        response = self._get(tokens['access'])
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'token_revoked')
+        refresh = self.client.post(reverse('token_refresh'), {'refresh': tokens['refresh']})
+        self.assertEqual(refresh.status_code, 401)
+
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'alice', 'password': 'nueva-clave'})
+        self.assertEqual(self._get(response.data['access']).status_code, 200)
+
+    def test_deactivation_revokes_tokens_for_good(self):
+        access = self._login()['access']
+        self._get(access)
+        self.alice.is_active = False
+        self.alice.save(update_fields=['is_active'])
+        self.assertEqual(self._get(access).status_code, 401)
+        self.alice.is_active = True
+        self.alice.save(update_fields=['is_active'])
+        self.assertEqual(self._get(access).status_code, 401)
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.token_version, 1)
+
+    def test_deleted_user_is_rejected(self):
+        access = self._login()['access']
+        self._get(access)
+        self.alice.delete()
+        self.assertEqual(self._get(access).status_code, 401)
+
+    def test_login_keeps_token_version(self):
+        # Crear el usuario o iniciar sesión no revoca nada
+        self._login()
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.token_version, 0)
+
+    def test_password_rehash_keeps_tokens(self):
+        access = self._login()['access']
+        # Un hasher nuevo por delante: el siguiente login vuelve a cifrar la contraseña
+        hashers = ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher', 'django.contrib.auth.hashers.MD5PasswordHasher']
+        with self.settings(PASSWORD_HASHERS=hashers):
+            self._login()
+        self.alice.refresh_from_db()
+        self.assertTrue(self.alice.password.startswith('pbkdf2_sha1$'))
+        self.assertEqual(self.alice.token_version, 0)
+        self.assertEqual(self._get(access).status_code, 200)
+
+
+class MessageRowSerializerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123', avatar='avatars/álice.webp')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        Message.objects.create(sender=self.bob, receiver=self.alice, content='hola ñandú\u2028', image='messages/foto.jpg')
+        Message.objects.create(sender=self.alice, receiver=self.bob, content='adiós', delivered_at=timezone.now(), read_at=timezone.now())
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def _request(self):
+        request = APIRequestFactory().get('/api/messages/', HTTP_HOST='chat.example.com')
+        return Request(request)
+
+    @override_settings(TIME_ZONE='Europe/Madrid', ALLOWED_HOSTS=['chat.example.com'])
+    def test_same_bytes_as_message_serializer(self):
+        request = self._request()
+        messages = Message.objects.for_timeline(self.alice).order_by('-sent_at', '-id')
+        expected = JSONRenderer().render(MessageSerializer(messages, many=True, context={'request': request}).data)
+        rows = MessageRowSerializer(messages.rows(), context={'request': request}).data
+        self.assertEqual(JSONRenderer().render(rows), expected)
+        self.assertIn(b'"image":"https://', expected)
+        self.assertIn(b'"read_at":"', expected)
+
+    @override_settings(ALLOWED_HOSTS=['chat.example.com'])
+    def test_absolute_urls_match_build_absolute_uri(self):
+        request = self._request()
+        absolute = AbsoluteUrls(request)
+        for url in ('/media/a b/ñ.jpg', '//cdn.example.com/x', 'https://s3/x%20y', 'relativa.jpg', '/a/../b', None):
+            self.assertEqual(absolute(url), request.build_absolute_uri(url) if url else url)
+
+    def test_list_endpoints_use_rows(self):
+        self.client.get(reverse('messages'))
+        with self.assertNumQueries(timeline_queries()):
+            response = self.client.get(reverse('messages'))
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['results'][0]['content'], 'adiós')
+
+
+class MessageExportTests(TestCase):
+    def setUp(self):
+        self.s3 = storage.InMemoryS3Client()
+        storage.set_client(self.s3)
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        self.carol = CustomUser.objects.create_user('carol', 'carol@example.com', 'secret123')
+        for i in range(5):
+            Message.objects.create(sender=self.bob, receiver=self.alice, content=f'hola {i}', image='messages/a.jpg' if i == 2 else None)
+        Message.objects.create(sender=self.alice, receiver=self.bob, content='adiós')
+        Message.objects.create(sender=self.bob, receiver=self.carol, content='no es de alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def tearDown(self):
+        storage.set_client(None)
+
+    def _body(self, key):
+        return self.s3.objects[(storage.bucket_name(), key)]['Body']
+
+    def _lines(self, key):
+        return [json.loads(line) for line in self._body(key).decode().splitlines()]
+
+    @override_settings(EXPORT_PART_SIZE=4)
+    def test_export_in_background(self):
+        response = self.client.post(reverse('message_exports'), {'format': 'jsonl'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        # Mientras está en marcha no se crea otra
+        again = self.client.post(reverse('message_exports'), {}, format='json')
+        self.assertEqual((again.status_code, again.data['id']), (200, response.data['id']))
+        self.assertIsNone(response.data['files'])
+
+        jobs.run_until_empty()
+        data = self.client.get(reverse('message_export', args=[response.data['id']])).data
+        self.assertEqual((data['status'], data['message_count'], data['parts']), ('done', 6, 2))
+        self.assertEqual(len(data['files']['parts']), 2)
+        # URLs firmadas y temporales, bajo una ruta que no se deduce del id
+        self.assertIn('X-Amz-Expires=600', data['files']['manifest'])
+        self.assertIn(f"/{data['id']}-", data['files']['manifest'])
+
+        export = MessageExport.objects.get()
+        first, second = (self._lines(key) for key in exports.part_keys(export))
+        self.assertEqual([row['content'] for row in first + second], ['hola 0', 'hola 1', 'hola 2', 'hola 3', 'hola 4', 'adiós'])
+        self.assertEqual(first[2]['image'], 'messages/a.jpg')
+        manifest = json.loads(self._body(exports.manifest_key(export)))
+        self.assertEqual((manifest['messages'], manifest['parts']), (6, exports.part_keys(export)))
+
+        other = APIClient()
+        other.force_authenticate(self.bob)
+        self.assertEqual(other.get(reverse('message_export', args=[export.id])).status_code, 404)
+
+    @override_settings(EXPORT_PART_SIZE=2)
+    def test_resumes_from_checkpoint(self):
+        export = MessageExport.objects.create(user=self.alice)
+        upload = storage.upload_fileobj
+        uploads = []
+
+        def failing_upload(fileobj, key, content_type):
+            uploads.append(key)
+            if len(uploads) == 2:
+                raise ConnectionError("S3 no responde")
+            return upload(fileobj, key, content_type)
+
+        with mock.patch.object(storage, 'upload_fileobj', failing_upload):
+            with self.assertRaises(ConnectionError):
+                exports.run_export(export.id)
+        export.refresh_from_db()
+        self.assertEqual((export.status, export.parts, export.message_count), ('running', 1, 2))
+
+        with mock.patch.object(storage, 'upload_fileobj', failing_upload):
+            exports.run_export(export.id)
+        export.refresh_from_db()
+        self.assertEqual((export.status, export.parts, export.message_count), ('done', 3, 6))
+        # La primera parte no se vuelve a escribir
+        self.assertEqual(uploads.count(exports.part_key(export, 1)), 1)
+        rows = [row for key in exports.part_keys(export) for row in self._lines(key)]
+        self.assertEqual(len({row['id'] for row in rows}), 6)
+
+    def test_concurrent_start_returns_the_same_export(self):
+        first, created = exports.start_export(self.alice)
+        self.assertTrue(created)
+        # El segundo POST no vio la exportación del primero al comprobarlo
+        with mock.patch.object(exports, 'active_export', side_effect=[None, first]):
+            self.assertEqual(exports.start_export(self.alice), (first, False))
+        self.assertEqual(MessageExport.objects.count(), 1)
+        self.assertEqual(Job.objects.filter(kind='exports.run').count(), 1)
+
+    @override_settings(EXPORT_PART_SIZE=2)
+    def test_long_export_keeps_its_job_lock(self):
+        export, _ = exports.start_export(self.alice)
+        Job.objects.update(status=Job.RUNNING, locked_at=timezone.now() - timedelta(hours=1))
+        exports.run_export(export.id)
+        self.assertGreater(Job.objects.get().locked_at, timezone.now() - timedelta(minutes=1))
+
+    @override_settings(EXPORT_PART_SIZE=2)
+    def test_superseded_worker_stops(self):
+        export = MessageExport.objects.create(user=self.alice)
+        stale = MessageExport.objects.get(id=export.id)
+        exports.write_part(export)
+        # Un worker con el punto de control antiguo no vuelve a sumar la parte
+        with self.assertRaises(exports.ExportSuperseded):
+            exports.write_part(stale)
+        export.refresh_from_db()
+        self.assertEqual((export.parts, export.message_count), (1, 2))
+
+    @override_settings(EXPORT_PART_SIZE=4)
+    def test_includes_archived_messages(self):
+        old = timezone.now() - timedelta(days=400)
+        first, second, third = Message.objects.filter(receiver=self.alice).order_by('id')[:3]
+        Message.objects.filter(id__in=[first.id, second.id, third.id]).update(sent_at=old)
+        retention.archive_batch(retention.retention_cutoff(365), batch_size=2)
+        retention.archive_batch(retention.retention_cutoff(365), batch_size=1, target=retention.STORAGE)
+        self.assertEqual(ArchivedMessage.objects.count(), 2)
+
+        export, _ = exports.start_export(self.alice)
+        jobs.run_until_empty()
+        export.refresh_from_db()
+        rows = [row for key in exports.part_keys(export) for row in self._lines(key)]
+        self.assertEqual([row['content'] for row in rows], ['hola 0', 'hola 1', 'hola 3', 'hola 4', 'adiós'])
+        self.assertEqual((rows[0]['sender_username'], rows[0]['receiver_username']), ('bob', 'alice'))
+        # El archivado en storage no se lee, pero el manifiesto lo nombra
+        manifest = json.loads(self._body(exports.manifest_key(export)))
+        self.assertEqual(manifest['storage_archives'], [f'archive/messages/{third.id:012d}-{third.id:012d}.jsonl.gz'])
+
+    def test_zip_format(self):
+        call_command('export_messages', '--user', 'alice', '--format', 'zip', stdout=io.StringIO())
+        export = MessageExport.objects.get()
+        with zipfile.ZipFile(io.BytesIO(self._body(exports.part_key(export, 1)))) as archive:
+            lines = archive.read('messages.jsonl').decode().splitlines()
+            self.assertEqual(len(lines), 6)
+            self.assertEqual(archive.read('images.txt').decode(), 'messages/a.jpg\n')
+
+
+@override_settings(THROTTLE_RATES={'list': '100/min', 'send': '3/min', 'upload': '20/min', 'login': '2/min'})
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def _send(self, client=None):
+        return (client or self.client).post(reverse('send_message'), {'receiver': self.bob.id, 'content': 'hola'}, format='json')
+
+    def test_send_bucket_per_user(self):
+        remaining = [self._send()['X-RateLimit-Remaining'] for _ in range(3)]
+        self.assertEqual(remaining, ['2', '1', '0'])
+        response = self._send()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+        self.assertEqual(response['X-RateLimit-Limit'], '3')
+        self.assertEqual(Message.objects.count(), 3)
+
+        # Otro tipo de endpoint y otro usuario tienen sus propios cubos
+        response = self.client.get(reverse('messages'))
+        self.assertEqual((response.status_code, response['X-RateLimit-Remaining']), (200, '99'))
+        other = APIClient()
+        other.force_authenticate(self.bob)
+        self.assertEqual(self._send(other).status_code, 201)
+
+    def test_bucket_refills_over_time(self):
+        store = throttling.get_store()
+        with mock.patch('user_messages.throttling.time.time', return_value=1000.0):
+            decisions = [store.consume('throttle:test:1', 3, 20) for _ in range(4)]
+        self.assertEqual([decision.allowed for decision in decisions], [True, True, True, False])
+        self.assertEqual(decisions[-1].retry_after, 20)
+        with mock.patch('user_messages.throttling.time.time', return_value=1020.0):
+            self.assertTrue(store.consume('throttle:test:1', 3, 20).allowed)
+            self.assertFalse(store.consume('throttle:test:1', 3, 20).allowed)
+        with mock.patch('user_messages.throttling.time.time', return_value=2000.0):
+            self.assertEqual(store.consume('throttle:test:1', 3, 20).remaining, 2)
+
+    def test_login_limited_per_ip(self):
+        login = {'username': 'alice', 'password': 'mala'}
+        client = APIClient()
+        self.assertEqual(client.post(reverse('token_obtain_pair'), login).status_code, 401)
+        self.assertEqual(client.post(reverse('token_obtain_pair'), login).status_code, 401)
+        self.assertEqual(client.post(reverse('token_obtain_pair'), login).status_code, 429)
+
+    def test_login_ip_ignores_spoofed_forwarded_for(self):
+        login = {'username': 'alice', 'password': 'mala'}
+        client = APIClient()
+        rest_framework = {**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}
+        with self.settings(REST_FRAMEWORK=rest_framework):
+            # El proxy añade la IP real al final; la primera la pone el cliente
+            statuses = [
+                client.post(reverse('token_obtain_pair'), login, HTTP_X_FORWARDED_FOR=f'10.0.0.{i}, 203.0.113.7').status_code
+                for i in range(3)
+            ]
+        self.assertEqual(statuses, [401, 401, 429])
+
+    def test_async_views_share_buckets(self):
+        for _ in range(3):
+            self._send()
+        token = str(AccessToken.for_user(self.alice))
+        response = self.client.post(
+            reverse('async_send_message'), {'receiver': self.bob.id, 'content': 'hola'}, format='json',
+            headers={'Authorization': f'Bearer {token}'},
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+
+    def test_check_is_cheap(self):
+        throttling.check_rate('list', 'user:1')
+        with self.assertNumQueries(0):
+            started = time.perf_counter()
+            for i in range(1000):
+                throttling.check_rate('list', f'user:{i % 10}')
+            elapsed = time.perf_counter() - started
+        self.assertLess(elapsed / 1000, 0.001)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        Conversation.objects.record_message(Message.objects.create(sender=self.bob, receiver=self.alice, content='hola'))
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.alice)}')
+
+    def _revalidate(self, name, response):
+        return self.client.get(reverse(name), HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_inbox_not_modified_with_one_query(self):
+        response = self.client.get(reverse('messages_received'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Authorization', response['Vary'])
+        with self.assertNumQueries(1):
+            cached = self._revalidate('messages_received', response)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        self.assertEqual(cached['ETag'], response['ETag'])
+        # El buzón de enviados tiene su propio validador
+        self.assertEqual(self._revalidate('messages_sent', response).status_code, 200)
+
+    def test_inbox_etag_changes_with_messages_and_receipts(self):
+        first = self.client.get(reverse('messages_received'))
+        message = Message.objects.create(sender=self.bob, receiver=self.alice, content='otro')
+        second = self._revalidate('messages_received', first)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(len(second.data['results']), 2)
+
+        Message.objects.filter(id=message.id).update(read_at=timezone.now(), updated_at=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(self._revalidate('messages_received', second).status_code, 200)
+
+        third = self.client.get(reverse('messages_received'))
+        message.delete()
+        self.assertEqual(self._revalidate('messages_received', third).status_code, 200)
+
+    def test_sender_profile_change_refreshes_inbox_and_directory(self):
+        inbox = self.client.get(reverse('messages_received'))
+        directory = self.client.get(reverse('user_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.avatar = 'avatars/bob.png'
+            self.bob.save()
+        self.assertEqual(self._revalidate('messages_received', inbox).status_code, 200)
+        self.assertEqual(self._revalidate('user_list', directory).status_code, 200)
+
+    def test_validators_survive_cache_and_ignore_strangers(self):
+        names = ('messages_received', 'user_list', 'profile')
+        responses = {name: self.client.get(reverse(name)) for name in names}
+        # Otro proceso (u otra caché) calcula el mismo ETag
+        cache.clear()
+        for name in names:
+            self.assertEqual(self._revalidate(name, responses[name]).status_code, 304, name)
+        # Un perfil que no aparece en el buzón no lo invalida
+        carol = CustomUser.objects.create_user('carol', 'carol@example.com', 'secret123')
+        carol.avatar = 'avatars/carol.png'
+        carol.save()
+        self.assertEqual(self._revalidate('messages_received', responses['messages_received']).status_code, 304)
+        self.assertEqual(self._revalidate('user_list', responses['user_list']).status_code, 200)
+        # Las bajas también cambian el directorio, que se valida con una lectura por clave
+        directory = self.client.get(reverse('user_list'))
+        carol.delete()
+        directory = self._revalidate('user_list', directory)
+        self.assertEqual(directory.status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self._revalidate('user_list', directory).status_code, 304)
+
+    def test_profile_version_only_counts_profile_fields(self):
+        self.bob.last_login = timezone.now()
+        self.bob.save(update_fields=['last_login'])
+        self.bob.email = 'bob@example.org'
+        self.bob.save(update_fields=['email'])
+        self.assertEqual(self.bob.profile_version, 1)
+
+    def test_profile_not_modified_without_queries(self):
+        response = self.client.get(reverse('profile'))
+        with self.assertNumQueries(0):
+            cached = self._revalidate('profile', response)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(self.client.get(reverse('profile'), HTTP_IF_NONE_MATCH='*').status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.avatar = 'avatars/alice.png'
+            self.alice.save()
+        response = self._revalidate('profile', response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['avatar'].rsplit('/', 1)[-1].split('?')[0], 'alice.png')
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.s3 = storage.InMemoryS3Client()
+        storage.set_client(self.s3)
+        self.alice = CustomUser.objects.create_user('alice', 'alice@example.com', 'secret123')
+        self.bob = CustomUser.objects.create_user('bob', 'bob@example.com', 'secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def tearDown(self):
+        storage.set_client(None)
+
+    def _send(self, content, image=None, days_ago=0):
+        response = self.client.post(reverse('send_message'), {'receiver': self.bob.id, 'content': content}, format='json')
+        message_id = response.data['data']['id']
+        Message.objects.filter(id=message_id).update(sent_at=timezone.now() - timedelta(days=days_ago), image=image)
+        return message_id
+
+    def test_archives_old_messages_in_batches(self):
+        old = [self._send(f'viejo {i}', days_ago=400) for i in range(5)]
+        recent = self._send('reciente')
+        out = io.StringIO()
+        call_command('archive_messages', '--days', '365', '--batch-size', '2', stdout=out)
+        self.assertIn('5 mensajes archivados en la tabla de archivo (3 lotes)', out.getvalue())
+        self.assertEqual(list(Message.objects.values_list('id', flat=True)), [recent])
+        self.assertEqual(sorted(ArchivedMessage.objects.values_list('id', flat=True)), old)
+        self.assertEqual(ArchivedMessage.objects.get(id=old[0]).content, 'viejo 0')
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.last_message_id, recent)
+        self.assertEqual(conversation.unread_for(self.bob), 1)
+        # Archivar no es borrar: la sincronización no recibe tombstones
+        self.assertFalse(MessageTombstone.objects.exists())
+
+    def test_archive_to_storage_releases_conversation(self):
+        message_id = self._send('viejo', days_ago=400)
+        self.assertEqual(retention.archive_batch(retention.retention_cutoff(365), target=retention.STORAGE), 1)
+        self.assertFalse(Message.objects.exists())
+        conversation = Conversation.objects.get()
+        self.assertIsNone(conversation.last_message_id)
+        self.assertEqual((conversation.last_message_snippet, conversation.unread_for(self.bob)), ('viejo', 0))
+        body = self.s3.objects[(storage.bucket_name(), f'archive/messages/{message_id:012d}-{message_id:012d}.jsonl.gz')]['Body']
+        record = json.loads(gzip.decompress(body))
+        self.assertEqual((record['id'], record['content'], record['receiver_id']), (message_id, 'viejo', self.bob.id))
+        self.assertFalse(MessageTombstone.objects.exists())
+
+    def test_archiving_changes_the_listing_etag(self):
+        self._send('viejo', days_ago=400)
+        self._send('reciente')
+        etag = self.client.get(reverse('messages_sent'))['ETag']
+        retention.archive_batch(retention.retention_cutoff(365), target=retention.STORAGE)
+        response = self.client.get(reverse('messages_sent'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['content'] for row in response.data['results']], ['reciente'])
+
+    def test_purge_keeps_images_of_storage_archives(self):
+        bucket = storage.bucket_name()
+        self._send('con imagen', image='messages/1/old.webp', days_ago=400)
+        for key in ('messages/1/old.webp', 'messages/1/old_256.webp', 'messages/1/orphan.webp'):
+            self.s3.objects[(bucket, key)] = {'Body': b'x'}
+        retention.archive_batch(retention.retention_cutoff(365), target=retention.STORAGE)
+        self.assertEqual(ArchivedImage.objects.get().image, 'messages/1/old.webp')
+        self.assertEqual(retention.orphaned_image_keys(), ['messages/1/orphan.webp'])
+
+    def test_purge_orphaned_images_in_bulk(self):
+        bucket = storage.bucket_name()
+        self._send('con imagen', image='messages/1/kept.webp')
+        ArchivedMessage.objects.create(id=999, sender_id=1, receiver_id=2, content='x', image='messages/1/archived.webp', sent_at=timezone.now())
+        for key in ('messages/1/kept.webp', 'messages/1/kept_256.webp', 'messages/1/archived.webp', 'avatars/a.png'):
+            self.s3.objects[(bucket, key)] = {'Body': b'x'}
+        orphans = [f'messages/1/{i:04d}.webp' for i in range(1500)]
+        for key in orphans:
+            self.s3.objects[(bucket, key)] = {'Body': b'x'}
+        self.s3.put_object(Bucket=bucket, Key='messages/1/pending.png', Body=b'x')
+        self.s3.calls.clear()
+
+        call_command('purge_orphaned_images', stdout=io.StringIO())
+        self.assertEqual(Counter(self.s3.calls)['delete_objects'], 2)
+        self.assertNotIn('delete_object', self.s3.calls)
+        self.assertEqual(
+            sorted(key for _, key in self.s3.objects),
+            ['avatars/a.png', 'messages/1/archived.webp', 'messages/1/kept.webp', 'messages/1/kept_256.webp', 'messages/1/pending.png'],
+        )
@@ -0,0 +1,94 @@
+import math
+import time
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+# Límites por usuario (o IP sin autenticar) y tipo de endpoint con un token bucket.
+# THROTTLE_RATES: {'list': '120/min', ...} es un cubo de 120 peticiones que se rellena
+# entero en un minuto. Las vistas declaran su tipo en `throttle_scope` (str o {método: tipo}).
+
+PERIODS = {'s': 1, 'sec': 1, 'second': 1, 'm': 60, 'min': 60, 'minute': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+# allowed: si se atiende; limit/remaining: capacidad y peticiones que quedan;
+# retry_after: segundos hasta el siguiente token si se rechaza; reset: segundos hasta el cubo lleno
+Decision = namedtuple('Decision', ['allowed', 'limit', 'remaining', 'retry_after', 'reset'])
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    # '120/min' -> (capacidad, segundos por token)
+    count, period = rate.split('/')
+    count = int(count)
+    return count, PERIODS[period] / count
+
+
+class CacheThrottleStore:
+    # GCRA, equivalente a un token bucket, sobre cualquier caché de Django (locmem, Redis,
+    # Memcached): un entero por clave con el "instante teórico de llegada" (TAT) en ms.
+    # Cada petición lo adelanta con incr, y si el cubo no tenía token se devuelve con decr;
+    # ambos son atómicos en esos backends. La clave caduca cuando el cubo vuelve a estar lleno.
+    def __init__(self, cache):
+        self.cache = cache
+
+    def consume(self, key, capacity, interval):
+        now = int(time.time() * 1000)
+        step = max(int(interval * 1000), 1)
+        burst = capacity * step
+        try:
+            tat = self.cache.incr(key, step)
+        except ValueError:
+            tat = now + step
+            if not self.cache.add(key, tat, math.ceil(step / 1000) + 1):
+                tat = self.cache.incr(key, step)
+        if tat - step < now:
+            # Cubo lleno desde hace rato: se cuenta desde ahora. Dos peticiones simultáneas
+            # aquí pueden contar como una (a favor del cliente, nunca en su contra).
+            tat = now + step
+            self.cache.set(key, tat, math.ceil(step / 1000) + 1)
+        elif tat - now > burst:
+            self.cache.decr(key, step)
+            return Decision(False, capacity, 0, (tat - burst - now) / 1000, (tat - step - now) / 1000)
+        else:
+            self.cache.touch(key, math.ceil((tat - now) / 1000) + 1)
+        return Decision(True, capacity, (burst - (tat - now)) // step, 0, (tat - now) / 1000)
+
+
+def get_store():
+    return CacheThrottleStore(caches[settings.THROTTLE_CACHE_ALIAS])
+
+
+def view_scope(view, method):
+    scope = getattr(view, 'throttle_scope', None)
+    return scope.get(method) if isinstance(scope, dict) else scope
+
+
+def check_rate(scope, ident):
+    # Consume un token del cubo (scope, ident); None si el tipo no tiene límite
+    if scope is None or not settings.THROTTLE_ENABLED:
+        return None
+    rate = settings.THROTTLE_RATES.get(scope)
+    if not rate:
+        return None
+    capacity, interval = parse_rate(rate)
+    return get_store().consume(f'throttle:{scope}:{ident}', capacity, interval)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    # Throttle de DRF; deja la decisión en la petición para RateLimitHeadersMiddleware
+    decision = None
+
+    def allow_request(self, request, view):
+        user = getattr(request, 'user', None)
+        ident = f'user:{user.pk}' if user is not None and user.is_authenticated else f'ip:{self.get_ident(request)}'
+        self.decision = check_rate(view_scope(view, request.method), ident)
+        if self.decision is None:
+            return True
+        request._request.rate_limit = self.decision
+        return self.decision.allowed
+
+    def wait(self):
+        return self.decision.retry_after if self.decision else None
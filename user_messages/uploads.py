@@ -0,0 +1,84 @@
+import re
+import uuid
+
+from django.conf import settings
+
+from . import storage
+
+# Tipos de imagen aceptados y la extensión con la que se guardan
+ALLOWED_IMAGE_TYPES = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/webp': 'webp',
+    'image/gif': 'gif',
+}
+
+# Prefijo en S3 y setting con el tamaño máximo para cada tipo de subida
+UPLOAD_KINDS = {
+    'message': ('messages', 'UPLOAD_MESSAGE_IMAGE_MAX_BYTES'),
+    'avatar': ('avatars', 'UPLOAD_AVATAR_MAX_BYTES'),
+}
+
+
+class UploadError(Exception):
+    pass
+
+
+def max_size(kind):
+    return getattr(settings, UPLOAD_KINDS[kind][1])
+
+
+def _key_pattern(kind, user):
+    # Se usa con fullmatch: con match y $ pasaría una clave con un salto de línea al final
+    prefix = UPLOAD_KINDS[kind][0]
+    return re.compile(rf'{prefix}/{user.id}/[0-9a-f]{{32}}\.(?:{"|".join(ALLOWED_IMAGE_TYPES.values())})')
+
+
+def create_upload(kind, user, content_type, size=None):
+    # Paso 1: el servidor elige la clave y firma la subida directa a S3
+    if kind not in UPLOAD_KINDS:
+        raise UploadError("Tipo de subida inválido")
+    if content_type not in ALLOWED_IMAGE_TYPES:
+        raise UploadError("Tipo de archivo no permitido")
+    limit = max_size(kind)
+    if size is not None and not 0 < size <= limit:
+        raise UploadError(f"El archivo supera el tamaño máximo de {limit} bytes")
+    prefix = UPLOAD_KINDS[kind][0]
+    key = f"{prefix}/{user.id}/{uuid.uuid4().hex}.{ALLOWED_IMAGE_TYPES[content_type]}"
+    expires_in = settings.UPLOAD_URL_EXPIRES
+    post = storage.presigned_post(key, content_type, limit, expires_in)
+    return {
+        'key': key,
+        'url': post['url'],
+        'fields': post['fields'],
+        'max_size': limit,
+        'expires_in': expires_in,
+    }
+
+
+def confirm_upload(kind, user, key):
+    # Paso 2: comprueba que la clave es de este usuario y que el objeto existe en S3
+    _check_key(kind, user, key)
+    _check_head(kind, storage.head_object(key))
+    return key
+
+
+async def aconfirm_upload(kind, user, key):
+    # Igual que confirm_upload sin bloquear el bucle de eventos mientras responde S3
+    _check_key(kind, user, key)
+    _check_head(kind, await storage.ahead_object(key))
+    return key
+
+
+def _check_key(kind, user, key):
+    if not isinstance(key, str) or not _key_pattern(kind, user).fullmatch(key):
+        raise UploadError("Clave de subida inválida")
+
+
+def _check_head(kind, head):
+    if head is None:
+        raise UploadError("El archivo no se ha subido")
+    if not 0 < head.get('ContentLength', 0) <= max_size(kind):
+        raise UploadError("Tamaño de archivo no permitido")
+    if head.get('ContentType') not in ALLOWED_IMAGE_TYPES:
+        raise UploadError("Tipo de archivo no permitido")
@@ -1,20 +1,37 @@
 from django.urls import path
-from .views import RegisterView, ProtectedView, MessageListCreateView, UserListView, ReceivedMessagesView, SentMessagesView, ProfileView, SendMessageView
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from .views import LoginView, RegisterView, ProtectedView, MessageListCreateView, UserListView, ReceivedMessagesView, SentMessagesView, ProfileView, SendMessageView, ConversationListView, SyncMessagesView, UploadView, UserPickerView, RecentContactsView, ReceiptView, UnreadCountsView, MessageSearchView, BroadcastMessageView, MessageExportListView, MessageExportDetailView
+from .async_views import AsyncMessageListView, AsyncProfileView, AsyncSendMessageView
+from rest_framework_simplejwt.views import TokenRefreshView
 from django.conf import settings
 from django.conf.urls.static import static
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'), #login
+    path('token/', LoginView.as_view(), name='token_obtain_pair'), #login
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'), #renovar token
     path('protected/', ProtectedView.as_view(), name='protected/'), # ver usuario si es autenticado
     path('messages/', MessageListCreateView.as_view(), name='messages'), # ver mensajes del usuario autenticado
-    path('users/', UserListView.as_view(), name='user_list'), # lista de usuarios
+    path('users/', UserListView.as_view(), name='user_list'), # lista de usuarios (paginada, ?q= para buscar)
+    path('users/picker/', UserPickerView.as_view(), name='user_picker'), # búsqueda ligera para el selector de contactos
+    path('users/recent/', RecentContactsView.as_view(), name='user_recent'), # contactos recientes
     path('messages/received/', ReceivedMessagesView.as_view(), name='messages_received'), # mensajes recibidos del usuario (como receptor)
     path('messages/sent/', SentMessagesView.as_view(), name='messages_sent'), # mensajes enviados del usuario (como emisor)
     path('profile/', ProfileView.as_view(), name='profile'), # ver y actualizar avatar del usuario
     path('messages/send/', SendMessageView.as_view(), name='send_message'), # enviar mensaje a otro usuario
+    path('messages/broadcast/', BroadcastMessageView.as_view(), name='broadcast_message'), # envío masivo (operadores)
+    path('messages/search/', MessageSearchView.as_view(), name='messages_search'), # búsqueda de texto en el historial
+    path('messages/sync/', SyncMessagesView.as_view(), name='messages_sync'), # cambios desde un token (reconexión)
+    path('uploads/', UploadView.as_view(), name='uploads'), # subida directa a S3 (URL firmada)
+    path('exports/', MessageExportListView.as_view(), name='message_exports'), # exportaciones del historial
+    path('exports/<int:export_id>/', MessageExportDetailView.as_view(), name='message_export'), # estado y descarga
+    path('conversations/', ConversationListView.as_view(), name='conversations'), # lista de chats con el último mensaje
+    path('conversations/<int:user_id>/read/', ReceiptView.as_view(state='read'), name='conversation_read'), # marcar como leído hasta un id
+    path('conversations/<int:user_id>/delivered/', ReceiptView.as_view(state='delivered'), name='conversation_delivered'), # marcar como entregado hasta un id
+    # Versiones async (perfil ASGI) de los endpoints que más esperan a S3 y a la base de datos
+    path('async/messages/', AsyncMessageListView.as_view(), name='async_messages'),
+    path('async/messages/send/', AsyncSendMessageView.as_view(), name='async_send_message'),
+    path('async/profile/', AsyncProfileView.as_view(), name='async_profile'),
+    path('unread/', UnreadCountsView.as_view(), name='unread_counts'), # contadores de no leídos
 
 ]
 
@@ -1,21 +1,55 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.generics import ListAPIView
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework import status, generics, permissions
-from .serializers import RegisterSerializer, MessageSerializer, User, UserSerializer
-from .models import CustomUser, Message
+from .serializers import RegisterSerializer, MessageSerializer, User, UserSerializer, ConversationSerializer, UserPickerSerializer, MessageRowSerializer, MessageExportSerializer, format_local_datetime
+from .models import CustomUser, Message, MessageExport, Conversation, VersionCounter, PARTICIPANT_FIELDS
+from .pagination import MessageCursorPagination, ConversationCursorPagination, UserCursorPagination
+from .directory import recent_contacts, search_directory
+from .receipts import mark_delivered, mark_read, unread_counts
+from .broadcast import load_receivers, send_broadcast
+from .exports import start_export
+from .jobs import enqueue
+from .tasks import enqueue_image_processing
+from .realtime import notify_new_message
+from .search import search_messages
+from .sync import InvalidSyncToken, changes_since
+from .uploads import UploadError, create_upload, confirm_upload
+from .conditional import ConditionalGetMixin, message_watermark
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Q
-import boto3
+from rest_framework_simplejwt.views import TokenObtainPairView
 from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse
 from urllib.parse import quote_plus
+import hmac
+import logging
 import uuid
 
+from . import metrics, storage
+
+logger = logging.getLogger(__name__)
+
+
+def metrics_view(request):
+    # Métricas en formato de texto de Prometheus; exige la cabecera
+    # "Authorization: Bearer <METRICS_TOKEN>". Sin token solo se sirven con DEBUG.
+    token = settings.METRICS_TOKEN
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponse(status=403)
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
 class RegisterView(APIView):
+    throttle_scope = 'login'
+
     def post(self, request):
-        print(request.data)
+        # Sin la contraseña
+        logger.debug("Registro de usuario", extra={'fields': {'username': request.data.get('username')}})
         serializer = RegisterSerializer(data=request.data)
         if serializer.is_valid():
             try:
@@ -26,6 +60,11 @@ class RegisterView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class LoginView(TokenObtainPairView):
+    # Login de SimpleJWT con el límite de intentos por IP
+    throttle_scope = 'login'
+
+
 class ProtectedView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -33,50 +72,205 @@ class ProtectedView(APIView):
         return Response({"message": f"Hola, {request.user.username}. Estás autenticado"})
 
 
-class MessageListCreateView(generics.ListCreateAPIView):
+class MessageRowsMixin:
+    # Listados de mensajes con MessageRowSerializer: filas de .values_list() en lugar de
+    # instancias y la misma salida que MessageSerializer
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        ordering = getattr(self, 'keyset_ordering', None) or self.paginator.ordering
+        fields = [field.lstrip('-') for field in ordering]
+        if isinstance(queryset, list):
+            page = self.paginate_queryset([branch.rows(*fields) for branch in queryset])
+        else:
+            page = self.paginate_queryset(queryset.rows(*fields))
+        return self.get_paginated_response(MessageRowSerializer(page, context=self.get_serializer_context()).data)
+
+
+class MessageListCreateView(MessageRowsMixin, generics.ListCreateAPIView):
+    throttle_scope = {'GET': 'list', 'POST': 'send'}
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageCursorPagination
 
     def get_queryset(self):
-        # Devuelve solo los mensajes en los que el usuario está involucrado
-        user = self.request.user
-        return Message.objects.filter(Q(sender=user) | Q(receiver=user)).order_by('-sent_at')
+        # Mensajes en los que el usuario está involucrado: enviados y recibidos por separado
+        # (la paginación recorre cada rama por su índice y las mezcla)
+        return Message.objects.timeline_branches(self.request.user)
 
     def perform_create(self, serializer):
-        serializer.save(sender=self.request.user)
+        with transaction.atomic():
+            message = serializer.save(sender=self.request.user)
+            Conversation.objects.record_message(message)
+            notify_new_message(message, serializer.data)
+
+
+class MessageSearchView(MessageRowsMixin, generics.ListAPIView):
+    # GET ?q=texto: mensajes del usuario (enviados o recibidos) que coinciden, por relevancia
+    throttle_scope = 'list'
+    serializer_class = MessageSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get('q', '').strip():
+            return Response({"error": "Parámetro 'q' requerido"}, status=400)
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        queryset, self.keyset_ordering = search_messages(self.request.user, self.request.query_params['q'].strip())
+        return queryset
+
+
+class SyncMessagesView(APIView):
+    # Cambios desde un token de sincronización: mensajes nuevos/modificados y borrados
+    throttle_scope = 'list'
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', settings.API_PAGE_SIZE))
+        except ValueError:
+            return Response({"error": "Parámetro 'limit' inválido"}, status=400)
+        limit = max(1, min(limit, settings.API_MAX_PAGE_SIZE))
+        try:
+            changes = changes_since(request.user, request.query_params.get('since'), limit)
+        except InvalidSyncToken:
+            return Response({"error": "Token de sincronización inválido"}, status=400)
+        serializer = MessageSerializer(changes['messages'], many=True, context={'request': request})
+        return Response({
+            "messages": serializer.data,
+            "deleted": changes['deleted'],
+            "has_more": changes['has_more'],
+            "token": changes['token'],
+        })
+
+
+class ConversationListView(generics.ListAPIView):
+    # Lista de chats del usuario, ordenada por el último mensaje
+    throttle_scope = 'list'
+    serializer_class = ConversationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ConversationCursorPagination
+
+    def get_queryset(self):
+        return Conversation.objects.for_user(self.request.user).order_by('-last_message_at', '-id')
+
+
+class ReceiptView(APIView):
+    # POST {"up_to": id}: marca como entregados/leídos los mensajes recibidos de user_id hasta ese id
+    permission_classes = [IsAuthenticated]
+    state = 'read'
+
+    def post(self, request, user_id):
+        try:
+            up_to = int(request.data.get('up_to'))
+        except (TypeError, ValueError):
+            return Response({"error": "Parámetro 'up_to' inválido"}, status=400)
+        mark = mark_read if self.state == 'read' else mark_delivered
+        count, at = mark(request.user, user_id, up_to)
+        return Response({"updated": count, f"{self.state}_at": format_local_datetime(at)})
+
 
+class UnreadCountsView(APIView):
+    # Contadores de no leídos (total y por conversación) para los badges
+    permission_classes = [IsAuthenticated]
 
-class UserListView(ListAPIView):
+    def get(self, request):
+        return Response(unread_counts(request.user))
+
+
+class UserListView(ConditionalGetMixin, ListAPIView):
+    # Directorio paginado; ?q= busca por prefijo/subcadena en username y email
+    throttle_scope = 'list'
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = UserCursorPagination
+    fields = ('id', 'username', 'email', 'avatar', 'avatar_processed')
+
+    def get_etag_parts(self, request):
+        # Sube con cada alta, baja o edición de perfil; la búsqueda y el cursor van en la URL
+        return (VersionCounter.objects.value(VersionCounter.DIRECTORY),)
 
     def get_queryset(self):
-        user = self.request.user
-        # TODO ATENCION NOMBRE MODIFICABLE ADMIN
-        return User.objects.exclude(id=user.id).exclude(username='admin')
+        queryset, self.keyset_ordering = search_directory(self.request.user, self.request.query_params.get('q'), self.fields)
+        return queryset
+
+
+class UserPickerView(UserListView):
+    serializer_class = UserPickerSerializer
+    fields = PARTICIPANT_FIELDS
+
+
+class RecentContactsView(APIView):
+    # Contactos ordenados por el último mensaje intercambiado
+    throttle_scope = 'list'
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', settings.DIRECTORY_RECENT_CONTACTS))
+        except ValueError:
+            return Response({"error": "Parámetro 'limit' inválido"}, status=400)
+        limit = max(1, min(limit, settings.API_MAX_PAGE_SIZE))
+        contacts = recent_contacts(request.user, limit)
+        serializer = UserPickerSerializer([user for user, _ in contacts], many=True, context={'request': request})
+        results = [
+            {**row, 'last_message_at': format_local_datetime(last_message_at)}
+            for row, (_, last_message_at) in zip(serializer.data, contacts)
+        ]
+        return Response({"results": results})
 
 
-class ReceivedMessagesView(generics.ListAPIView):
+class ReceivedMessagesView(ConditionalGetMixin, MessageRowsMixin, generics.ListAPIView):
+    throttle_scope = 'list'
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageCursorPagination
+    watermark_role = 'receiver'
+
+    def get_etag_parts(self, request):
+        # Mensajes nuevos, editados, con acuse, borrados o archivados, y perfiles de los que aparecen en ellos
+        return (*message_watermark(request.user.id, self.watermark_role), request.user.profile_version)
 
     def get_queryset(self):
         user = self.request.user
-        return Message.objects.filter(receiver=user).order_by('-sent_at')
+        return Message.objects.received_by(user).order_by('-sent_at', '-id')
 
 
-class SentMessagesView(generics.ListAPIView):
-    serializer_class = MessageSerializer
-    permission_classes = [permissions.IsAuthenticated]
+class SentMessagesView(ReceivedMessagesView):
+    watermark_role = 'sender'
 
     def get_queryset(self):
         user = self.request.user
-        return Message.objects.filter(sender=user).order_by('-sent_at')
+        return Message.objects.sent_by(user).order_by('-sent_at', '-id')
+
+
+class UploadView(APIView):
+    # Paso 1 de la subida directa: devuelve un POST firmado a S3 con clave elegida por el servidor.
+    # Paso 2: enviar la clave como 'image_key' (messages/send/) o 'avatar_key' (profile/).
+    throttle_scope = 'upload'
+    permission_classes = [permissions.IsAuthenticated]
 
+    def post(self, request):
+        size = request.data.get('size')
+        try:
+            size = int(size) if size not in (None, '') else None
+        except (TypeError, ValueError):
+            return Response({"error": "Parámetro 'size' inválido"}, status=400)
+        try:
+            upload = create_upload(request.data.get('kind'), request.user, request.data.get('content_type'), size)
+        except UploadError as e:
+            return Response({"error": str(e)}, status=400)
+        return Response(upload, status=201)
 
-class ProfileView(APIView):
+
+class ProfileView(ConditionalGetMixin, APIView):
+    throttle_scope = {'PUT': 'upload'}
     permission_classes = [permissions.IsAuthenticated]
-    parser_classes = [MultiPartParser, FormParser]
+    parser_classes = [MultiPartParser, FormParser, JSONParser]
+
+    def get_etag_parts(self, request):
+        return (request.user.profile_version,)
 
     def get(self, request):
         serializer = UserSerializer(request.user, context={'request': request})
@@ -85,40 +279,17 @@ class ProfileView(APIView):
     def put(self, request):
         user = request.user
         avatar_file = request.FILES.get("avatar")
+        avatar_key = request.data.get("avatar_key")
 
-        if avatar_file:
-            # Subida a S3
-            s3 = boto3.client(
-                's3',
-                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                region_name=settings.AWS_S3_REGION_NAME
-            )
-            if user.avatar and user.avatar.name:
-                try:
-                    s3.delete_object(
-                        Bucket=settings.AWS_STORAGE_BUCKET_NAME,
-                        Key=user.avatar.name
-                    )
-                except Exception as e:
-                    print(f"⚠️ Error al borrar el avatar anterior: {e}")
-            # Construye nombre único: username_nombrearchivo.png
-            safe_username = quote_plus(user.username)
-            safe_filename = quote_plus(avatar_file.name)
-            s3_key = f"avatars/{safe_username}_{safe_filename}"
-            s3.upload_fileobj(
-                avatar_file.file,
-                settings.AWS_STORAGE_BUCKET_NAME,
-                s3_key,
-                ExtraArgs={
-                    "ContentType": avatar_file.content_type,
-                    "ContentDisposition": "inline",
-                }
-            )
-            # Asigna nombre manualmente al avatar en el modelo
-            print(">>> Avatar file name:", avatar_file.name)
-            user.avatar.name = s3_key
-            user.save()
+        if avatar_key:
+            # Confirmación de una subida directa a S3 (POST /api/uploads/)
+            try:
+                confirm_upload('avatar', user, avatar_key)
+            except UploadError as e:
+                return Response({"error": str(e)}, status=400)
+            set_uploaded_avatar(user, avatar_key)
+        elif avatar_file:
+            set_avatar_file(user, avatar_file)
         serializer = UserSerializer(user, context={'request': request})
         return Response({
             "message": "Perfil actualizado correctamente",
@@ -126,55 +297,180 @@ class ProfileView(APIView):
         })
 
 
+def set_uploaded_avatar(user, avatar_key):
+    # Avatar ya subido y confirmado en S3: se procesa en segundo plano
+    with transaction.atomic():
+        replace_avatar(user, avatar_key)
+        enqueue_image_processing('avatar', avatar_key, user.id)
+
+
+def set_avatar_file(user, avatar_file):
+    # Subida multipart: se envía a S3 en la petición (el worker corre en otra máquina y no ve
+    # los archivos temporales de esta); el procesado y el borrado del anterior van a la cola.
+    # Construye nombre único: username_nombrearchivo.png
+    safe_username = quote_plus(user.username)
+    safe_filename = quote_plus(avatar_file.name)
+    s3_key = f"avatars/{safe_username}_{safe_filename}"
+    logger.debug("Avatar recibido", extra={'fields': {'user': user.id, 'file': avatar_file.name, 'key': s3_key}})
+    storage.upload_fileobj(avatar_file, s3_key, avatar_file.content_type)
+    set_uploaded_avatar(user, s3_key)
+
+
+def replace_avatar(user, s3_key):
+    previous = user.avatar.name if user.avatar else None
+    with transaction.atomic():
+        # Asigna nombre manualmente al avatar en el modelo
+        user.avatar.name = s3_key
+        user.avatar_processed = False
+        user.save()
+        if previous and previous != s3_key:
+            # El borrado del avatar anterior en S3 lo hace el worker
+            enqueue('storage.delete_avatar', {'key': previous})
+
+
+def message_image(request):
+    # Clave S3 de la imagen del mensaje, si la hay.
+    # image_key: ya subida directamente a S3 (POST /api/uploads/); image: multipart.
+    image_key = request.data.get('image_key')
+    if image_key:
+        return confirm_upload('message', request.user, image_key)
+    image_file = request.FILES.get('image')
+    if image_file:
+        return upload_message_image(image_file)
+    return None
+
+
+def new_message_image_key(image_file):
+    # 🆔 Generar nombre único: uuid.uuid4().hex
+    ext = image_file.name.split('.')[-1]
+    unique_name = f"{uuid.uuid4().hex}.{ext}"
+    return f"messages/{unique_name}"
+
+
+def upload_message_image(image_file):
+    # Subida multipart: se envía a S3 en la petición, antes de crear el mensaje (el worker no
+    # ve los archivos temporales de esta máquina); devuelve la clave
+    image_s3_key = new_message_image_key(image_file)
+    storage.upload_fileobj(image_file, image_s3_key, image_file.content_type)
+    return image_s3_key
+
+
+def create_message(request, sender, receiver, content, image_s3_key=None):
+    # Crear mensaje (un único INSERT, con la imagen incluida) y actualizar el
+    # resumen de la conversación en la misma transacción; devuelve el mensaje serializado
+    with transaction.atomic():
+        message = Message.objects.create(
+            sender=sender,
+            receiver=receiver,
+            content=content,
+            image=image_s3_key,
+        )
+        if image_s3_key:
+            enqueue_image_processing('message', image_s3_key, message.id)
+        Conversation.objects.record_message(message)
+        serializer = MessageSerializer(message, context={'request': request})
+        notify_new_message(message, serializer.data)
+    return serializer.data
+
+
 class SendMessageView(APIView):
+    throttle_scope = 'send'
     permission_classes = [permissions.IsAuthenticated]
-    parser_classes = [MultiPartParser, FormParser]
+    parser_classes = [MultiPartParser, FormParser, JSONParser]
 
     def post(self, request):
         user = request.user
         receiver_id = request.data.get('receiver')
         content = request.data.get('content')
-        image_file = request.FILES.get('image')
         if not receiver_id or not content:
             return Response({"error": "Campos 'receiver' y 'content' son obligatorios"}, status=400)
         try:
-            receiver = CustomUser.objects.get(id=receiver_id)
+            receiver = CustomUser.objects.only(*PARTICIPANT_FIELDS).get(id=receiver_id)
         except CustomUser.DoesNotExist:
             return Response({"error": "El receptor no existe"}, status=404)
-        image_s3_key = None
-        if image_file:
-            # Subida a S3
-            s3 = boto3.client(
-                's3',
-                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                region_name=settings.AWS_S3_REGION_NAME
-            )
-            # 🆔 Generar nombre único: uuid.uuid4().hex
-            ext = image_file.name.split('.')[-1]
-            unique_name = f"{uuid.uuid4().hex}.{ext}"
-            s3_key = f"messages/{unique_name}"
-            s3.upload_fileobj(
-                image_file.file,
-                settings.AWS_STORAGE_BUCKET_NAME,
-                s3_key,
-                ExtraArgs={
-                    "ContentType": image_file.content_type,
-                    "ContentDisposition": "inline",
-                }
-            )
-            image_s3_key = s3_key
-        # Crear mensaje en la base de datos
-        message = Message.objects.create(
-            sender=user,
-            receiver=receiver,
-            content=content,
-        )
-        if image_s3_key:
-            message.image = image_s3_key
-            message.save()
-        serializer = MessageSerializer(message, context={'request': request})
+        try:
+            image_s3_key = message_image(request)
+        except UploadError as e:
+            return Response({"error": str(e)}, status=400)
+        data = create_message(request, user, receiver, content, image_s3_key)
         return Response({
             "message": "Mensaje enviado correctamente",
-            "data": serializer.data
+            "data": data
+        }, status=201)
+
+
+class BroadcastMessageView(APIView):
+    # Envío masivo (solo operadores): el mismo contenido/imagen a una lista de
+    # receptores ({"receivers": [ids]}) o a los usuarios del directorio ({"filter": {"q": ...}})
+    throttle_scope = 'send'
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser, FormParser, JSONParser]
+
+    def post(self, request):
+        content = request.data.get('content')
+        if not content:
+            return Response({"error": "El campo 'content' es obligatorio"}, status=400)
+        if 'filter' in request.data:
+            user_filter = request.data.get('filter')
+            if not isinstance(user_filter, dict):
+                return Response({"error": "Parámetro 'filter' inválido"}, status=400)
+            queryset, _ = search_directory(request.user, user_filter.get('q'), PARTICIPANT_FIELDS)
+            receivers = list(queryset.order_by('id'))
+            missing = []
+        else:
+            # JSON: lista de ids; formulario: receivers repetido
+            raw_ids = request.data.getlist('receivers') if hasattr(request.data, 'getlist') else request.data.get('receivers', [])
+            try:
+                if not isinstance(raw_ids, list):
+                    raise TypeError
+                receiver_ids = list(dict.fromkeys(int(receiver_id) for receiver_id in raw_ids))
+            except (TypeError, ValueError):
+                return Response({"error": "Parámetro 'receivers' inválido"}, status=400)
+            if not receiver_ids:
+                return Response({"error": "Campos 'receivers' o 'filter' son obligatorios"}, status=400)
+            found = load_receivers(receiver_ids)
+            receivers = [found[receiver_id] for receiver_id in receiver_ids if receiver_id in found]
+            missing = [receiver_id for receiver_id in receiver_ids if receiver_id not in found]
+        try:
+            image_s3_key = message_image(request)
+        except UploadError as e:
+            return Response({"error": str(e)}, status=400)
+
+        with transaction.atomic():
+            messages = send_broadcast(request.user, receivers, content, image_s3_key, request)
+            if image_s3_key and messages:
+                # Una sola imagen compartida: se procesa una vez para todos los mensajes
+                enqueue_image_processing('message', image_s3_key, messages[0].id)
+        return Response({
+            "message": "Mensajes enviados correctamente",
+            "sent": len(messages),
+            "results": [{"receiver": message.receiver_id, "id": message.id} for message in messages]
+            + [{"receiver": receiver_id, "error": "El receptor no existe"} for receiver_id in missing],
         }, status=201)
+
+
+class MessageExportListView(APIView):
+    # GET: últimas exportaciones del usuario. POST {"format": "jsonl"|"zip"}: exporta todo
+    # su historial en segundo plano (o devuelve la que ya está en marcha)
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        exports = MessageExport.objects.filter(user=request.user).order_by('-created_at', '-id')[:20]
+        return Response({"results": MessageExportSerializer(exports, many=True).data})
+
+    def post(self, request):
+        export_format = request.data.get('format', MessageExport.JSONL)
+        if export_format not in dict(MessageExport.FORMAT_CHOICES):
+            return Response({"error": "Parámetro 'format' inválido"}, status=400)
+        export, created = start_export(request.user, export_format)
+        return Response(MessageExportSerializer(export).data, status=202 if created else 200)
+
+
+class MessageExportDetailView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, export_id):
+        export = MessageExport.objects.filter(id=export_id, user=request.user).first()
+        if export is None:
+            return Response({"error": "La exportación no existe"}, status=404)
+        return Response(MessageExportSerializer(export).data)